@@ -112,7 +112,7 @@ def create_app(config_class: type = Config) -> Flask:
         scheduler.init_app(app)
         scheduler.start()
 
-    PrometheusMetrics(app, registry=CollectorRegistry())
+    app.metrics = PrometheusMetrics(app, registry=CollectorRegistry())
 
     app.redis = Redis.from_url(app.config['REDIS_URL'])
     app.task_queue = rq.Queue('expenseapp-tasks', connection=app.redis)
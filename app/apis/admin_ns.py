@@ -61,7 +61,7 @@ task_list_model = api.model('TaskList', {
 })
 
 launch_task_model = api.model('LaunchTaskInput', {
-    'key': fields.String(required=True, description='Task key (WASTE_TIME, CHECK_CURRENCIES, UPDATE_CURRENCIES, TYPE_ERROR)'),
+    'key': fields.String(required=True, description='Task key (WASTE_TIME, CHECK_CURRENCIES, UPDATE_CURRENCIES, SCRUB_STORAGE, TYPE_ERROR)'),
     'amount': fields.Integer(description='Amount parameter (for WASTE_TIME / TYPE_ERROR)'),
     'source': fields.String(description='Source parameter (for UPDATE_CURRENCIES)'),
 })
@@ -12,6 +12,8 @@ from werkzeug.exceptions import Forbidden
 from app import db
 from app.apis.auth import token_auth
 from app.apis.errors import bad_request
+from app.models import SETTLEMENT_MODE_ACCOUNTANT, SETTLEMENT_MODES
+from app.rates import EventRates
 from app.services import event_service
 
 api = Namespace('events', description='Event operations')
@@ -28,6 +30,7 @@ event_model = api.model('Event', {
     'description': fields.String(description='Event description'),
     'fileshare_link': fields.String(description='File sharing link'),
     'exchange_fee': fields.Float(description='Exchange fee percentage'),
+    'settlement_mode': fields.String(description='Settlement planner: accountant or minimal'),
     'base_currency_code': fields.String(description='Base currency code'),
     'admin_username': fields.String(description='Event admin username'),
     'accountant_username': fields.String(description='Event accountant username'),
@@ -48,6 +51,8 @@ event_input = api.model('EventInput', {
     'base_currency_id': fields.Integer(required=True, description='Base currency ID'),
     'currency_ids': fields.List(fields.Integer, required=True, description='Currency IDs'),
     'exchange_fee': fields.Float(required=True, description='Exchange fee %'),
+    'settlement_mode': fields.String(description='Settlement planner: accountant or minimal',
+                                     default=SETTLEMENT_MODE_ACCOUNTANT),
     'fileshare_link': fields.String(description='File sharing link', default=''),
     'description': fields.String(description='Description', default=''),
 })
@@ -59,6 +64,7 @@ event_update_input = api.model('EventUpdateInput', {
     'currency_ids': fields.List(fields.Integer, required=True, description='Currency IDs'),
     'exchange_fee': fields.Float(required=True, description='Exchange fee %'),
     'accountant_id': fields.Integer(required=True, description='Accountant EventUser ID'),
+    'settlement_mode': fields.String(description='Settlement planner: accountant or minimal'),
     'fileshare_link': fields.String(description='File sharing link', default=''),
     'description': fields.String(description='Description', default=''),
 })
@@ -224,8 +230,12 @@ def _get_eventuser_guid() -> str | None:
     return request.headers.get('X-EventUser-GUID')
 
 
-def _event_to_dict(event: object) -> dict:
-    """Serialise an Event model to a dict."""
+def _event_to_dict(event: object, card: event_service.EventCard | None = None) -> dict:
+    """Serialise an Event model to a dict.
+
+    Pass the event's *card* from :func:`event_service.load_event_cards` when
+    serialising a list of events to reuse its batch-loaded stats and image.
+    """
     return {
         'guid': str(event.guid),
         'name': event.name,
@@ -234,11 +244,12 @@ def _event_to_dict(event: object) -> dict:
         'description': event.description or '',
         'fileshare_link': event.fileshare_link or '',
         'exchange_fee': event.exchange_fee,
+        'settlement_mode': event.settlement_mode or SETTLEMENT_MODE_ACCOUNTANT,
         'base_currency_code': event.base_currency.code if event.base_currency else None,
         'admin_username': event.admin.username if event.admin else None,
         'accountant_username': event.accountant.username if event.accountant else None,
-        'stats': event.get_stats(),
-        'image_url': event.avatar(256),
+        'stats': card.stats if card is not None else event.get_stats(),
+        'image_url': card.image_url if card is not None else event.avatar(256),
     }
 
 
@@ -256,13 +267,21 @@ def _eventuser_to_dict(eu: object) -> dict:
     }
 
 
-def _expense_to_dict(expense: object) -> dict:
-    """Serialise an Expense model to a dict."""
+def _expense_to_dict(expense: object, rates: EventRates | None = None) -> dict:
+    """Serialise an Expense model to a dict.
+
+    Pass the event's *rates* when serialising a list of expenses so that
+    amounts are converted and formatted without further queries.
+    """
+    if rates is not None:
+        currency_code = rates.code(expense.currency_id)
+    else:
+        currency_code = expense.currency.code if expense.currency else None
     return {
         'guid': str(expense.guid),
         'amount': expense.amount,
-        'amount_str': expense.get_amount_str(),
-        'currency_code': expense.currency.code if expense.currency else None,
+        'amount_str': expense.get_amount_str(rates),
+        'currency_code': currency_code,
         'date': expense.date.isoformat() if expense.date else None,
         'description': expense.description or '',
         'user_username': expense.user.username if expense.user else None,
@@ -270,13 +289,20 @@ def _expense_to_dict(expense: object) -> dict:
     }
 
 
-def _settlement_to_dict(settlement: object) -> dict:
-    """Serialise a Settlement model to a dict."""
+def _settlement_to_dict(settlement: object, rates: EventRates | None = None) -> dict:
+    """Serialise a Settlement model to a dict.
+
+    Pass the event's *rates* when serialising a list of settlements.
+    """
+    if rates is not None:
+        currency_code = rates.code(settlement.currency_id)
+    else:
+        currency_code = settlement.currency.code if settlement.currency else None
     return {
         'guid': str(settlement.guid),
         'amount': settlement.amount,
-        'amount_str': settlement.get_amount_str(),
-        'currency_code': settlement.currency.code if settlement.currency else None,
+        'amount_str': settlement.get_amount_str(rates),
+        'currency_code': currency_code,
         'sender_username': settlement.sender.username if settlement.sender else None,
         'recipient_username': settlement.recipient.username if settlement.recipient else None,
         'draft': settlement.draft,
@@ -337,7 +363,10 @@ class EventList(Resource):
             per_page=per_page,
         )
         return {
-            'items': [_event_to_dict(e) for e in result.items],
+            'items': [
+                _event_to_dict(card.event, card)
+                for card in event_service.load_event_cards(result.items, 256)
+            ],
             'total': result.total,
             'has_next': result.has_next,
             'has_prev': result.has_prev,
@@ -353,6 +382,9 @@ class EventList(Resource):
         for field in ('name', 'date', 'base_currency_id', 'currency_ids', 'exchange_fee'):
             if field not in data:
                 return bad_request(f'{field} is required')
+        settlement_mode = data.get('settlement_mode') or SETTLEMENT_MODE_ACCOUNTANT
+        if settlement_mode not in SETTLEMENT_MODES:
+            return bad_request(f'settlement_mode must be one of {", ".join(SETTLEMENT_MODES)}')
 
         try:
             event_date = datetime.fromisoformat(data['date'])
@@ -369,6 +401,7 @@ class EventList(Resource):
             fileshare_link=data.get('fileshare_link', ''),
             description=data.get('description', ''),
             created_by=g.current_user.username,
+            settlement_mode=settlement_mode,
         )
         return _event_to_dict(result.event), 201
 
@@ -399,6 +432,9 @@ class EventDetail(Resource):
         for field in ('name', 'date', 'base_currency_id', 'currency_ids', 'exchange_fee', 'accountant_id'):
             if field not in data:
                 return bad_request(f'{field} is required')
+        settlement_mode = data.get('settlement_mode')
+        if settlement_mode is not None and settlement_mode not in SETTLEMENT_MODES:
+            return bad_request(f'settlement_mode must be one of {", ".join(SETTLEMENT_MODES)}')
 
         try:
             event_date = datetime.fromisoformat(data['date'])
@@ -415,6 +451,7 @@ class EventDetail(Resource):
             exchange_fee=data['exchange_fee'],
             accountant_id=data['accountant_id'],
             currency_ids=data['currency_ids'],
+            settlement_mode=settlement_mode,
         )
         return _event_to_dict(result.event)
 
@@ -638,8 +675,9 @@ class ExpenseList(Resource):
             filter_own=filter_own,
             per_page=per_page,
         )
+        rates = event.get_rates()
         return {
-            'items': [_expense_to_dict(e) for e in result.items],
+            'items': [_expense_to_dict(e, rates) for e in result.items],
             'total': result.total,
             'has_next': result.has_next,
             'has_prev': result.has_prev,
@@ -806,8 +844,9 @@ class SettlementList(Resource):
         draft = draft_str.lower() == 'true'
 
         result = event_service.list_settlements(event, page, draft=draft, per_page=per_page)
+        rates = event.get_rates()
         return {
-            'items': [_settlement_to_dict(s) for s in result.items],
+            'items': [_settlement_to_dict(s, rates) for s in result.items],
             'total': result.total,
             'has_next': result.has_next,
             'has_prev': result.has_prev,
@@ -964,8 +1003,14 @@ class EventBalance(Resource):
     @token_auth.login_required
     @api.marshal_with(balance_model)
     def get(self, guid: str) -> dict:
-        """Recalculate the balance and return per-user balances and draft settlements."""
-        result = event_service.get_balance(guid)
+        """Return per-user balances and draft settlements.
+
+        Draft settlements are only rewritten if they no longer match the
+        balance.  Query param: ``recalculate`` (true/false) regenerates all
+        drafts.
+        """
+        recalculate = request.args.get('recalculate', 'false').lower() == 'true'
+        result = event_service.get_balance(guid, recalculate=recalculate)
         balances = []
         for row in result.balances_str:
             balances.append({
@@ -979,7 +1024,7 @@ class EventBalance(Resource):
         return {
             'balances': balances,
             'total_expenses': result.total_expenses_str,
-            'draft_settlements': [_settlement_to_dict(s) for s in result.draft_settlements],
+            'draft_settlements': [_settlement_to_dict(s, result.rates) for s in result.draft_settlements],
         }
 
 
@@ -1103,7 +1148,8 @@ class EventPicture(Resource):
         if 'image' not in request.files or request.files['image'].filename == '':
             return bad_request('No image file provided')
         file_obj = request.files['image']
-        image = event_service.update_event_picture(guid, file_obj.stream, file_obj.filename)
+        image = event_service.update_event_picture(guid, file_obj.stream, file_obj.filename,
+                                                   uploader=g.current_user)
         return {'guid': image.guid, 'url': image.get_url(), 'width': image.width, 'height': image.height}, 201
 
 
@@ -1118,7 +1164,8 @@ class EventUserPicture(Resource):
         if 'image' not in request.files or request.files['image'].filename == '':
             return bad_request('No image file provided')
         file_obj = request.files['image']
-        image = event_service.update_event_user_picture(user_guid, file_obj.stream, file_obj.filename)
+        image = event_service.update_event_user_picture(user_guid, file_obj.stream, file_obj.filename,
+                                                        uploader=g.current_user)
         return {'guid': image.guid, 'url': image.get_url(), 'width': image.width, 'height': image.height}, 201
 
 
@@ -1133,5 +1180,6 @@ class ExpenseReceipt(Resource):
         if 'image' not in request.files or request.files['image'].filename == '':
             return bad_request('No image file provided')
         file_obj = request.files['image']
-        image = event_service.add_receipt(expense_guid, file_obj.stream, file_obj.filename)
+        image = event_service.add_receipt(expense_guid, file_obj.stream, file_obj.filename,
+                                          uploader=g.current_user)
         return {'guid': image.guid, 'url': image.get_url(), 'width': image.width, 'height': image.height}, 201
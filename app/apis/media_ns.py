@@ -3,12 +3,10 @@
 
 from __future__ import annotations
 
-from io import BytesIO
-
-from flask import send_file
 from flask_restx import Namespace, Resource, fields
 
 from app.apis.auth import token_auth
+from app.media.serving import send_media_file
 from app.services import main_service, media_service
 
 api = Namespace('media', description='Media file operations')
@@ -58,20 +56,33 @@ class FileServe(Resource):
     def get(self, file_id: int) -> object:
         """Serve the raw file content with appropriate MIME type.
 
-        Uses Redis caching (24h TTL) and browser caching (1 year).
+        Supports ``Range`` and ``If-None-Match`` (strong ETag from the file
+        hash) and browser caching (1 year).
         No authentication required — files are referenced by opaque ID.
         """
-        result = media_service.get_file_bytes(file_id)
-        if result is None:
+        response = send_media_file(file_id)
+        if response is None:
             api.abort(404, 'File not found')
+        return response
+
+
+@api.route('/files/<int:file_id>/w/<int:width>')
+class FileVariant(Resource):
+    """Serve an image file resized to a requested size."""
+
+    def get(self, file_id: int, width: int) -> object:
+        """Serve the image resized to fit *width* × *width* pixels.
 
-        return send_file(
-            BytesIO(result.file_bytes),
-            mimetype=result.mime_type,
-            as_attachment=False,
-            download_name=result.original_filename,
-            max_age=31536000,
-        )
+        The variant is generated on first request and cached in storage;
+        sizes at or above the original return the original.  Only the
+        configured variant sizes are served, and only with THUMBNAIL_VARIANTS.
+        No authentication required — files are referenced by opaque ID.
+        """
+        variant_id = media_service.get_variant_file_id(file_id, width)
+        response = send_media_file(variant_id) if variant_id is not None else None
+        if response is None:
+            api.abort(404, 'File not found')
+        return response
 
 
 @api.route('/images/<guid>')
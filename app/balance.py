@@ -0,0 +1,327 @@
+"""Balance engine: compute every participant's event balance in a single pass.
+
+The per-user helpers on :class:`~app.models.Event` (``get_amount_paid`` and
+friends) issue several queries per participant and reload every expense for
+each of them.  This module instead loads an event's expenses, affected-user
+links, confirmed settlements and currency rates in a fixed number of bulk
+queries and aggregates them with NumPy arrays indexed by event user.
+
+:func:`compute_balance_sheet_sql` is an alternative backend that pushes the
+aggregation into ``GROUP BY`` queries so that only one row per participant
+leaves the database.  :func:`build_balance_sheet` picks the backend based on
+``BALANCE_SQL_THRESHOLD``.
+"""
+
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, field
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, case, exists, func, literal
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.rates import EventRates
+
+if TYPE_CHECKING:
+    from app.models import Event, EventUser
+
+
+@dataclass
+class BalanceSheet:
+    """Per-participant totals of an event, expressed in its base currency.
+
+    All arrays share the row order of :attr:`eventusers`.
+    """
+
+    eventusers: list[EventUser]
+    paid: np.ndarray
+    spent: np.ndarray
+    sent: np.ndarray
+    received: np.ndarray
+    total_expenses: float
+    _index: dict[int, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._index = {u.id: i for i, u in enumerate(self.eventusers)}
+
+    @property
+    def balance(self) -> np.ndarray:
+        """Net balance per participant (positive means the event owes them)."""
+        return self.paid - self.spent + self.sent - self.received
+
+    def rows(self) -> list[tuple[EventUser, float, float, float, float, float]]:
+        """Return *(user, paid, spent, sent, received, balance)* for every participant."""
+        return [self._row(i) for i in range(len(self.eventusers))]
+
+    def get_user_balance(self, user: EventUser) -> tuple[EventUser, float, float, float, float, float]:
+        """Return the balance row of *user*, or zeros if *user* is not a participant."""
+        i = self._index.get(user.id)
+        if i is None:
+            return (user, 0.0, 0.0, 0.0, 0.0, 0.0)
+        return self._row(i)
+
+    def _row(self, i: int) -> tuple[EventUser, float, float, float, float, float]:
+        paid, spent = float(self.paid[i]), float(self.spent[i])
+        sent, received = float(self.sent[i]), float(self.received[i])
+        return (self.eventusers[i], paid, spent, sent, received, paid - spent + sent - received)
+
+
+def get_conversion_factors(event: Event) -> dict[int, float]:
+    """Return *currency_id → factor* converting amounts into the base currency.
+
+    Mirrors :meth:`EventCurrency.get_amount_in`: the base currency converts
+    1:1, every other currency is converted via its event rate and charged the
+    event's exchange fee.
+    """
+    return EventRates.for_event(event).factors
+
+
+def ensure_convertible(event: Event, currency_ids: Iterable[int | None], factors: dict[int, float]) -> None:
+    """Raise :class:`ValueError` if any of *currency_ids* has no conversion factor.
+
+    Amounts in a currency the event has no rate for cannot be expressed in
+    the base currency.  Every balance backend, and the ledger, refuses them
+    rather than dropping them or counting them as zero, like
+    :meth:`~app.models.Event.convert_currencies_to_base` does.
+    """
+    missing = {currency_id for currency_id in currency_ids if currency_id not in factors}
+    if missing:
+        raise ValueError(f'Event {event.guid} has amounts in currencies without an exchange rate: '
+                         f'{sorted(missing, key=str)}')
+
+
+def _accumulate(rows: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Sum *values* into *size* buckets by *rows*, ignoring rows marked ``-1``."""
+    mask = rows >= 0
+    return np.bincount(rows[mask], weights=values[mask], minlength=size).astype(float)
+
+
+def compute_balance_sheet(event: Event) -> BalanceSheet:
+    """Compute the :class:`BalanceSheet` of *event* in a fixed number of queries."""
+    from app.models import EventUser, Expense, Settlement, expense_affected_users
+
+    with db.session.no_autoflush:
+        eventusers = event.users.all()
+        factors = get_conversion_factors(event)
+
+        expenses = (
+            db.session.query(Expense.id, Expense.user_id, Expense.currency_id, Expense.amount)
+            .filter(Expense.event_id == event.id)
+            .all()
+        )
+        links = (
+            db.session.query(
+                expense_affected_users.c.expense_id,
+                expense_affected_users.c.user_id,
+                EventUser.weighting,
+            )
+            .join(Expense, Expense.id == expense_affected_users.c.expense_id)
+            .join(EventUser, EventUser.id == expense_affected_users.c.user_id)
+            .filter(Expense.event_id == event.id)
+            .all()
+        )
+        settlements = (
+            db.session.query(
+                Settlement.sender_id, Settlement.recipient_id,
+                Settlement.currency_id, Settlement.amount,
+            )
+            .filter(Settlement.event_id == event.id, Settlement.draft == False)  # noqa: E712
+            .all()
+        )
+    ensure_convertible(event, [row.currency_id for row in (*expenses, *settlements)], factors)
+
+    n_users = len(eventusers)
+    user_index = {u.id: i for i, u in enumerate(eventusers)}
+    expense_index = {row.id: i for i, row in enumerate(expenses)}
+
+    # Expenses converted to the base currency, indexed by expense row.
+    expense_amounts = np.array(
+        [(row.amount or 0) * factors[row.currency_id] for row in expenses], dtype=float,
+    )
+    payer_rows = np.array([user_index.get(row.user_id, -1) for row in expenses], dtype=int)
+    paid = _accumulate(payer_rows, expense_amounts, n_users)
+
+    # Weighted share of every affected user in every expense.
+    link_expenses = np.array([expense_index[row.expense_id] for row in links], dtype=int)
+    link_users = np.array([user_index.get(row.user_id, -1) for row in links], dtype=int)
+    link_weights = np.array([row.weighting or 0 for row in links], dtype=float)
+    total_weights = np.bincount(link_expenses, weights=link_weights, minlength=len(expenses))
+    link_totals = total_weights[link_expenses]
+    shares = np.divide(
+        link_weights * expense_amounts[link_expenses], link_totals,
+        out=np.zeros_like(link_weights), where=link_totals > 0,
+    )
+    spent = _accumulate(link_users, shares, n_users)
+
+    # Confirmed settlements converted to the base currency.
+    settlement_amounts = np.array(
+        [(row.amount or 0) * factors[row.currency_id] for row in settlements], dtype=float,
+    )
+    sender_rows = np.array([user_index.get(row.sender_id, -1) for row in settlements], dtype=int)
+    recipient_rows = np.array([user_index.get(row.recipient_id, -1) for row in settlements], dtype=int)
+    sent = _accumulate(sender_rows, settlement_amounts, n_users)
+    received = _accumulate(recipient_rows, settlement_amounts, n_users)
+
+    return BalanceSheet(
+        eventusers=eventusers,
+        paid=paid,
+        spent=spent,
+        sent=sent,
+        received=received,
+        total_expenses=float(expense_amounts.sum()),
+    )
+
+
+def _grouped(rows: list[Any], user_index: dict[int, int], size: int) -> tuple[np.ndarray, float]:
+    """Scatter *(user_id, total)* rows into an array; also return the grand total."""
+    values = np.zeros(size, dtype=float)
+    grand_total = 0.0
+    for user_id, total in rows:
+        total = float(total or 0)
+        grand_total += total
+        i = user_index.get(user_id)
+        if i is not None:
+            values[i] += total
+    return values, grand_total
+
+
+def compute_balance_sheet_sql(event: Event) -> BalanceSheet:
+    """Compute the :class:`BalanceSheet` of *event* with database-side aggregation.
+
+    Currency conversion (event rate and exchange fee) and the weighted split
+    of every expense are evaluated inside the SQL statements, which only use
+    joins, ``CASE``, ``NULLIF`` and ``GROUP BY`` and therefore run unchanged
+    on SQLite, PostgreSQL, MySQL/MariaDB and Oracle.
+    """
+    from app.models import Event, EventCurrency, EventUser, Expense, Settlement, expense_affected_users
+
+    rate = aliased(EventCurrency)
+    base_rate = aliased(EventCurrency)
+
+    def in_base_currency(model: Any) -> Any:
+        factor = case(
+            (model.currency_id == Event.base_currency_id, literal(1.0)),
+            else_=(1 + func.coalesce(Event.exchange_fee, 0) / 100.0) * rate.inCHF / base_rate.inCHF,
+        )
+        return func.coalesce(model.amount, 0) * factor
+
+    def with_rates(query: Any, model: Any) -> Any:
+        return (
+            query.join(Event, Event.id == model.event_id)
+            .join(rate, and_(rate.event_id == model.event_id,
+                             rate.currency_id == model.currency_id))
+            .join(base_rate, and_(base_rate.event_id == model.event_id,
+                                  base_rate.currency_id == Event.base_currency_id))
+            .filter(model.event_id == event.id)
+        )
+
+    with db.session.no_autoflush:
+        eventusers = event.users.all()
+
+        # The joins in with_rates() would silently drop rows without a rate
+        unconvertible = [
+            db.session.query(model.currency_id).filter(
+                model.event_id == event.id, *conditions,
+                ~exists().where(EventCurrency.event_id == event.id, EventCurrency.currency_id == model.currency_id),
+            )
+            for model, conditions in ((Expense, ()), (Settlement, (Settlement.draft == False,)))  # noqa: E712
+        ]
+        ensure_convertible(event, [currency_id for (currency_id,) in unconvertible[0].union(unconvertible[1])], {})
+
+        paid_rows = with_rates(
+            db.session.query(Expense.user_id, func.sum(in_base_currency(Expense))), Expense,
+        ).group_by(Expense.user_id).all()
+
+        # Sum of weightings per expense, used as the denominator of each share.
+        weights = (
+            db.session.query(
+                expense_affected_users.c.expense_id.label('expense_id'),
+                func.sum(EventUser.weighting).label('total'),
+            )
+            .join(EventUser, EventUser.id == expense_affected_users.c.user_id)
+            .join(Expense, Expense.id == expense_affected_users.c.expense_id)
+            .filter(Expense.event_id == event.id)
+            .group_by(expense_affected_users.c.expense_id)
+            .subquery()
+        )
+        share = (
+            in_base_currency(Expense) * func.coalesce(EventUser.weighting, 0)
+            / func.nullif(weights.c.total, 0)
+        )
+        spent_rows = with_rates(
+            db.session.query(expense_affected_users.c.user_id, func.sum(share))
+            .select_from(expense_affected_users)
+            .join(Expense, Expense.id == expense_affected_users.c.expense_id)
+            .join(EventUser, EventUser.id == expense_affected_users.c.user_id)
+            .join(weights, weights.c.expense_id == expense_affected_users.c.expense_id),
+            Expense,
+        ).group_by(expense_affected_users.c.user_id).all()
+
+        confirmed = Settlement.draft == False  # noqa: E712
+        sent_rows = with_rates(
+            db.session.query(Settlement.sender_id, func.sum(in_base_currency(Settlement))), Settlement,
+        ).filter(confirmed).group_by(Settlement.sender_id).all()
+        received_rows = with_rates(
+            db.session.query(Settlement.recipient_id, func.sum(in_base_currency(Settlement))), Settlement,
+        ).filter(confirmed).group_by(Settlement.recipient_id).all()
+
+    n_users = len(eventusers)
+    user_index = {u.id: i for i, u in enumerate(eventusers)}
+    paid, total_expenses = _grouped(paid_rows, user_index, n_users)
+    spent, _total = _grouped(spent_rows, user_index, n_users)
+    sent, _total = _grouped(sent_rows, user_index, n_users)
+    received, _total = _grouped(received_rows, user_index, n_users)
+
+    return BalanceSheet(
+        eventusers=eventusers,
+        paid=paid,
+        spent=spent,
+        sent=sent,
+        received=received,
+        total_expenses=total_expenses,
+    )
+
+
+def build_balance_sheet(event: Event) -> BalanceSheet:
+    """Compute the balance sheet of *event* with the configured backend.
+
+    Events with at least ``BALANCE_SQL_THRESHOLD`` expenses are aggregated in
+    the database; smaller events (or all events, if the threshold is ``0``)
+    use the in-memory engine.
+    """
+    threshold = current_app.config.get('BALANCE_SQL_THRESHOLD') or 0
+    if threshold and event.expenses.count() >= threshold:
+        return compute_balance_sheet_sql(event)
+    return compute_balance_sheet(event)
+
+
+def plan_minimal_transfers(balances: np.ndarray, tolerance: float) -> list[tuple[int, int, float]]:
+    """Return *(sender_row, recipient_row, amount)* transfers that settle *balances*.
+
+    Greedily matches the largest remaining debtor with the largest remaining
+    creditor using two heaps.  Every transfer settles at least one of the two
+    completely, so at most ``N - 1`` transfers are produced for ``N``
+    participants, in ``O(N log N)``.  Balances within *tolerance* of zero are
+    considered settled.
+    """
+    creditors = [(-float(b), i) for i, b in enumerate(balances) if b > tolerance]
+    debtors = [(float(b), i) for i, b in enumerate(balances) if b < -tolerance]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers: list[tuple[int, int, float]] = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit - amount > tolerance:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt - amount > tolerance:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
@@ -0,0 +1,206 @@
+"""Incrementally maintained balance ledger (``event_balances``).
+
+Every write that changes an event's expenses or confirmed settlements records
+the contribution of the affected rows before and after the change and applies
+the difference to the participants' :class:`~app.models.EventBalance` rows
+inside the same transaction.  Reading a balance is then a single scan of one
+row per participant.
+
+Changes that affect every expense at once (exchange rates, exchange fee,
+base currency, weightings) rebuild the event's ledger from scratch with
+:func:`rebuild_event_ledger`.  Events without a ledger, e.g. those created
+before the table existed, are rebuilt lazily on their next write.
+
+Amounts in a currency the event has no rate for are refused with
+:class:`ValueError` (see :func:`~app.balance.ensure_convertible`), as by
+the balance engines, instead of being counted as zero.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+from sqlalchemy import update
+
+from app import db
+from app.balance import BalanceSheet, compute_balance_sheet, ensure_convertible, get_conversion_factors
+
+if TYPE_CHECKING:
+    from app.models import Event, EventUser, Expense, Settlement
+
+#: *eventuser_id → [paid, spent, sent, received]* contributed by some rows.
+Contribution = dict[int, list[float]]
+
+_PAID, _SPENT, _SENT, _RECEIVED = range(4)
+
+
+def _add(contribution: Contribution, user_id: int | None, column: int, amount: float) -> None:
+    if user_id is None:
+        return
+    contribution.setdefault(user_id, [0.0, 0.0, 0.0, 0.0])[column] += amount
+
+
+def expense_contribution(expense: Expense) -> Contribution:
+    """Return what *expense* currently contributes to its event's balances.
+
+    The session is flushed first so that reassigned relationships are
+    reflected in the foreign-key columns.
+    """
+    db.session.flush()
+    contribution: Contribution = {}
+    if expense.event_id is None:
+        return contribution
+
+    factors = get_conversion_factors(expense.event)
+    ensure_convertible(expense.event, [expense.currency_id], factors)
+    amount = (expense.amount or 0) * factors[expense.currency_id]
+    _add(contribution, expense.user_id, _PAID, amount)
+
+    affected = expense.affected_users.all()
+    total_weight = sum(u.weighting or 0 for u in affected)
+    if total_weight > 0:
+        for u in affected:
+            _add(contribution, u.id, _SPENT, amount * (u.weighting or 0) / total_weight)
+    return contribution
+
+
+def settlement_contribution(settlement: Settlement) -> Contribution:
+    """Return what *settlement* currently contributes; drafts contribute nothing."""
+    db.session.flush()
+    contribution: Contribution = {}
+    if settlement.event_id is None or settlement.draft:
+        return contribution
+
+    factors = get_conversion_factors(settlement.event)
+    ensure_convertible(settlement.event, [settlement.currency_id], factors)
+    amount = (settlement.amount or 0) * factors[settlement.currency_id]
+    _add(contribution, settlement.sender_id, _SENT, amount)
+    _add(contribution, settlement.recipient_id, _RECEIVED, amount)
+    return contribution
+
+
+def apply_ledger_delta(event: Event, before: Contribution, after: Contribution) -> None:
+    """Apply the change from *before* to *after* to *event*'s ledger.
+
+    Totals are incremented in the database (``SET paid = paid + :delta``) so
+    concurrent writers do not lose updates.  If the event has no complete
+    ledger yet, it is rebuilt instead.
+    """
+    from app.models import EventBalance, EventUser
+
+    db.session.flush()
+    accounts = dict(
+        db.session.query(EventUser.id, EventBalance.eventuser_id)
+        .outerjoin(EventBalance, (EventBalance.eventuser_id == EventUser.id)
+                   & (EventBalance.event_id == event.id))
+        .filter(EventUser.event_id == event.id)
+        .all()
+    )
+    if any(account is None for account in accounts.values()):
+        rebuild_event_ledger(event)
+        return
+
+    for user_id in before.keys() | after.keys():
+        # Non-participants are not part of the balance sheet.
+        if user_id not in accounts:
+            continue
+        old = before.get(user_id, [0.0, 0.0, 0.0, 0.0])
+        new = after.get(user_id, [0.0, 0.0, 0.0, 0.0])
+        delta = [n - o for n, o in zip(new, old)]
+        if not any(delta):
+            continue
+        db.session.execute(
+            update(EventBalance)
+            .where(EventBalance.event_id == event.id, EventBalance.eventuser_id == user_id)
+            .values(
+                paid=EventBalance.paid + delta[_PAID],
+                spent=EventBalance.spent + delta[_SPENT],
+                sent=EventBalance.sent + delta[_SENT],
+                received=EventBalance.received + delta[_RECEIVED],
+            )
+        )
+
+
+def rebuild_event_ledger(event: Event) -> None:
+    """Replace *event*'s ledger with totals recomputed from its expenses and settlements."""
+    from app.models import EventBalance
+
+    db.session.flush()
+    sheet = compute_balance_sheet(event)
+    db.session.query(EventBalance).filter(EventBalance.event_id == event.id).delete(
+        synchronize_session=False,
+    )
+    db.session.add_all([
+        EventBalance(event_id=event.id, eventuser_id=user.id,
+                     paid=paid, spent=spent, sent=sent, received=received)
+        for user, paid, spent, sent, received, _balance in sheet.rows()
+    ])
+    db.session.flush()
+
+
+def open_ledger_account(event: Event, eventuser: EventUser) -> None:
+    """Add a zero row for a new participant if *event* already has a ledger."""
+    from app.models import EventBalance
+
+    db.session.flush()
+    has_ledger = db.session.query(
+        db.session.query(EventBalance).filter(EventBalance.event_id == event.id).exists()
+    ).scalar()
+    if has_ledger and db.session.get(EventBalance, (event.id, eventuser.id)) is None:
+        db.session.add(EventBalance(event_id=event.id, eventuser_id=eventuser.id))
+        db.session.flush()
+
+
+def read_ledger_sheet(event: Event) -> BalanceSheet | None:
+    """Build a :class:`BalanceSheet` from *event*'s ledger rows.
+
+    Returns ``None`` if any participant has no ledger row, in which case the
+    caller must fall back to computing the balances.
+    """
+    from app.models import EventBalance, EventUser
+
+    with db.session.no_autoflush:
+        rows = (
+            db.session.query(EventUser, EventBalance)
+            .outerjoin(EventBalance, (EventBalance.eventuser_id == EventUser.id)
+                       & (EventBalance.event_id == event.id))
+            .filter(EventUser.event_id == event.id)
+            .order_by(EventUser.id)
+            .all()
+        )
+    if not rows or any(balance is None for _user, balance in rows):
+        return None
+
+    paid = np.array([b.paid or 0 for _u, b in rows], dtype=float)
+    return BalanceSheet(
+        eventusers=[u for u, _b in rows],
+        paid=paid,
+        spent=np.array([b.spent or 0 for _u, b in rows], dtype=float),
+        sent=np.array([b.sent or 0 for _u, b in rows], dtype=float),
+        received=np.array([b.received or 0 for _u, b in rows], dtype=float),
+        total_expenses=float(paid.sum()),
+    )
+
+
+def verify_event_ledger(
+    event: Event,
+    tolerance: float = 1e-6,
+) -> list[tuple[EventUser, tuple[float, ...], tuple[float, ...]]]:
+    """Compare *event*'s ledger with a full recomputation.
+
+    Returns *(user, ledger_totals, expected_totals)* for every participant
+    whose row is missing or differs by more than *tolerance*.
+    """
+    ledger = read_ledger_sheet(event)
+    expected = compute_balance_sheet(event)
+    mismatches = []
+    for row in expected.rows():
+        user, expected_totals = row[0], tuple(row[1:5])
+        ledger_totals = tuple(ledger.get_user_balance(user)[1:5]) if ledger is not None else ()
+        if len(ledger_totals) != 4 or not all(
+            math.isclose(a, b, abs_tol=tolerance) for a, b in zip(ledger_totals, expected_totals)
+        ):
+            mismatches.append((user, ledger_totals, expected_totals))
+    return mismatches
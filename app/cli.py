@@ -458,24 +458,304 @@ def register(app) -> None:  # noqa: C901 — CLI registration is inherently comp
         db.session.commit()
         click.echo(f'Deleted {len(broken)} file record(s).')
 
+    @dbmaint.command()
+    @click.option('--event', 'event_guid', default='', help='Only process the event with this GUID.')
+    @click.option('--verify-only', is_flag=True, default=False,
+                  help='Compare the ledgers with a full recomputation without rebuilding them.')
+    def rebuild_balances(event_guid: str, verify_only: bool) -> None:
+        """Rebuild and verify the event_balances ledger from scratch.
+
+        Every event's ledger is recomputed from its expenses and confirmed
+        settlements and then verified against a second full computation.
+        With ``--verify-only`` nothing is written and the command exits with
+        status 1 if any ledger row is missing or out of date.  Events with
+        amounts in a currency they have no rate for cannot be computed and
+        are reported as mismatching.
+        """
+        from app.balance_ledger import rebuild_event_ledger, verify_event_ledger
+
+        if event_guid:
+            events = Event.query.filter(Event.guid == event_guid).all()
+            if not events:
+                click.echo(f'Error: event {event_guid} not found.')
+                return
+        else:
+            events = Event.query.order_by(Event.id).all()
+
+        rebuilt = 0
+        mismatched = 0
+        for event in events:
+            try:
+                if not verify_only:
+                    rebuild_event_ledger(event)
+                    db.session.commit()
+                    rebuilt += 1
+                mismatches = verify_event_ledger(event)
+            except ValueError as e:
+                db.session.rollback()
+                mismatched += 1
+                click.echo(f'Event {event.guid} ({event.name}): {e}')
+                continue
+            if mismatches:
+                mismatched += 1
+                click.echo(f'Event {event.guid} ({event.name}): {len(mismatches)} mismatching row(s)')
+                for user, ledger_totals, expected_totals in mismatches:
+                    click.echo(f'  {user.username}: ledger={ledger_totals} expected={expected_totals}')
+
+        click.echo(
+            f'Balances: {rebuilt} event ledger(s) rebuilt, '
+            f'{len(events) - mismatched} verified, {mismatched} mismatching.'
+        )
+        if mismatched:
+            sys.exit(1)
+
+    @dbmaint.command()
+    def backfill_thumbnail_formats() -> None:
+        """Create missing thumbnails, including THUMBNAIL_ALTERNATE_FORMATS encodings.
+
+        Images uploaded before an alternate format (WebP/AVIF) was enabled
+        only have primary-format thumbnails; this renders the missing
+        size/format pairs from each stored original.  Safe to re-run.
+        """
+        from app.media.processor import create_thumbnails, thumbnail_formats
+
+        images = (
+            Image.query
+            .filter(Image.is_vector.isnot(True), Image.file_id.isnot(None))
+            .order_by(Image.id)
+            .all()
+        )
+        created = 0
+        updated = 0
+        failed = 0
+        for image in images:
+            try:
+                thumbnails = create_thumbnails(image)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                click.echo(f'Image {image.guid}: {e}')
+                continue
+            if thumbnails:
+                created += len(thumbnails)
+                updated += 1
+
+        click.echo(
+            f'Thumbnails ({", ".join(thumbnail_formats())}): {created} created for '
+            f'{updated} of {len(images)} image(s), {failed} failed.'
+        )
+
+    @dbmaint.command()
+    @click.option('--batch-size', default=50, show_default=True,
+                  help='Images loaded, rendered and committed together.')
+    @click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+                  help='Worker processes for decoding, resizing and encoding.')
+    @click.option('--checkpoint', default='.regenerate-thumbnails.checkpoint', show_default=True,
+                  type=click.Path(dir_okay=False), help='File recording the last committed image ID.')
+    @click.option('--restart', is_flag=True, default=False,
+                  help='Ignore an existing checkpoint and start from the first image.')
+    def regenerate_thumbnails(batch_size: int, workers: int, checkpoint: str, restart: bool) -> None:
+        """Rebuild thumbnails after THUMBNAIL_SIZES or the thumbnail formats changed.
+
+        Images are processed in ID order, in batches of ``--batch-size``.
+        Images whose thumbnails already match the configuration are skipped;
+        for the rest, outdated thumbnails are removed and missing ones are
+        rendered in ``--workers`` processes.  After each committed batch the
+        last image ID is written to ``--checkpoint``, so an interrupted run
+        resumes where it stopped.  The checkpoint is removed when the run
+        completes.  Exits with status 1 if any image failed.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        from app.media.processor import regenerate_thumbnails as regenerate
+
+        last_id = 0
+        if not restart and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                last_id = int(f.read().strip() or 0)
+            click.echo(f'Resuming after image id {last_id} (from {checkpoint}).')
+
+        processed = 0
+        changed = 0
+        failed = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+            while True:
+                # Keyset pagination: committing every batch would invalidate a streaming cursor
+                images = (
+                    Image.query
+                    .filter(Image.id > last_id)
+                    .order_by(Image.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not images:
+                    break
+                batch_changed, failures = regenerate(images, executor)
+                db.session.commit()
+                last_id = images[-1].id
+                with open(checkpoint, 'w') as f:
+                    f.write(str(last_id))
+
+                processed += len(images)
+                changed += batch_changed
+                failed += len(failures)
+                for image, error in failures:
+                    click.echo(f'  Image {image.guid} (id={image.id}): {error}')
+                rate = processed / max(time.monotonic() - started, 1e-9)
+                click.echo(f'  up to id {last_id}: {processed} image(s) processed, {rate:.1f} images/s')
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.monotonic() - started
+        click.echo(
+            f'Thumbnails regenerated: {changed} image(s) updated, '
+            f'{processed - changed - failed} already up to date, {failed} failed '
+            f'in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.1f} images/s).'
+        )
+        if failed:
+            sys.exit(1)
+
+    @dbmaint.command()
+    @click.option('--batch-size', default=500, show_default=True,
+                  help='Duplicate content hashes loaded and committed together.')
+    @click.option('--dry-run', is_flag=True, default=False,
+                  help='Only report what would be collapsed; change nothing.')
+    def collapse_duplicate_files(batch_size: int, dry_run: bool) -> None:
+        """Store identical files once, deleting the redundant copies.
+
+        Hashes held under more than one storage key are processed in hash
+        order, ``--batch-size`` at a time; see
+        :func:`~app.services.media_service.collapse_duplicate_files`.  Each
+        batch is committed before its objects are deleted, so an interrupted
+        run can simply be restarted.  Exits with status 1 if any content
+        could not be collapsed.
+        """
+        from app.services import media_service
+
+        total = media_service.CollapseResult()
+        hashes = 0
+        last_hash = ''
+        started = time.monotonic()
+        while True:
+            batch = media_service.find_duplicate_hashes(after=last_hash, limit=batch_size)
+            if not batch:
+                break
+            result = media_service.collapse_duplicate_files(batch, dry_run=dry_run)
+            last_hash = batch[-1]
+
+            hashes += len(batch)
+            total.files += result.files
+            total.objects_removed += result.objects_removed
+            total.bytes_reclaimed += result.bytes_reclaimed
+            total.failures += result.failures
+            for file_hash, reason in result.failures:
+                click.echo(f'  {file_hash}: {reason}')
+            rate = hashes / max(time.monotonic() - started, 1e-9)
+            click.echo(f'  {hashes} hash(es) processed, {rate:.1f} hashes/s')
+
+        elapsed = time.monotonic() - started
+        verb = 'would be' if dry_run else 'were'
+        click.echo(
+            f'Duplicates: {total.files} file(s) {verb} repointed, {total.objects_removed} object(s) '
+            f'({total.bytes_reclaimed / (1024 * 1024):.1f} MiB) {verb} removed, '
+            f'{len(total.failures)} hash(es) failed in {elapsed:.1f}s.'
+        )
+        if total.failures:
+            sys.exit(1)
+
+    @dbmaint.command()
+    @click.option('--delete/--dry-run', 'delete', default=False,
+                  help='Actually delete the orphaned objects (default: dry-run).')
+    @click.option('--min-age-hours', default=24, show_default=True,
+                  help='Leave objects younger than this alone; their row may not be committed yet.')
+    @click.option('--batch-size', default=500, show_default=True,
+                  help='Listed keys checked against the database per query.')
+    @click.option('--backend', 'backends', multiple=True,
+                  help='Only sweep this storage backend (repeatable; default: all in use).')
+    def sweep_orphans(delete: bool, min_age_hours: int, batch_size: int, backends: tuple[str, ...]) -> None:
+        """Find (or delete) stored objects that no file or backup segment references.
+
+        Objects are left behind by failed uploads, rolled-back transactions
+        and interrupted backup deletions.  Only the prefixes the app writes
+        to are listed; see
+        :func:`~app.services.storage_service.get_sweep_locations`.
+
+        Runs as a dry-run by default; pass ``--delete`` to remove the objects.
+        Exits with status 1 if a location could not be listed or an orphan
+        could not be deleted.
+        """
+        from datetime import timedelta
+
+        from app.services import storage_service
+
+        started = time.monotonic()
+
+        def report(result: storage_service.SweepResult) -> None:
+            rate = result.scanned / max(time.monotonic() - location_started, 1e-9)
+            click.echo(f'  {result.scanned} object(s) listed, {result.orphans} orphaned, {rate:.0f} objects/s')
+
+        scanned = orphans = orphan_bytes = deleted = 0
+        failed: list[str] = []
+        for backend, prefix in storage_service.get_sweep_locations():
+            if backends and backend not in backends:
+                continue
+            click.echo(f'Sweeping {backend}:{prefix}/')
+            location_started = time.monotonic()
+            try:
+                result = storage_service.sweep_orphans(
+                    backend, prefix, dry_run=not delete, min_age=timedelta(hours=min_age_hours),
+                    batch_size=batch_size, progress=report,
+                )
+            except Exception as e:
+                click.echo(f'  Listing failed: {e}')
+                failed.append(f'{backend}:{prefix}/')
+                continue
+            scanned += result.scanned
+            orphans += result.orphans
+            orphan_bytes += result.orphan_bytes
+            deleted += result.deleted
+            for storage_key in result.failed:
+                click.echo(f'  Could not delete {storage_key}')
+                failed.append(storage_key)
+
+        elapsed = time.monotonic() - started
+        click.echo(
+            f'Orphans: {orphans} of {scanned} object(s) ({orphan_bytes / (1024 * 1024):.1f} MiB), '
+            f'{deleted} deleted, {len(failed)} failed in {elapsed:.1f}s '
+            f'({scanned / max(elapsed, 1e-9):.0f} objects/s).'
+        )
+        if not delete and orphans:
+            click.echo('Dry-run: nothing deleted. Re-run with --delete to remove them.')
+        if failed:
+            sys.exit(1)
+
     # ------------------------------------------------------------------
     # Cache / storage flush commands
     # ------------------------------------------------------------------
 
     @app.cli.command('flush-media-cache')
-    def flush_media_cache() -> None:
-        """Clear all cached images from Redis."""
-        r = redis.Redis(
-            host=current_app.config.get('REDIS_HOST', 'localhost'),
-            port=current_app.config.get('REDIS_PORT', 6379),
-            db=current_app.config.get('REDIS_DB', 0),
-            password=current_app.config.get('REDIS_PASSWORD'),
+    @click.option('--stats-only', is_flag=True, default=False,
+                  help='Only report occupancy and hit ratio; keep the cache.')
+    def flush_media_cache(stats_only: bool) -> None:
+        """Report the Redis media cache statistics, then clear it."""
+        from app.services import media_service
+
+        stats = media_service.get_media_cache_stats()
+        mib = 1024 * 1024
+        click.echo(
+            f'Redis media cache: {stats.entries} entries, {stats.bytes / mib:.1f} of '
+            f'{stats.budget / mib:.1f} MiB ({stats.bytes / max(stats.budget, 1):.1%}), '
+            f'hit ratio {stats.hit_ratio:.1%} ({stats.hits} hits, {stats.misses} misses), '
+            f'{stats.evictions} evictions.'
         )
+        if stats_only:
+            return
 
-        keys = r.keys('media_cache:*')
-        if keys:
-            r.delete(*keys)
-            click.echo(f'Successfully flushed {len(keys)} media files from Redis cache.')
+        removed = media_service.flush_media_cache()
+        if removed:
+            click.echo(f'Successfully flushed {removed} media files from Redis cache.')
         else:
             click.echo('Redis media cache is already empty.')
 
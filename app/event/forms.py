@@ -12,6 +12,13 @@ from wtforms import (
 from wtforms.validators import DataRequired, Optional, Length, Email, Regexp
 from wtforms.fields import DateField
 
+from app.models import SETTLEMENT_MODE_ACCOUNTANT, SETTLEMENT_MODE_MINIMAL
+
+SETTLEMENT_MODE_CHOICES = [
+    (SETTLEMENT_MODE_ACCOUNTANT, _l('Via accountant')),
+    (SETTLEMENT_MODE_MINIMAL, _l('Fewest direct transfers')),
+]
+
 
 class PostForm(FlaskForm):
     """Form for submitting a new post on the event wall."""
@@ -65,6 +72,12 @@ class EventForm(FlaskForm):
         default=2.0,
         validators=[DataRequired()],
     )
+    settlement_mode = SelectField(
+        _l('Settlement mode'),
+        choices=SETTLEMENT_MODE_CHOICES,
+        default=SETTLEMENT_MODE_ACCOUNTANT,
+        validators=[DataRequired()],
+    )
     submit = SubmitField(_l('Submit'))
 
 
@@ -103,6 +116,12 @@ class EventEditForm(FlaskForm):
         default=2.0,
         validators=[DataRequired()],
     )
+    settlement_mode = SelectField(
+        _l('Settlement mode'),
+        choices=SETTLEMENT_MODE_CHOICES,
+        default=SETTLEMENT_MODE_ACCOUNTANT,
+        validators=[DataRequired()],
+    )
     accountant_id = SelectField(
         _l('Select accountant'),
         coerce=int,
@@ -25,7 +25,7 @@ from app.event.forms import (
     SettlementForm,
 )
 from app.main.forms import ImageForm
-from app.models import Currency, Event, EventCurrency, EventUser, Expense, Settlement
+from app.models import SETTLEMENT_MODE_ACCOUNTANT, Currency, Event, EventCurrency, EventUser, Expense, Settlement
 from app.services.event_service import (
     add_event_user,
     add_expense_user,
@@ -47,6 +47,7 @@ from app.services.event_service import (
     list_expenses,
     list_posts,
     list_settlements,
+    load_event_cards,
     readd_event_user,
     remove_event_user,
     remove_expense,
@@ -93,7 +94,7 @@ def index() -> str:
     return render_template(
         'event/index.html',
         title=_('Hi %(username)s, your events:', username=current_user.username),
-        events=result.items,
+        cards=load_event_cards(result.items, 64),
         next_url=next_url,
         prev_url=prev_url,
     )
@@ -252,6 +253,7 @@ def new() -> str:
             fileshare_link=form.fileshare_link.data,
             description=form.description.data,
             created_by=current_user.username,
+            settlement_mode=form.settlement_mode.data,
         )
         flash(_('Your new event has been added.'))
         return redirect(url_for('event.main', guid=result.event.guid))
@@ -291,6 +293,7 @@ def edit(guid: str) -> str:
             exchange_fee=form.exchange_fee.data,
             accountant_id=form.accountant_id.data,
             currency_ids=form.currency_id.data,
+            settlement_mode=form.settlement_mode.data,
         )
         flash(_('Your changes have been saved.'))
         return redirect(url_for('event.main', guid=guid))
@@ -303,6 +306,7 @@ def edit(guid: str) -> str:
         form.currency_id.data = [c.id for c in event.currencies]
         form.exchange_fee.data = event.exchange_fee
         form.accountant_id.data = event.accountant_id
+        form.settlement_mode.data = event.settlement_mode or SETTLEMENT_MODE_ACCOUNTANT
     return render_template('edit_form.html', title=_('Edit Event'), form=form)
 
 
@@ -325,7 +329,8 @@ def edit_picture(guid: str) -> str:
 
         file_obj = request.files['image']
         try:
-            update_event_picture(guid, file_obj.stream, file_obj.filename)
+            update_event_picture(guid, file_obj.stream, file_obj.filename,
+                                 uploader=current_user if current_user.is_authenticated else None)
             flash(_('Your changes have been saved.'))
         except Exception as e:
             current_app.logger.error(f"Failed to upload event picture: {e}")
@@ -502,7 +507,8 @@ def edit_profile_picture(guid: str) -> str:
 
         file_obj = request.files['image']
         try:
-            update_event_user_picture(guid, file_obj.stream, file_obj.filename)
+            update_event_user_picture(guid, file_obj.stream, file_obj.filename,
+                                      uploader=current_user if current_user.is_authenticated else None)
             flash(_('Your changes have been saved.'))
         except Exception as e:
             current_app.logger.error(f"Failed to upload user profile picture: {e}")
@@ -531,6 +537,7 @@ def balance(guid: str) -> str:
         draft_settlements=result.draft_settlements,
         balances_str=result.balances_str,
         total_expenses_str=result.total_expenses_str,
+        rates=result.rates,
     )
 
 
@@ -584,6 +591,7 @@ def expenses(guid: str) -> str:
         event=event,
         eventuser=eventuser,
         expenses=result.items,
+        rates=event.get_rates(),
         next_url=next_url,
         prev_url=prev_url,
     )
@@ -612,7 +620,8 @@ def add_receipt(guid: str) -> str:
         file_obj = request.files['image']
         try:
             from app.services.event_service import add_receipt as svc_add_receipt
-            svc_add_receipt(guid, file_obj.stream, file_obj.filename)
+            svc_add_receipt(guid, file_obj.stream, file_obj.filename,
+                            uploader=current_user if current_user.is_authenticated else None)
             flash(_('Your changes have been saved.'))
         except Exception as e:
             current_app.logger.error(f"Failed to upload receipt: {e}")
@@ -687,7 +696,8 @@ def expense_users(guid: str) -> str:
     log_page_access(request, current_user)
 
     form = ExpenseAddUserForm()
-    form.user_id.choices = [(u.id, u.username) for u in event.users.order_by(EventUser.username.asc()) if u not in expense.affected_users]
+    affected_ids = {u.id for u in expense.affected_users}
+    form.user_id.choices = [(u.id, u.username) for u in event.users.order_by(EventUser.username.asc()) if u.id not in affected_ids]
     if form.validate_on_submit():
         if event.closed:
             flash(_('Your are only allowed to edit an open event!'))
@@ -801,6 +811,7 @@ def settlements(guid: str) -> str:
         event=event,
         eventuser=eventuser,
         settlements=result.items,
+        rates=event.get_rates(),
         next_url=next_url,
         prev_url=prev_url,
     )
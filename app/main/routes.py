@@ -432,6 +432,8 @@ def start_task():
         flash(_('Checking online sources for currency rates'))
     elif key == 'UPDATE_CURRENCIES':
         flash(_('Updating currency rates from known sources'))
+    elif key == 'SCRUB_STORAGE':
+        flash(_('Verifying stored files against their checksums'))
     elif key == 'TYPE_ERROR':
         amount = kwargs.get('amount', 1)
         flash(_('%(amount)s tasks with TypeErrors have been created', amount=amount))
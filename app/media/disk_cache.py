@@ -0,0 +1,208 @@
+# coding=utf-8
+"""Size-bounded media cache on local disk, between Redis and S3.
+
+Entries are keyed by :attr:`File.file_hash` and stored as
+``<MEDIA_DISK_CACHE_PATH>/<hash[:2]>/<hash>``.  The directory can be
+shared by all workers on a node:
+
+* Entries are written to ``tmp/`` and moved into place with
+  :func:`os.replace`, so readers never see a partial file.
+* Recency lives in the file system: a hit bumps the entry's mtime, and
+  eviction removes the oldest entries once ``MEDIA_DISK_CACHE_MAX_BYTES``
+  is exceeded.  Each worker tracks its own writes and rescans the
+  directory every :data:`RESCAN_INTERVAL` to account for the others.
+
+Hits, misses and evictions are counted in the app's Prometheus registry.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import suppress
+from typing import TYPE_CHECKING
+
+from flask import current_app
+from prometheus_client import Counter
+
+if TYPE_CHECKING:
+    from prometheus_client import CollectorRegistry
+
+RESCAN_INTERVAL = 60.0
+"""Seconds after which a worker re-measures the directory instead of trusting its own tally."""
+
+EVICT_TO = 0.9
+"""Eviction stops once the cache is below this fraction of its budget."""
+
+STALE_TMP_AGE = 3600.0
+"""Seconds after which an unfinished ``tmp/`` file is considered abandoned."""
+
+_cache_lock = threading.Lock()
+
+
+class PendingEntry:
+    """A cache entry being written; it becomes visible only on :meth:`commit`.
+
+    Used as a context manager, an uncommitted entry is discarded on exit.
+    """
+
+    def __init__(self, cache: MediaDiskCache, file_hash: str) -> None:
+        self.cache = cache
+        self.file_hash = file_hash
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.tmp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> None:
+        """Atomically publish the entry under its hash."""
+        self.file.close()
+        path = self.cache.path_for(self.file_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+        self.tmp_path = None
+        self.cache.account(self.size)
+
+    def discard(self) -> None:
+        self.file.close()
+        if self.tmp_path is not None:
+            with suppress(FileNotFoundError):
+                os.remove(self.tmp_path)
+            self.tmp_path = None
+
+    def __enter__(self) -> PendingEntry:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.discard()
+
+
+class MediaDiskCache:
+    """LRU file cache under *root* holding at most about *max_bytes*."""
+
+    def __init__(self, root: str, max_bytes: int, registry: CollectorRegistry | None = None) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes: int | None = None
+        self._scanned_at = 0.0
+
+        self.hits = Counter('media_disk_cache_hits', 'Media reads served from the local disk cache',
+                            registry=registry)
+        self.misses = Counter('media_disk_cache_misses', 'Media reads not found in the local disk cache',
+                              registry=registry)
+        self.evictions = Counter('media_disk_cache_evictions', 'Files evicted from the local disk cache',
+                                 registry=registry)
+
+    def path_for(self, file_hash: str) -> str:
+        return os.path.join(self.root, file_hash[:2], file_hash)
+
+    def get_path(self, file_hash: str) -> str | None:
+        """Return the cached file of *file_hash* and mark it as recently used, or ``None``."""
+        path = self.path_for(file_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        return path
+
+    def read(self, file_hash: str) -> bytes | None:
+        """Return the cached content of *file_hash*, or ``None``."""
+        path = self.get_path(file_hash)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another worker in between
+            return None
+
+    def begin(self, file_hash: str) -> PendingEntry:
+        """Start writing the entry of *file_hash*; see :class:`PendingEntry`."""
+        return PendingEntry(self, file_hash)
+
+    def put(self, file_hash: str, data: bytes) -> None:
+        with self.begin(file_hash) as entry:
+            entry.write(data)
+            entry.commit()
+
+    def account(self, nbytes: int) -> None:
+        """Add *nbytes* of new entries to the tally and evict if over budget."""
+        with self._lock:
+            if self._total_bytes is None or time.monotonic() - self._scanned_at > RESCAN_INTERVAL:
+                self._total_bytes = sum(size for _mtime, size, _path in self._scan())
+                self._scanned_at = time.monotonic()
+            else:
+                self._total_bytes += nbytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        """Return *(mtime, size, path)* of every entry; removes abandoned temp files."""
+        entries = []
+        now = time.time()
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if shard.path == self.tmp_dir:
+                    if now - stat.st_mtime > STALE_TMP_AGE:
+                        with suppress(FileNotFoundError):
+                            os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache is below :data:`EVICT_TO` of its budget."""
+        entries = sorted(self._scan())
+        total = sum(size for _mtime, size, _path in entries)
+        target = self.max_bytes * EVICT_TO
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker evicted it first
+                pass
+            else:
+                self.evictions.inc()
+            total -= size
+        self._total_bytes = total
+        self._scanned_at = time.monotonic()
+
+
+def get_media_disk_cache() -> MediaDiskCache | None:
+    """Return the app's disk cache, or ``None`` if ``MEDIA_DISK_CACHE_PATH`` is unset.
+
+    Created on first use and kept in ``app.extensions['media_disk_cache']``.
+    """
+    root = current_app.config.get('MEDIA_DISK_CACHE_PATH')
+    if not root:
+        return None
+    cache = current_app.extensions.get('media_disk_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get('media_disk_cache')
+            if cache is None:
+                cache = current_app.extensions['media_disk_cache'] = MediaDiskCache(
+                    root,
+                    current_app.config['MEDIA_DISK_CACHE_MAX_BYTES'],
+                    registry=current_app.metrics.registry,
+                )
+    return cache
@@ -1,5 +1,10 @@
 # coding=utf-8
-"""Image processing pipeline: hashing, storage, thumbnail generation."""
+"""Image processing pipeline: hashing, storage, thumbnail generation.
+
+Uploads only store the original; thumbnails are created afterwards by the
+``generate_thumbnails`` RQ job (see :func:`queue_thumbnails`).  Until then
+:meth:`~app.models.Image.get_thumbnail_url` falls back to the original.
+"""
 
 from __future__ import annotations
 
@@ -8,13 +13,24 @@ import mimetypes
 import os
 import re
 import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import IO
 
 from PIL import Image as ImagePIL
+from PIL import features
 from flask import current_app
 
 from app import db
-from app.models import File, Image, Thumbnail
+from app.models import THUMBNAIL_ALTERNATE_MIME_TYPES, File, Image, Thumbnail, User
+from app.thumbnails import invalidate_thumbnail_index
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+VARIANT_TOUCH_INTERVAL = timedelta(hours=1)
+"""Minimum age of ``last_accessed_at`` before serving a variant updates it again."""
 
 
 def compute_file_hash(file_stream: BytesIO) -> str:
@@ -31,83 +47,113 @@ def compute_file_hash(file_stream: BytesIO) -> str:
     return sha256.hexdigest()
 
 
-def process_and_store_image(file_stream: object, original_filename: str) -> Image:
+def _read_file(file_obj: File) -> bytes:
+    """Return the full content of *file_obj* from storage."""
+    stream = file_obj.get_provider().get_file_stream(file_obj.storage_key)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+
+def _spool_upload(file_stream: IO[bytes], spool: IO[bytes]) -> tuple[str, int]:
+    """Copy *file_stream* into *spool* in chunks, hashing on the way.
+
+    Returns the SHA-256 hex digest and the size in bytes; *spool* is
+    rewound to the start.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    while chunk := file_stream.read(UPLOAD_CHUNK_SIZE):
+        sha256.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return sha256.hexdigest(), size
+
+
+def process_and_store_image(file_stream: IO[bytes], original_filename: str) -> Image:
     """Process an uploaded image and persist it to the active storage backend.
 
     Steps performed:
-    1. Detach bytes from the Flask/Werkzeug stream.
-    2. Compute a SHA-256 hash for deduplication.
-    3. Gather metadata (MIME type, dimensions, format).
-    4. Save the original file via the ``StorageProvider``.
+    1. Spool the upload to a ``SpooledTemporaryFile`` (kept in memory up to
+       ``UPLOAD_SPOOL_MAX_MEMORY`` bytes, on disk beyond), computing its
+       SHA-256 hash in the same pass.
+    2. Return the existing image if this exact file was uploaded before.
+    3. Gather metadata (MIME type; dimensions, format and mode from the
+       image header only — no pixels are decoded).
+    4. Stream the original from the spool to the ``StorageProvider``.
     5. Create ``File`` and ``Image`` database records.
-    6. Generate thumbnails for raster images.
+
+    Peak memory is bounded by the spool threshold regardless of upload
+    size.  Thumbnails are not generated here; call :func:`queue_thumbnails`
+    once the image has been committed, which decodes the pixels exactly
+    once for all derivatives.
 
     Returns the ``Image`` ORM instance (already flushed but not committed).
     """
-    # Detach file data from Flask/Werkzeug early to prevent stream conflicts
-    file_bytes: bytes = file_stream.read()
-
-    # 1. Compute hash for deduplication
-    file_hash = compute_file_hash(BytesIO(file_bytes))
-
-    # 2. Return existing image if this exact file was already uploaded
-    existing_file = File.query.filter_by(file_hash=file_hash).first()
-    if existing_file:
-        existing_image = Image.query.filter_by(file_id=existing_file.id).first()
-        if existing_image:
-            return existing_image
-
-    # 3. Gather metadata
-    mime_type, _ = mimetypes.guess_type(original_filename)
-    mime_type = mime_type or 'application/octet-stream'
-
-    ext = os.path.splitext(original_filename)[1].lower()
-    if not ext and mime_type == 'image/jpeg':
-        ext = '.jpg'
-
-    storage_backend: str = current_app.config.get('STORAGE_DEFAULT_BACKEND', 'local')
-    unique_id = uuid.uuid4().hex
-    raw_key = f"{current_app.config.get('IMAGE_IMG_PATH')}/{unique_id}{ext}"
-    storage_key = re.sub(r'/+', '/', raw_key.replace('\\', '/')).lstrip('/')
-
-    # 4. Read image properties with PIL
-    is_vector = mime_type == 'image/svg+xml'
-    width: int = 0
-    height: int = 0
-    img_format: str = ''
-    mode: str = ''
-
-    if is_vector:
-        img_format = 'SVG'
-        mode = 'RGB'
-    else:
-        try:
-            with ImagePIL.open(BytesIO(file_bytes)) as pil_img:
-                width, height = pil_img.size
-                img_format = pil_img.format
-                mode = pil_img.mode
-        except Exception as e:
-            current_app.logger.error(f"Failed to read image {original_filename}: {e}")
-            raise ValueError("Invalid image file")
-
-    # 5. Persist the original file to storage
-    file_obj = File(
-        original_filename=original_filename,
-        storage_backend=storage_backend,
-        storage_key=storage_key,
-        mime_type=mime_type,
-        file_size=len(file_bytes),
-        file_hash=file_hash,
-        hash_algorithm='sha256',
-    )
-
-    provider = file_obj.get_provider()
-    provider.save(storage_key, BytesIO(file_bytes), mime_type)
+    max_memory: int = current_app.config.get('UPLOAD_SPOOL_MAX_MEMORY', 1024 * 1024)
+    with SpooledTemporaryFile(max_size=max_memory) as spool:
+        # 1. Detach the upload from Flask/Werkzeug and hash it in one pass
+        file_hash, file_size = _spool_upload(file_stream, spool)
+
+        # 2. Return existing image if this exact file was already uploaded
+        existing_file = File.query.filter_by(file_hash=file_hash).first()
+        if existing_file:
+            existing_image = Image.query.filter_by(file_id=existing_file.id).first()
+            if existing_image:
+                return existing_image
+
+        # 3. Gather metadata
+        mime_type, _ = mimetypes.guess_type(original_filename)
+        mime_type = mime_type or 'application/octet-stream'
+
+        ext = os.path.splitext(original_filename)[1].lower()
+        if not ext and mime_type == 'image/jpeg':
+            ext = '.jpg'
+
+        storage_backend: str = current_app.config.get('STORAGE_DEFAULT_BACKEND', 'local')
+        unique_id = uuid.uuid4().hex
+        raw_key = f"{current_app.config.get('IMAGE_IMG_PATH')}/{unique_id}{ext}"
+        storage_key = re.sub(r'/+', '/', raw_key.replace('\\', '/')).lstrip('/')
+
+        is_vector = mime_type == 'image/svg+xml'
+        width: int = 0
+        height: int = 0
+        img_format: str = ''
+        mode: str = ''
+
+        if is_vector:
+            img_format = 'SVG'
+            mode = 'RGB'
+        else:
+            try:
+                # Image.open only parses the header; pixels stay undecoded
+                with ImagePIL.open(spool) as pil_img:
+                    width, height = pil_img.size
+                    img_format = pil_img.format
+                    mode = pil_img.mode
+            except Exception as e:
+                current_app.logger.error(f"Failed to read image {original_filename}: {e}")
+                raise ValueError("Invalid image file")
+            spool.seek(0)
+
+        # 4. Stream the original to storage
+        file_obj = File(
+            original_filename=original_filename,
+            storage_backend=storage_backend,
+            storage_key=storage_key,
+            mime_type=mime_type,
+            file_size=file_size,
+            file_hash=file_hash,
+            hash_algorithm='sha256',
+        )
+        file_obj.save_content(spool)
 
+    # 5. Create the File and Image records
     db.session.add(file_obj)
     db.session.flush()
 
-    # 6. Create the Image record
     image_obj = Image(
         file_obj=file_obj,
         is_vector=is_vector,
@@ -119,74 +165,390 @@ def process_and_store_image(file_stream: object, original_filename: str) -> Imag
     db.session.add(image_obj)
     db.session.flush()
 
-    # 7. Generate thumbnails (raster images only)
-    if not is_vector:
-        _generate_thumbnails(
-            file_bytes, image_obj, provider,
-            storage_backend, unique_id, original_filename,
-            width, height,
+    return image_obj
+
+
+def queue_thumbnails(image: Image, notify: User | None = None) -> None:
+    """Enqueue thumbnail generation for *image* on the task queue.
+
+    Must be called after *image* is committed so the worker can load it.
+    *notify* receives a ``thumbnails_ready`` notification when done.  If the
+    queue is disabled (``THUMBNAIL_ASYNC``) or unreachable, the thumbnails
+    are generated inline and committed instead.
+    """
+    if image.is_vector:
+        return
+
+    if current_app.config.get('THUMBNAIL_ASYNC', True):
+        try:
+            current_app.task_queue.enqueue(
+                'app.tasks.generate_thumbnails', image.id, str(notify.guid) if notify else None,
+            )
+            return
+        except Exception as e:
+            current_app.logger.warning(f"Enqueuing thumbnails of image {image.id} failed, generating inline: {e}")
+
+    try:
+        create_thumbnails(image, notify=notify)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Generating thumbnails of image {image.id} failed: {e}")
+
+
+def create_thumbnails(image: Image, notify: User | None = None) -> list[Thumbnail]:
+    """Create the missing thumbnails of *image* from its stored original.
+
+    Every size is encoded in each of :func:`thumbnail_formats`; size/format
+    pairs that already exist are skipped, so repeated calls are harmless
+    and backfill new formats for older images.  Returns the new thumbnails
+    (flushed but not committed).
+    """
+    if image.is_vector or image.file is None:
+        return []
+
+    file_obj = image.file
+    primary = current_app.config.get('IMAGE_DEFAULT_FORMAT', 'JPEG').upper()
+    existing = {
+        (size, (fmt or primary).upper())
+        for size, fmt in image.thumbnails.with_entities(Thumbnail.size, Thumbnail.format)
+    }
+    max_dim = max(image.width or 0, image.height or 0)
+    if all((size, fmt) in existing
+           for size in current_app.config['THUMBNAIL_SIZES'] if size < max_dim
+           for fmt in thumbnail_formats()):
+        return []
+
+    file_bytes = _read_file(file_obj)
+    unique_id = os.path.splitext(os.path.basename(file_obj.storage_key))[0]
+    thumbnails = _generate_thumbnails(
+        file_bytes, image, file_obj.storage_backend, unique_id, file_obj.original_filename,
+        image.width, image.height, skip=existing,
+    )
+    invalidate_thumbnail_index(image.id)
+
+    if notify is not None:
+        notify.add_notification('thumbnails_ready', {
+            'image_guid': str(image.guid),
+            'sizes': sorted({size for size, _fmt in existing} | {t.size for t in thumbnails}),
+        })
+    return thumbnails
+
+
+def thumbnail_formats() -> list[str]:
+    """Return the thumbnail encodings to produce, ``IMAGE_DEFAULT_FORMAT`` first.
+
+    Alternates from ``THUMBNAIL_ALTERNATE_FORMATS`` are included only if
+    Pillow was built with an encoder for them.
+    """
+    primary = current_app.config.get('IMAGE_DEFAULT_FORMAT', 'JPEG').upper()
+    alternates = [fmt.upper() for fmt in current_app.config.get('THUMBNAIL_ALTERNATE_FORMATS', [])]
+    return [primary] + [
+        fmt for fmt in alternates
+        if fmt != primary and fmt in THUMBNAIL_ALTERNATE_MIME_TYPES and features.check(fmt.lower())
+    ]
+
+
+THUMBNAIL_REDUCING_GAP = 2.0
+"""``reducing_gap`` for :meth:`PIL.Image.Image.thumbnail`: cheap box reduction down
+to twice the target size, then a full-quality resample for the rest."""
+
+
+def _render_thumbnails(
+    file_bytes: bytes,
+    sizes: list[int],
+    formats: list[str],
+    skip: set[tuple[int, str]] | frozenset[tuple[int, str]] = frozenset(),
+) -> list[tuple[int, str, bytes, str]]:
+    """Return *(size, format, encoded bytes, mode)* for each of *sizes* × *formats*, largest first.
+
+    *(size, format)* pairs in *skip* are not encoded.  The original is
+    decoded once; JPEGs are decoded with
+    :meth:`~PIL.Image.Image.draft` directly at the smallest DCT scale that
+    still covers the largest size times :data:`THUMBNAIL_REDUCING_GAP`.
+    Every size is resized from the next larger one instead of from the
+    original, and all encodings run in parallel threads (Pillow releases
+    the GIL while encoding).
+    """
+    sizes = sorted(sizes, reverse=True)
+    if not sizes:
+        return []
+
+    with ImagePIL.open(BytesIO(file_bytes)) as pil_img:
+        if pil_img.format == 'JPEG':
+            draft_size = int(sizes[0] * THUMBNAIL_REDUCING_GAP)
+            pil_img.draft(pil_img.mode, (draft_size, draft_size))
+        pil_img.load()
+        current = pil_img
+        if pil_img.mode == 'RGBA':
+            current = ImagePIL.new('RGB', pil_img.size, (255, 255, 255))
+            current.paste(pil_img, mask=pil_img.split()[3])
+
+        resized: list[tuple[int, ImagePIL.Image]] = []
+        for size in sizes:
+            if resized:
+                current = current.copy()
+            current.thumbnail((size, size), reducing_gap=THUMBNAIL_REDUCING_GAP)
+            resized.append((size, current))
+
+        jobs = [(size, fmt, thumb_img) for size, thumb_img in resized for fmt in formats if (size, fmt) not in skip]
+
+        def _encode(job: tuple[int, str, ImagePIL.Image]) -> tuple[int, str, bytes, str]:
+            size, fmt, thumb_img = job
+            thumb_stream = BytesIO()
+            thumb_img.save(thumb_stream, format=fmt)
+            return size, fmt, thumb_stream.getvalue(), thumb_img.mode
+
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+            return list(executor.map(_encode, jobs))
+
+
+# ---------------------------------------------------------------------------
+# On-demand variants
+# ---------------------------------------------------------------------------
+
+def _as_utc(value: datetime) -> datetime:
+    """Attach UTC to naive datetimes as loaded from the database."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def create_thumbnail_variant(image: Image, size: int) -> Thumbnail:
+    """Create an on-demand thumbnail of *image* fitting *size* × *size*.
+
+    The variant is resized from the smallest existing thumbnail that is at
+    least :data:`THUMBNAIL_REDUCING_GAP` times larger, or the original.  If
+    the image already has ``THUMBNAIL_VARIANTS_PER_IMAGE`` on-demand
+    variants, the least recently used ones are evicted first.  A size from
+    ``THUMBNAIL_SIZES`` is stored as a regular thumbnail instead, which
+    :func:`create_thumbnails` then counts as done and eviction never
+    removes.  Returns the new thumbnail (flushed but not committed).
+    """
+    on_demand = size not in current_app.config['THUMBNAIL_SIZES']
+    source = (
+        image.thumbnails
+        .filter(Thumbnail.is_primary(), Thumbnail.size >= size * THUMBNAIL_REDUCING_GAP)
+        .order_by(Thumbnail.size.asc())
+        .first()
+    )
+    source_bytes = _read_file(source.file if source is not None else image.file)
+
+    if on_demand:
+        cap = current_app.config['THUMBNAIL_VARIANTS_PER_IMAGE']
+        variants = (
+            image.thumbnails
+            .filter(Thumbnail.on_demand.is_(True))
+            .order_by(Thumbnail.last_accessed_at.asc())
+            .all()
         )
+        evict_thumbnails(variants[:max(len(variants) - cap + 1, 0)])
+
+    file_obj = image.file
+    unique_id = os.path.splitext(os.path.basename(file_obj.storage_key))[0]
+    [thumbnail] = _generate_thumbnails(
+        source_bytes, image, file_obj.storage_backend, unique_id, file_obj.original_filename,
+        image.width, image.height, sizes=[size],
+        formats=[current_app.config.get('IMAGE_DEFAULT_FORMAT', 'JPEG').upper()],
+    )
+    if on_demand:
+        thumbnail.on_demand = True
+        thumbnail.last_accessed_at = datetime.now(timezone.utc)
+    db.session.flush()
+    invalidate_thumbnail_index(image.id)
+    return thumbnail
 
-    return image_obj
+
+def touch_thumbnail_variant(thumbnail: Thumbnail) -> None:
+    """Record that an on-demand *thumbnail* was served (at most once per interval)."""
+    if not thumbnail.on_demand:
+        return
+    now = datetime.now(timezone.utc)
+    if thumbnail.last_accessed_at is None or _as_utc(thumbnail.last_accessed_at) < now - VARIANT_TOUCH_INTERVAL:
+        thumbnail.last_accessed_at = now
+        db.session.commit()
+
+
+def evict_thumbnails(thumbnails: list[Thumbnail]) -> int:
+    """Delete *thumbnails* with their files and storage objects; return how many were removed.
+
+    Storage deletion is best-effort: an object that cannot be deleted is
+    logged and its rows are removed anyway.  Does not commit.
+    """
+    image_ids = set()
+    for thumbnail in thumbnails:
+        file_obj = thumbnail.file
+        if file_obj is not None:
+            try:
+                file_obj.delete_from_storage()
+            except Exception as e:
+                current_app.logger.warning(f"Deleting thumbnail object {file_obj.storage_key} failed: {e}")
+        image_ids.add(thumbnail.image_id)
+        db.session.delete(thumbnail)
+        if file_obj is not None:
+            db.session.delete(file_obj)
+    db.session.flush()
+    invalidate_thumbnail_index(*image_ids)
+    return len(thumbnails)
+
+
+def regenerate_thumbnails(images: list[Image], executor: Executor) -> tuple[int, list[tuple[Image, Exception]]]:
+    """Bring the thumbnails of *images* in line with the current configuration.
+
+    The expected set is every ``THUMBNAIL_SIZES`` entry below the original's
+    dimensions in each of :func:`thumbnail_formats`.  Images whose
+    upload-time thumbnails already match are skipped.  For the others,
+    thumbnails outside the set (and on-demand variants that would share a
+    storage key with a new one) are evicted, and the missing encodings are
+    rendered on *executor*.  Originals are read here and rendering for the
+    whole batch runs concurrently.
+
+    Returns the number of images changed and the ``(image, error)`` pairs
+    that failed.  An image that fails to render keeps its thumbnails; one
+    that fails while storing may be left with fewer, until the next run.
+    Does not commit.
+    """
+    sizes = current_app.config['THUMBNAIL_SIZES']
+    formats = thumbnail_formats()
+    all_pairs = {(size, fmt) for size in sizes for fmt in formats}
+
+    by_pair: dict[int, dict[tuple[int, str], list[Thumbnail]]] = {image.id: {} for image in images}
+    for thumbnail in Thumbnail.query.filter(Thumbnail.image_id.in_(list(by_pair))):
+        pair = (thumbnail.size, (thumbnail.format or formats[0]).upper())
+        by_pair[thumbnail.image_id].setdefault(pair, []).append(thumbnail)
+
+    failures: list[tuple[Image, Exception]] = []
+    jobs: list[tuple[Image, list[Thumbnail], Future | None]] = []
+    for image in images:
+        if image.is_vector or image.file is None:
+            continue
+        max_dim = max(image.width or 0, image.height or 0)
+        expected = {(size, fmt) for size, fmt in all_pairs if size < max_dim}
+        stale: list[Thumbnail] = []
+        kept: set[tuple[int, str]] = set()
+        for pair, thumbnails in by_pair[image.id].items():
+            if pair not in expected:
+                stale.extend(t for t in thumbnails if not t.on_demand)
+            elif len(thumbnails) == 1 and not thumbnails[0].on_demand:
+                kept.add(pair)
+            else:
+                stale.extend(thumbnails)
+        missing = expected - kept
+        if not missing and not stale:
+            continue
+
+        future = None
+        if missing:
+            try:
+                file_bytes = _read_file(image.file)
+            except Exception as e:
+                failures.append((image, e))
+                continue
+            future = executor.submit(
+                _render_thumbnails, file_bytes, sorted({size for size, _fmt in missing}), formats, all_pairs - missing,
+            )
+        jobs.append((image, stale, future))
+
+    changed = 0
+    for image, stale, future in jobs:
+        try:
+            rendered = future.result() if future is not None else []
+            # Stale rows may share a storage key with a new encoding, so drop them first
+            evict_thumbnails(stale)
+            file_obj = image.file
+            unique_id = os.path.splitext(os.path.basename(file_obj.storage_key))[0]
+            db.session.add_all([
+                _store_thumbnail(image, file_obj.storage_backend, unique_id, file_obj.original_filename, *item)
+                for item in rendered
+            ])
+        except Exception as e:
+            failures.append((image, e))
+            continue
+        changed += 1
+
+    db.session.flush()
+    invalidate_thumbnail_index(*(image.id for image, _stale, _future in jobs))
+    return changed, failures
+
+
+def evict_idle_thumbnail_variants(max_idle_days: int) -> int:
+    """Evict on-demand variants not served for *max_idle_days*; return how many were removed."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_idle_days)
+    idle = Thumbnail.query.filter(
+        Thumbnail.on_demand.is_(True),
+        db.or_(Thumbnail.last_accessed_at.is_(None), Thumbnail.last_accessed_at < cutoff),
+    ).all()
+    return evict_thumbnails(idle)
 
 
 def _generate_thumbnails(
     file_bytes: bytes,
     image_obj: Image,
-    provider: object,
     storage_backend: str,
     unique_id: str,
     original_filename: str,
     width: int,
     height: int,
-) -> None:
-    """Create and store resized thumbnail versions of the original image."""
-    sizes: list[int] = current_app.config.get('THUMBNAIL_SIZES')
-    thumb_format: str = current_app.config.get('IMAGE_DEFAULT_FORMAT', 'JPEG')
+    skip: set[tuple[int, str]] | frozenset[tuple[int, str]] = frozenset(),
+    sizes: list[int] | None = None,
+    formats: list[str] | None = None,
+) -> list[Thumbnail]:
+    """Create and store resized thumbnail versions of the original image.
+
+    *sizes* defaults to ``THUMBNAIL_SIZES`` and *formats* to
+    :func:`thumbnail_formats`; *(size, format)* pairs in *skip* are left out.
+    """
+    if sizes is None:
+        sizes = current_app.config.get('THUMBNAIL_SIZES')
+    if formats is None:
+        formats = thumbnail_formats()
     max_dim = max(width, height)
+    wanted = [size for size in sizes
+              if size < max_dim and any((size, fmt) not in skip for fmt in formats)]
+    thumbnails = [
+        _store_thumbnail(image_obj, storage_backend, unique_id, original_filename, *rendered)
+        for rendered in _render_thumbnails(file_bytes, wanted, formats, skip)
+    ]
+    db.session.add_all(thumbnails)
+    db.session.flush()
+    return thumbnails
 
-    with ImagePIL.open(BytesIO(file_bytes)) as pil_img:
-        if pil_img.mode == 'RGBA':
-            background = ImagePIL.new('RGB', pil_img.size, (255, 255, 255))
-            background.paste(pil_img, mask=pil_img.split()[3])
-            pil_img = background
-
-        for size in sizes:
-            if size >= max_dim:
-                continue
-
-            thumb_img = pil_img.copy()
-            thumb_img.thumbnail((size, size))
-
-            thumb_stream = BytesIO()
-            thumb_img.save(thumb_stream, format=thumb_format)
-            thumb_stream.seek(0)
-
-            raw_thumb_key = f"{current_app.config.get('IMAGE_TIMG_PATH')}/{unique_id}_{size}.{thumb_format.lower()}"
-            thumb_key = re.sub(r'/+', '/', raw_thumb_key.replace('\\', '/')).lstrip('/')
-            thumb_mime = f"image/{thumb_format.lower()}"
-
-            thumb_file = File(
-                original_filename=f"thumb_{size}_{original_filename}",
-                storage_backend=storage_backend,
-                storage_key=thumb_key,
-                mime_type=thumb_mime,
-                file_size=len(thumb_stream.getvalue()),
-                file_hash=compute_file_hash(thumb_stream),
-                hash_algorithm='sha256',
-            )
 
-            thumb_stream.seek(0)
-            provider.save(thumb_key, thumb_stream, thumb_mime)
+def _store_thumbnail(
+    image_obj: Image,
+    storage_backend: str,
+    unique_id: str,
+    original_filename: str,
+    size: int,
+    thumb_format: str,
+    thumb_bytes: bytes,
+    thumb_mode: str,
+) -> Thumbnail:
+    """Save one encoded thumbnail to storage and return its new (unadded) row."""
+    thumb_stream = BytesIO(thumb_bytes)
+
+    raw_thumb_key = f"{current_app.config.get('IMAGE_TIMG_PATH')}/{unique_id}_{size}.{thumb_format.lower()}"
+    thumb_key = re.sub(r'/+', '/', raw_thumb_key.replace('\\', '/')).lstrip('/')
+    thumb_mime = f"image/{thumb_format.lower()}"
+
+    thumb_file = File(
+        original_filename=f"thumb_{size}_{original_filename}",
+        storage_backend=storage_backend,
+        storage_key=thumb_key,
+        mime_type=thumb_mime,
+        file_size=len(thumb_bytes),
+        file_hash=compute_file_hash(thumb_stream),
+        hash_algorithm='sha256',
+    )
 
-            db.session.add(thumb_file)
-            db.session.flush()
+    thumb_stream.seek(0)
+    thumb_file.save_content(thumb_stream)
 
-            thumbnail_obj = Thumbnail(
-                image=image_obj,
-                size=size,
-                file_obj=thumb_file,
-            )
-            thumbnail_obj.format = thumb_format
-            thumbnail_obj.mode = thumb_img.mode
-            db.session.add(thumbnail_obj)
+    thumbnail_obj = Thumbnail(
+        image=image_obj,
+        size=size,
+        file_obj=thumb_file,
+    )
+    thumbnail_obj.format = thumb_format
+    thumbnail_obj.mode = thumb_mode
+    return thumbnail_obj
@@ -1,32 +1,42 @@
 # coding=utf-8
-"""Media routes for serving files with Redis caching."""
+"""Media routes for serving stored files."""
 
 from __future__ import annotations
 
-from io import BytesIO
-
-from flask import send_file, abort
+from flask import abort
 
 from app.media import bp
-from app.services.media_service import get_file_bytes
+from app.media.serving import send_media_file
+from app.services.media_service import get_variant_file_id
 
 
 @bp.route('/<int:file_id>')
 def serve_file(file_id: int) -> object:
-    """Serve a file by its database ID, using a two-tier cache strategy.
+    """Serve a file by its database ID.
 
-    Tier 1: Redis in-memory cache (24 h TTL, max 5 MB per file).
-    Tier 2: Browser cache via ``max_age`` (1 year).
-    Falls back to the storage provider on cache miss.
+    Answers ``If-None-Match`` with 304 from the file hash alone, sends local
+    files from disk, redirects to presigned S3 URLs or streams large S3
+    objects in chunks and honours ``Range`` requests (see
+    :mod:`app.media.serving`).
+    Browser cache via ``max_age`` (1 year).
     """
-    result = get_file_bytes(file_id)
-    if result is None:
+    response = send_media_file(file_id)
+    if response is None:
         abort(404)
+    return response
+
+
+@bp.route('/<int:file_id>/w/<int:width>')
+def serve_variant(file_id: int, width: int) -> object:
+    """Serve image file *file_id* resized to fit *width* × *width* pixels.
 
-    return send_file(
-        BytesIO(result.file_bytes),
-        mimetype=result.mime_type,
-        as_attachment=False,
-        download_name=result.original_filename,
-        max_age=31536000,
-    )
+    The variant is generated and stored on first request and served from
+    storage afterwards.  Widths other than :func:`~app.models.variant_sizes`,
+    or any width while ``THUMBNAIL_VARIANTS`` is off, return 404; see
+    :func:`~app.services.media_service.get_variant_file_id`.
+    """
+    variant_id = get_variant_file_id(file_id, width)
+    response = send_media_file(variant_id) if variant_id is not None else None
+    if response is None:
+        abort(404)
+    return response
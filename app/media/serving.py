@@ -0,0 +1,297 @@
+# coding=utf-8
+"""HTTP responses for stored media files.
+
+Shared by :func:`app.media.routes.serve_file` and the media REST API.
+
+* Thumbnails with WebP/AVIF encodings are negotiated from the ``Accept``
+  header (``Vary: Accept``); the primary format is the fallback.
+* ``If-None-Match`` matching the file's SHA-256 hash (its strong ETag) is
+  answered with ``304`` before storage or Redis are touched.
+* Local files are sent straight from disk, or handed to the reverse proxy
+  with ``X-Accel-Redirect``/``X-Sendfile`` when ``MEDIA_SENDFILE_HEADER``
+  is set.
+* With ``MEDIA_S3_REDIRECT`` S3 objects are answered with a ``302`` to a
+  presigned bucket URL, so their bytes never pass through the app.
+* Otherwise small S3 objects go through the Redis cache; larger ones are
+  piped from S3 in chunks instead of being buffered in memory.  With
+  ``MEDIA_DISK_CACHE_PATH`` both are also kept in the node's disk cache and
+  served from there on later requests.
+* ``Range`` requests are honoured in all cases.
+"""
+
+from __future__ import annotations
+
+import os
+import unicodedata
+from collections.abc import Iterator
+from io import BytesIO
+from typing import IO
+from urllib.parse import quote
+
+from flask import Response, current_app, redirect, request, send_file, stream_with_context
+
+from app.media.disk_cache import PendingEntry
+from app.models import THUMBNAIL_ALTERNATE_MIME_TYPES, File
+from app.services.media_service import (
+    MEDIA_CACHE_MAX_BYTES,
+    PRESIGNED_URL_REUSE,
+    get_cached_file_bytes,
+    get_disk_cache_for,
+    get_file,
+    get_file_alternatives,
+    get_presigned_url,
+    open_file_stream,
+)
+
+MEDIA_MAX_AGE = 31536000
+"""Browser cache lifetime for media files (1 year); files are immutable per ID."""
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+SENDFILE_HEADERS = ('X-Accel-Redirect', 'X-Sendfile')
+
+
+def _set_cache_headers(response: Response, file_obj: File) -> None:
+    if file_obj.file_hash:
+        response.set_etag(file_obj.file_hash)
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+
+
+def _not_modified(file_obj: File) -> Response:
+    response = Response(status=304)
+    _set_cache_headers(response, file_obj)
+    return response
+
+
+def _content_disposition_params(filename: str | None) -> dict[str, str]:
+    """Return ``Content-Disposition`` parameters for *filename*, as ``send_file`` builds them."""
+    if not filename:
+        return {}
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    return {'filename': filename}
+
+
+def _iter_stream(stream: IO[bytes], length: int) -> Iterator[bytes]:
+    """Yield at most *length* bytes of *stream* in chunks, then close it."""
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        stream.close()
+
+
+def _iter_into_cache(chunks: Iterator[bytes], entry: PendingEntry, size: int) -> Iterator[bytes]:
+    """Yield *chunks* while copying them into *entry*, which is kept only if all *size* bytes arrived."""
+    caching = True
+    with entry:
+        for chunk in chunks:
+            if caching:
+                try:
+                    entry.write(chunk)
+                except OSError as e:
+                    current_app.logger.warning(f"Disk cache write failed: {e}")
+                    caching = False
+            yield chunk
+        if caching and entry.size == size:
+            try:
+                entry.commit()
+            except OSError as e:
+                current_app.logger.warning(f"Disk cache write failed: {e}")
+
+
+def _send_from_disk_cache(file_obj: File) -> Response | None:
+    """Send *file_obj* from the disk cache, or return ``None`` on a miss."""
+    disk_cache = get_disk_cache_for(file_obj)
+    if disk_cache is None:
+        return None
+    try:
+        cached_path = disk_cache.get_path(file_obj.file_hash)
+        if cached_path is None:
+            return None
+        return send_file(
+            cached_path,
+            mimetype=file_obj.mime_type,
+            as_attachment=False,
+            download_name=file_obj.original_filename,
+            conditional=True,
+            etag=file_obj.file_hash,
+            max_age=MEDIA_MAX_AGE,
+        )
+    except OSError as e:
+        # Includes an entry evicted by another worker after the lookup
+        current_app.logger.warning(f"Disk cache read failed: {e}")
+        return None
+
+
+def _stream_file(file_obj: File) -> Response | None:
+    """Stream *file_obj* from storage, honouring a single-range ``Range`` header.
+
+    Complete (non-range) transfers are copied into the disk cache on the way.
+    """
+    response = _send_from_disk_cache(file_obj)
+    if response is not None:
+        return response
+
+    size = file_obj.file_size
+    byte_range = request.range
+    if_range = request.if_range
+    if byte_range is not None and (if_range.etag or if_range.date):
+        # Only resume from the same representation
+        if if_range.etag != file_obj.file_hash:
+            byte_range = None
+
+    start, stop, status = 0, size, 200
+    if byte_range is not None:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        start, stop = bounds
+        status = 206
+
+    stream = open_file_stream(file_obj, start=start)
+    if stream is None:
+        return None
+
+    chunks = _iter_stream(stream, stop - start)
+    disk_cache = get_disk_cache_for(file_obj)
+    if disk_cache is not None and status == 200:
+        try:
+            chunks = _iter_into_cache(chunks, disk_cache.begin(file_obj.file_hash), size)
+        except OSError as e:
+            current_app.logger.warning(f"Disk cache write failed: {e}")
+
+    response = Response(
+        stream_with_context(chunks),
+        status=status,
+        mimetype=file_obj.mime_type,
+        direct_passthrough=True,
+    )
+    response.content_length = stop - start
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    response.accept_ranges = 'bytes'
+    response.headers.set('Content-Disposition', 'inline', **_content_disposition_params(file_obj.original_filename))
+    _set_cache_headers(response, file_obj)
+    return response
+
+
+def _offload_file(file_obj: File, local_path: str, header: str) -> Response:
+    """Return an empty response telling the reverse proxy to send the file.
+
+    nginx (``X-Accel-Redirect``) receives the internal location
+    ``MEDIA_SENDFILE_PREFIX`` + storage key; Apache (``X-Sendfile``) the
+    absolute path.  The proxy handles ``Range`` and missing files.
+    """
+    if header == 'X-Accel-Redirect':
+        prefix = current_app.config['MEDIA_SENDFILE_PREFIX'].rstrip('/')
+        target = f"{prefix}/{quote(file_obj.storage_key.lstrip('/'))}"
+    else:
+        target = os.path.abspath(local_path)
+
+    response = Response(mimetype=file_obj.mime_type)
+    response.headers[header] = target
+    response.headers.set('Content-Disposition', 'inline', **_content_disposition_params(file_obj.original_filename))
+    _set_cache_headers(response, file_obj)
+    return response
+
+
+def _redirect_to_presigned(file_obj: File) -> Response | None:
+    """Redirect to a presigned URL of *file_obj*, or return ``None`` if none is available.
+
+    The redirect may only be cached by the browser for as long as the URL is
+    guaranteed to stay valid.
+    """
+    url = get_presigned_url(file_obj)
+    if url is None:
+        return None
+    response = redirect(url, code=302)
+    response.cache_control.private = True
+    ttl = current_app.config['MEDIA_PRESIGNED_URL_TTL']
+    response.cache_control.max_age = ttl - int(ttl * PRESIGNED_URL_REUSE)
+    return response
+
+
+def _negotiate_format(file_obj: File, alternatives: dict[str, File]) -> File:
+    """Return the preferred alternate encoding the client accepts, else *file_obj*.
+
+    Only MIME types named explicitly in ``Accept`` count: ``*/*`` and
+    ``image/*`` say nothing about decoder support.
+    """
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    for mime_type in THUMBNAIL_ALTERNATE_MIME_TYPES.values():
+        if mime_type in accepted and mime_type in alternatives:
+            return alternatives[mime_type]
+    return file_obj
+
+
+def send_media_file(file_id: int) -> Response | None:
+    """Return the response serving file *file_id*, or ``None`` if it is missing or unreadable."""
+    file_obj = get_file(file_id)
+    if file_obj is None:
+        return None
+
+    alternatives = get_file_alternatives(file_obj)
+    if not alternatives:
+        return _send_stored_file(file_obj)
+    response = _send_stored_file(_negotiate_format(file_obj, alternatives))
+    if response is not None:
+        response.vary.add('Accept')
+    return response
+
+
+def _send_stored_file(file_obj: File) -> Response | None:
+    if file_obj.file_hash and request.if_none_match.contains_weak(file_obj.file_hash):
+        return _not_modified(file_obj)
+
+    local_path = file_obj.get_provider().get_local_path(file_obj.storage_key)
+    if local_path is not None:
+        configured = (current_app.config.get('MEDIA_SENDFILE_HEADER') or '').lower()
+        header = next((h for h in SENDFILE_HEADERS if h.lower() == configured), None)
+        if header is not None:
+            return _offload_file(file_obj, local_path, header)
+        if not os.path.isfile(local_path):
+            file_obj.mark_read_error(FileNotFoundError(local_path))
+            return None
+        file_obj.clear_read_error()
+        return send_file(
+            os.path.abspath(local_path),
+            mimetype=file_obj.mime_type,
+            as_attachment=False,
+            download_name=file_obj.original_filename,
+            conditional=True,
+            etag=file_obj.file_hash or True,
+            max_age=MEDIA_MAX_AGE,
+        )
+
+    if current_app.config.get('MEDIA_S3_REDIRECT'):
+        response = _redirect_to_presigned(file_obj)
+        if response is not None:
+            return response
+
+    if file_obj.file_size is not None and file_obj.file_size > MEDIA_CACHE_MAX_BYTES:
+        return _stream_file(file_obj)
+
+    result = get_cached_file_bytes(file_obj)
+    if result is None:
+        return None
+    return send_file(
+        BytesIO(result.file_bytes),
+        mimetype=result.mime_type,
+        as_attachment=False,
+        download_name=result.original_filename,
+        conditional=True,
+        etag=file_obj.file_hash or False,
+        max_age=MEDIA_MAX_AGE,
+    )
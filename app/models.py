@@ -13,7 +13,7 @@ import uuid
 from datetime import datetime, timedelta, timezone
 from hashlib import md5
 from time import time
-from typing import Any
+from typing import IO, Any
 
 import jwt
 import redis
@@ -24,13 +24,18 @@ from flask_login import UserMixin
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import validates
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.types import CHAR, String, TypeDecorator
 from sqlalchemy_utils.types.uuid import UUIDType
 from webauthn.helpers.structs import AuthenticatorTransport
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db, login
-from app.storage import get_storage_provider
+from app.balance import BalanceSheet, build_balance_sheet, plan_minimal_transfers
+from app.balance_ledger import read_ledger_sheet
+from app.rates import EventRates
+from app.storage import content_addressed_key, get_storage_provider
+from app.thumbnails import get_thumbnail_index, resolve_thumbnail_url
 
 
 # ---------------------------------------------------------------------------
@@ -139,6 +144,11 @@ class Entity:
         return cls.query.filter(cls.guid == guid).first_or_404()
 
 
+def _exists(*criteria: Any) -> bool:
+    """Return whether a row matching *criteria* exists, using ``SELECT EXISTS``."""
+    return bool(db.session.scalar(db.select(db.exists().where(*criteria))))
+
+
 # ---------------------------------------------------------------------------
 # Models
 # ---------------------------------------------------------------------------
@@ -203,6 +213,35 @@ MISSING_IMAGE_DATA_URI = (
 )
 """Visible placeholder used when a file's backing object cannot be read."""
 
+THUMBNAIL_ALTERNATE_MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp'}
+"""Optional thumbnail encodings served by content negotiation, most preferred first."""
+
+
+def alternate_thumbnail_formats() -> list[str]:
+    """Return the :data:`THUMBNAIL_ALTERNATE_MIME_TYPES` formats that are not ``IMAGE_DEFAULT_FORMAT``.
+
+    With ``IMAGE_DEFAULT_FORMAT=WEBP`` the WebP thumbnails are the primary
+    encoding and only AVIF ones are alternates.
+    """
+    primary = current_app.config.get('IMAGE_DEFAULT_FORMAT', 'JPEG').upper()
+    return [fmt for fmt in THUMBNAIL_ALTERNATE_MIME_TYPES if fmt != primary]
+
+
+def variant_sizes() -> list[int]:
+    """Return the sizes the ``/w/<width>`` endpoint serves, ascending.
+
+    These are ``THUMBNAIL_SIZES`` and ``THUMBNAIL_VARIANT_SIZES``; the app
+    only links to these, and any other width is refused rather than
+    generated, so anonymous clients cannot make it encode and store images
+    of arbitrary sizes.
+    """
+    return sorted({*current_app.config['THUMBNAIL_SIZES'], *current_app.config['THUMBNAIL_VARIANT_SIZES']})
+
+
+def variant_size_for(desired_size: int) -> int | None:
+    """Return the smallest of :func:`variant_sizes` that is at least *desired_size*, or ``None``."""
+    return next((size for size in variant_sizes() if size >= desired_size), None)
+
 
 class File(Entity, db.Model):
     """Metadata record for a file stored via :class:`~app.storage.StorageProvider`."""
@@ -211,7 +250,8 @@ class File(Entity, db.Model):
 
     original_filename = db.Column(db.String(256))
     storage_backend = db.Column(db.String(32), default='local', index=True)
-    storage_key = db.Column(db.String(512), unique=True, index=True)
+    storage_key = db.Column(db.String(512), index=True)
+    """Object key within :attr:`storage_backend`; rows with identical content may share one."""
     mime_type = db.Column(db.String(128))
     file_size = db.Column(db.Integer)
     file_hash = db.Column(db.String(128), index=True)
@@ -254,7 +294,17 @@ class File(Entity, db.Model):
 
     def get_url(self) -> str:
         """Return the internal Flask route to securely serve this file."""
-        return url_for('media.serve_file', file_id=self.id)
+        return self.url_for_id(self.id)
+
+    @staticmethod
+    def url_for_id(file_id: int) -> str:
+        """Return the route serving the file *file_id* without loading it."""
+        return url_for('media.serve_file', file_id=file_id)
+
+    @staticmethod
+    def variant_url_for_id(file_id: int, size: int) -> str:
+        """Return the route serving image file *file_id* resized to fit *size* pixels."""
+        return url_for('media.serve_variant', file_id=file_id, width=size)
 
     def mark_read_error(self, error: Exception) -> None:
         """Flag this file as unreadable and log the failure.
@@ -323,8 +373,55 @@ class File(Entity, db.Model):
         """Return the local filesystem path (useful for image processing)."""
         return self.get_provider().get_local_path(self.storage_key)
 
+    def save_content(self, file_stream: IO[bytes]) -> None:
+        """Upload *file_stream* as the content of this file.
+
+        With ``STORAGE_CONTENT_ADDRESSED`` the key is replaced by
+        :func:`~app.storage.content_addressed_key` of :attr:`file_hash`.  The
+        upload is skipped only if another readable row references that key
+        and the object is actually there; otherwise it is (re)written.
+        """
+        if current_app.config.get('STORAGE_CONTENT_ADDRESSED') and self.file_hash:
+            self.storage_key = content_addressed_key(self.file_hash, self.hash_algorithm or 'sha256')
+            readable = [file_id for file_id, read_error in self._lock_other_references() if not read_error]
+            if readable and self.get_provider().exists(self.storage_key):
+                return
+        self.get_provider().save(self.storage_key, file_stream, self.mime_type)
+
+    def _lock_other_references(self) -> list[tuple[int, bool | None]]:
+        """Return *(id, read_error)* of the other rows pointing at this file's object.
+
+        All rows of the key, this one included, are locked with
+        ``SELECT … FOR UPDATE`` until the transaction ends.  An upload that
+        relies on an existing object and a deletion of that object therefore
+        cannot interleave: whichever comes second sees the other's outcome.
+        """
+        query = (
+            db.session.query(File.id, File.read_error)
+            .filter(File.storage_backend == self.storage_backend, File.storage_key == self.storage_key)
+            .with_for_update()
+        )
+        if self.id is None:
+            # Autoflushing would insert this row and count it as well
+            with db.session.no_autoflush:
+                rows = query.all()
+        else:
+            rows = query.all()
+        return [(file_id, read_error) for file_id, read_error in rows if file_id != self.id]
+
+    def count_other_references(self) -> int:
+        """Return how many other rows point at the same stored object.
+
+        Objects are shared between rows by content addressing and by
+        ``flask dbmaint collapse-duplicate-files``; the rows are their
+        reference count.
+        """
+        return len(self._lock_other_references())
+
     def delete_from_storage(self) -> None:
-        """Delete the actual file from the underlying storage backend."""
+        """Delete the actual file from the storage backend, unless other rows still reference it."""
+        if self._lock_other_references():
+            return
         self.get_provider().delete(self.storage_key)
 
 
@@ -341,6 +438,8 @@ class Thumbnail(Entity, db.Model):
     mode = db.Column(db.String(8))
     image_id = db.Column(db.Integer, db.ForeignKey('images.id'), index=True)
     image = db.relationship('Image', foreign_keys=image_id, back_populates='thumbnails')
+    on_demand = db.Column(db.Boolean)
+    last_accessed_at = db.Column(db.DateTime)
 
     def __init__(self, image: Image, size: int, file_obj: File,
                  db_created_by: str = 'SYSTEM') -> None:
@@ -365,6 +464,11 @@ class Thumbnail(Entity, db.Model):
             return self.file.get_url()
         return ''
 
+    @classmethod
+    def is_primary(cls) -> ColumnElement[bool]:
+        """SQL filter excluding alternate encodings (see :func:`alternate_thumbnail_formats`)."""
+        return db.or_(cls.format.is_(None), cls.format.notin_(alternate_thumbnail_formats()))
+
 
 class Image(Entity, db.Model):
     """An uploaded image with associated :class:`Thumbnail` variants."""
@@ -427,7 +531,7 @@ class Image(Entity, db.Model):
 
     def get_thumbnail(self, desired_size: int) -> Thumbnail | None:
         """Return the smallest thumbnail larger than *desired_size*, or ``None``."""
-        thumbnails = self.thumbnails.order_by(Thumbnail.size.asc()).all()
+        thumbnails = self.thumbnails.filter(Thumbnail.is_primary()).order_by(Thumbnail.size.asc()).all()
         if not self.is_vector:
             for thumbnail in thumbnails:
                 if thumbnail.size > desired_size:
@@ -435,7 +539,12 @@ class Image(Entity, db.Model):
         return None
 
     def get_thumbnail_url(self, desired_size: int) -> str:
-        """Return the URL for the best-matching thumbnail, falling back to the full image."""
+        """Return the URL for the best-matching thumbnail, falling back to the full image.
+
+        Resolved through the cached thumbnail index (see :mod:`app.thumbnails`).
+        """
+        if self.id is not None:
+            return resolve_thumbnail_url(self.id, desired_size)
         thumbnail = self.get_thumbnail(desired_size)
         if thumbnail:
             return thumbnail.get_url()
@@ -447,6 +556,11 @@ class Image(Entity, db.Model):
         Mirrors :meth:`get_thumbnail_url` but reads bytes directly from storage
         so it is safe to call from RQ background tasks (no request context needed).
         """
+        entry = get_thumbnail_index([self.id]).get(self.id) if self.id is not None else None
+        if entry is not None:
+            file_id = entry.file_id_for(desired_size)
+            file_obj = db.session.get(File, file_id) if file_id is not None else None
+            return file_obj.get_data_uri() if file_obj else ''
         thumbnail = self.get_thumbnail(desired_size)
         if thumbnail and thumbnail.file:
             return thumbnail.file.get_data_uri()
@@ -504,6 +618,36 @@ class EventCurrency(db.Model):
         return f'{eventcurrency.currency.code} {converted:.{exponent}f}'
 
 
+class EventBalance(db.Model):
+    """Running balance totals of an :class:`EventUser` in the event's base currency.
+
+    Maintained incrementally by :mod:`app.balance_ledger`; only confirmed
+    settlements are included.
+    """
+
+    __tablename__ = 'event_balances'
+
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), primary_key=True)
+    eventuser_id = db.Column(db.Integer, db.ForeignKey('eventusers.id'), primary_key=True)
+    eventuser = db.relationship('EventUser')
+    paid = db.Column(db.Float)
+    spent = db.Column(db.Float)
+    sent = db.Column(db.Float)
+    received = db.Column(db.Float)
+
+    def __init__(self, event_id: int, eventuser_id: int, paid: float = 0.0, spent: float = 0.0,
+                 sent: float = 0.0, received: float = 0.0) -> None:
+        self.event_id = event_id
+        self.eventuser_id = eventuser_id
+        self.paid = paid
+        self.spent = spent
+        self.sent = sent
+        self.received = received
+
+    def __repr__(self) -> str:
+        return f'<EventBalance {self.event_id}/{self.eventuser_id}>'
+
+
 class Currency(Entity, db.Model):
     """A real-world currency with its exchange rate to CHF."""
 
@@ -553,11 +697,18 @@ class Currency(Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this currency's flag thumbnail."""
-        if self.image:
-            return self.image.get_thumbnail_url(size)
+        if self.image_id:
+            return resolve_thumbnail_url(self.image_id, size)
         return ''
 
 
+SETTLEMENT_MODE_ACCOUNTANT = 'accountant'
+"""Settlement mode routing every debt through the event's accountant (default)."""
+SETTLEMENT_MODE_MINIMAL = 'minimal'
+"""Settlement mode using the fewest direct transfers between participants."""
+SETTLEMENT_MODES = (SETTLEMENT_MODE_ACCOUNTANT, SETTLEMENT_MODE_MINIMAL)
+
+
 class Event(Entity, db.Model):
     """A shared-expense event grouping users, expenses and settlements."""
 
@@ -581,6 +732,7 @@ class Event(Entity, db.Model):
         viewonly=True,
     )
     exchange_fee = db.Column(db.Float)
+    settlement_mode = db.Column(db.String(16))
     users = db.relationship('EventUser', foreign_keys='EventUser.event_id',
                             back_populates='event', lazy='dynamic')
     eventcurrencies = db.relationship('EventCurrency', back_populates='event',
@@ -598,6 +750,7 @@ class Event(Entity, db.Model):
     def __init__(self, name: str, date: datetime, admin: User, base_currency: Currency,
                  currencies: list[Currency], exchange_fee: float, fileshare_link: str,
                  closed: bool = False, description: str = '',
+                 settlement_mode: str = SETTLEMENT_MODE_ACCOUNTANT,
                  db_created_by: str = 'SYSTEM') -> None:
         Entity.__init__(self, db_created_by)
         self.name = name
@@ -609,6 +762,7 @@ class Event(Entity, db.Model):
         self.closed = closed
         self.fileshare_link = fileshare_link
         self.description = description
+        self.settlement_mode = settlement_mode
 
     def __repr__(self) -> str:
         return f'<Event {self.name}>'
@@ -629,8 +783,8 @@ class Event(Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this event's thumbnail."""
-        if self.image:
-            return self.image.get_thumbnail_url(size)
+        if self.image_id:
+            return resolve_thumbnail_url(self.image_id, size)
         return ''
 
     def avatar_data_uri(self, size: int) -> str:
@@ -653,61 +807,109 @@ class Event(Entity, db.Model):
 
     def has_user(self, user: EventUser) -> bool:
         """Return whether *user* is a participant in this event."""
-        return user in self.users
+        if self.id is None or user.id is None:
+            return user in self.users
+        return _exists(EventUser.id == user.id, EventUser.event_id == self.id)
 
     def add_user(self, user: EventUser) -> None:
         """Add *user* to this event if not already present."""
         if not self.has_user(user):
             self.users.append(user)
 
+    def is_user_blocked(self, user: EventUser) -> bool:
+        """Return whether *user* paid an expense or sent/received a settlement in this event."""
+        return (
+            _exists(Expense.event_id == self.id, Expense.user_id == user.id)
+            or _exists(Settlement.event_id == self.id,
+                       db.or_(Settlement.sender_id == user.id, Settlement.recipient_id == user.id))
+        )
+
     def remove_user(self, user: EventUser) -> int:
         """Remove *user* from this event. Returns 0 on success, 1 if blocked."""
-        blocked_users = set(
-            [x.user for x in self.expenses]
-            + [x.sender for x in self.settlements]
-            + [x.recipient for x in self.settlements]
-        )
-        if self.has_user(user) and user not in blocked_users:
+        if self.has_user(user) and not self.is_user_blocked(user):
             self.users.remove(user)
             return 0
         return 1
 
     def has_currency(self, currency: Currency) -> bool:
         """Return whether *currency* is assigned to this event."""
-        return currency in self.currencies
+        if self.id is None or currency.id is None:
+            return currency in self.currencies
+        return _exists(EventCurrency.event_id == self.id, EventCurrency.currency_id == currency.id)
 
     def add_currency(self, currency: Currency) -> None:
         """Add *currency* to this event if not already present."""
         if not self.has_currency(currency):
             self.currencies.append(currency)
 
+    def is_currency_blocked(self, currency: Currency) -> bool:
+        """Return whether *currency* is the base currency or used by an expense or settlement."""
+        return (
+            currency.id == self.base_currency_id
+            or _exists(Expense.event_id == self.id, Expense.currency_id == currency.id)
+            or _exists(Settlement.event_id == self.id, Settlement.currency_id == currency.id)
+        )
+
     def remove_currency(self, currency: Currency) -> int:
         """Remove *currency* from this event. Returns 0 on success, 1 if blocked."""
-        blocked_currencies = set(
-            [x.currency for x in self.expenses]
-            + [x.currency for x in self.settlements]
-            + [self.base_currency]
-        )
-        if self.has_currency(currency) and currency not in blocked_currencies:
-            self.currencies.remove(currency)
+        if self.has_currency(currency) and not self.is_currency_blocked(currency):
+            self.eventcurrencies.remove(db.session.get(EventCurrency, (self.id, currency.id)))
             return 0
         return 1
 
     def convert_currencies_to_base(self) -> None:
-        """Convert all expenses and settlements to the base currency in-place."""
-        with db.session.no_autoflush:
-            expenses = self.expenses.all()
-            settlements = self.settlements.all()
+        """Convert all expenses and settlements to the base currency in-place.
+
+        Issues one set-based ``UPDATE`` per table; the rate of each row's
+        currency is looked up with a correlated subquery on
+        ``event_currencies``.  Nothing is committed.
+
+        Raises :class:`ValueError`, before anything is converted, if a row
+        uses a currency the event has no rate for.
+        """
+        db.session.flush()
+        base_rate = self.base_eventcurrency.inCHF
+        factor = 1 + (self.exchange_fee or 0) / 100
+
+        def has_rate(model: type[Expense] | type[Settlement]):
+            return db.exists().where(EventCurrency.event_id == self.id,
+                                     EventCurrency.currency_id == model.currency_id)
+
+        for model in (Expense, Settlement):
+            orphaned = db.session.scalar(
+                db.select(db.func.count()).select_from(model)
+                .where(model.event_id == self.id,
+                       model.currency_id != self.base_currency_id,
+                       ~has_rate(model))
+            )
+            if orphaned:
+                raise ValueError(f'{orphaned} {model.__tablename__} of event {self.guid} '
+                                 f'use a currency without an exchange rate')
+
+        for model in (Expense, Settlement):
+            rate = (
+                db.select(EventCurrency.inCHF)
+                .where(EventCurrency.event_id == self.id,
+                       EventCurrency.currency_id == model.currency_id)
+                .scalar_subquery()
+            )
+            db.session.execute(
+                db.update(model)
+                .where(model.event_id == self.id,
+                       model.currency_id != self.base_currency_id,
+                       has_rate(model))
+                .values(amount=model.amount * factor * rate / base_rate,
+                        currency_id=self.base_currency_id)
+                .execution_options(synchronize_session=False)
+            )
 
-        for x in expenses:
-            x.amount = x.eventcurrency.get_amount_in(
-                x.amount, self.base_eventcurrency, self.exchange_fee)
-            x.currency = self.base_currency
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, (Expense, Settlement)) and obj.event_id == self.id:
+                db.session.expire(obj)
 
-        for x in settlements:
-            x.amount = x.eventcurrency.get_amount_in(
-                x.amount, self.base_eventcurrency, self.exchange_fee)
-            x.currency = self.base_currency
+    def get_rates(self) -> EventRates:
+        """Return this event's currency rate table, loaded in a single query."""
+        return EventRates.for_event(self)
 
     def get_currencies_str(self) -> str:
         """Return a comma-separated string of sorted currency codes."""
@@ -756,53 +958,127 @@ class Event(Entity, db.Model):
         balance = amount_paid - amount_spent + amount_sent - amount_received
         return (user, amount_paid, amount_spent, amount_sent, amount_received, balance)
 
-    def get_compensation_settlements_accountant(self) -> list[Settlement]:
-        """Generate draft settlements that zero out all balances via the accountant."""
-        with db.session.no_autoflush:
-            users = [u for u in self.users if u != self.accountant]
-        settlements: list[Settlement] = []
+    def get_balance_sheet(self) -> BalanceSheet:
+        """Return the balances of all participants.
+
+        Reads the maintained ledger (see :mod:`app.balance_ledger`) and falls
+        back to computing the balances (see :mod:`app.balance`) if the event
+        has no complete ledger.
+        """
+        sheet = read_ledger_sheet(self)
+        if sheet is None:
+            sheet = build_balance_sheet(self)
+        return sheet
+
+    def get_compensation_plan(self, sheet: BalanceSheet | None = None) -> list[tuple[EventUser, EventUser, float]]:
+        """Return *(sender, recipient, amount)* transfers that zero out all balances.
+
+        With :data:`SETTLEMENT_MODE_MINIMAL` participants pay each other
+        directly in at most N−1 transfers; otherwise every debt is routed
+        through the accountant.
+        """
+        if sheet is None:
+            sheet = self.get_balance_sheet()
         tolerance = 10 ** -self.base_currency.exponent
 
-        for user in users:
-            balance_item = self.get_user_balance(user)
-            balance = balance_item[5]
+        if self.settlement_mode == SETTLEMENT_MODE_MINIMAL:
+            users = sheet.eventusers
+            return [
+                (users[sender], users[recipient], amount)
+                for sender, recipient, amount in plan_minimal_transfers(sheet.balance, tolerance)
+            ]
+
+        plan: list[tuple[EventUser, EventUser, float]] = []
+
+        for balance_item in sheet.rows():
+            user, balance = balance_item[0], balance_item[5]
+            if user == self.accountant:
+                continue
             if balance < -tolerance:
-                settlements.append(Settlement(
-                    sender=user, recipient=self.accountant, event=self,
-                    currency=self.base_currency, amount=-balance, draft=True,
-                    date=datetime.now(timezone.utc)))
+                plan.append((user, self.accountant, -balance))
             elif balance > tolerance:
-                settlements.append(Settlement(
-                    sender=self.accountant, recipient=user, event=self,
-                    currency=self.base_currency, amount=balance, draft=True,
-                    date=datetime.now(timezone.utc)))
+                plan.append((self.accountant, user, balance))
 
-        return settlements
+        return plan
 
-    def calculate_balance(self) -> list[Settlement]:
+    def get_compensation_settlements_accountant(self, sheet: BalanceSheet | None = None) -> list[Settlement]:
+        """Generate draft settlements that zero out all balances via the accountant."""
+        return [
+            Settlement(sender=sender, recipient=recipient, event=self,
+                       currency=self.base_currency, amount=amount, draft=True,
+                       date=datetime.now(timezone.utc))
+            for sender, recipient, amount in self.get_compensation_plan(sheet)
+        ]
+
+    def calculate_balance(self, sheet: BalanceSheet | None = None) -> list[Settlement]:
         """Delete existing drafts and recalculate compensation settlements."""
         self.settlements.filter_by(draft=True).delete()
-        draft_settlements = self.get_compensation_settlements_accountant()
+        draft_settlements = self.get_compensation_settlements_accountant(sheet)
         db.session.add_all(draft_settlements)
         db.session.commit()
         return draft_settlements
 
-    def get_balance(self) -> tuple[list[Any], str]:
+    def sync_draft_settlements(self, sheet: BalanceSheet | None = None) -> list[Settlement]:
+        """Bring the stored draft settlements in line with the current balance.
+
+        Stored drafts that match a proposed transfer (same sender, recipient,
+        currency and amount at the base currency's precision) are kept as they
+        are; only stale drafts are deleted and missing ones inserted.  Nothing
+        is written or committed if the stored drafts are already up to date.
+        """
+        exponent = self.base_currency.exponent
+
+        def key(sender_id: int, recipient_id: int, currency_id: int, amount: float) -> tuple:
+            return (sender_id, recipient_id, currency_id, round(amount or 0, exponent))
+
+        stored: dict[tuple, list[Settlement]] = {}
+        for settlement in self.settlements.filter_by(draft=True).all():
+            stored.setdefault(
+                key(settlement.sender_id, settlement.recipient_id, settlement.currency_id, settlement.amount), [],
+            ).append(settlement)
+
+        draft_settlements: list[Settlement] = []
+        added: list[Settlement] = []
+        for sender, recipient, amount in self.get_compensation_plan(sheet):
+            matches = stored.get(key(sender.id, recipient.id, self.base_currency_id, amount))
+            if matches:
+                draft_settlements.append(matches.pop())
+                continue
+            settlement = Settlement(
+                sender=sender, recipient=recipient, event=self,
+                currency=self.base_currency, amount=amount, draft=True,
+                date=datetime.now(timezone.utc))
+            draft_settlements.append(settlement)
+            added.append(settlement)
+
+        stale = [settlement for matches in stored.values() for settlement in matches]
+        if added or stale:
+            for settlement in stale:
+                db.session.delete(settlement)
+            db.session.add_all(added)
+            db.session.commit()
+        return draft_settlements
+
+    def get_balance(self, sheet: BalanceSheet | None = None,
+                    rates: EventRates | None = None) -> tuple[list[Any], str]:
         """Return *(formatted_balances, total_expenses_str)*."""
-        balances = [self.get_user_balance(u) for u in self.users]
+        if sheet is None:
+            sheet = self.get_balance_sheet()
+        if rates is None:
+            rates = self.get_rates()
+        base_id = self.base_currency_id
         balances_str = [
             (
                 x[0],
-                self.base_eventcurrency.get_amount_as_str(x[1]),
-                self.base_eventcurrency.get_amount_as_str(x[2]),
-                self.base_eventcurrency.get_amount_as_str(x[3]),
-                self.base_eventcurrency.get_amount_as_str(x[4]),
-                self.base_eventcurrency.get_amount_as_str(x[5]),
+                rates.format(x[1], base_id),
+                rates.format(x[2], base_id),
+                rates.format(x[3], base_id),
+                rates.format(x[4], base_id),
+                rates.format(x[5], base_id),
             )
-            for x in balances
+            for x in sheet.rows()
         ]
-        total_expenses = self.get_total_expenses()
-        total_expenses_str = self.base_eventcurrency.get_amount_as_str(total_expenses)
+        total_expenses_str = rates.format(sheet.total_expenses, base_id)
         return (balances_str, total_expenses_str)
 
 
@@ -867,8 +1143,8 @@ class Expense(Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this expense's receipt thumbnail."""
-        if self.image:
-            return self.image.get_thumbnail_url(size)
+        if self.image_id:
+            return resolve_thumbnail_url(self.image_id, size)
         return ''
 
     def avatar_data_uri(self, size: int) -> str:
@@ -888,7 +1164,10 @@ class Expense(Entity, db.Model):
 
     def has_user(self, user: EventUser) -> bool:
         """Return whether *user* is among the affected users."""
-        return user in self.affected_users
+        if self.id is None or user.id is None:
+            return user in self.affected_users
+        return _exists(expense_affected_users.c.expense_id == self.id,
+                       expense_affected_users.c.user_id == user.id)
 
     def add_user(self, user: EventUser) -> None:
         """Add *user* to the affected users if not already present."""
@@ -896,9 +1175,36 @@ class Expense(Entity, db.Model):
             self.affected_users.append(user)
 
     def add_users(self, users: list[EventUser]) -> None:
-        """Add multiple users to the affected users."""
+        """Add multiple users to the affected users.
+
+        Persistent users are added with a single ``INSERT … SELECT`` that
+        skips pairs already present.  The insert bypasses the ORM, so both
+        sides of the relationship are expired afterwards.
+        """
+        if self.id is None or any(user.id is None for user in users):
+            for user in users:
+                self.add_user(user)
+            return
+        user_ids = {user.id for user in users}
+        if not user_ids:
+            return
+
+        already_affected = (
+            db.select(expense_affected_users.c.user_id)
+            .where(expense_affected_users.c.expense_id == self.id,
+                   expense_affected_users.c.user_id == EventUser.id)
+            .exists()
+        )
+        db.session.execute(
+            expense_affected_users.insert().from_select(
+                ['expense_id', 'user_id'],
+                db.select(db.literal(self.id), EventUser.id)
+                .where(EventUser.id.in_(user_ids), ~already_affected),
+            )
+        )
+        db.session.expire(self, ['affected_users'])
         for user in users:
-            self.add_user(user)
+            db.session.expire(user, ['affected_by_expenses'])
 
     def remove_user(self, user: EventUser) -> int:
         """Remove *user* from affected users. Returns 0 on success, 1 if not found."""
@@ -907,13 +1213,21 @@ class Expense(Entity, db.Model):
             return 0
         return 1
 
-    def get_amount(self) -> float:
-        """Return the expense amount converted to the event's base currency."""
+    def get_amount(self, rates: EventRates | None = None) -> float:
+        """Return the expense amount converted to the event's base currency.
+
+        Pass the event's *rates* (see :meth:`Event.get_rates`) to avoid
+        loading the currency rates from the database.
+        """
+        if rates is not None:
+            return rates.convert(self.amount, self.currency_id)
         return self.eventcurrency.get_amount_in(
             self.amount, self.event.base_eventcurrency, self.event.exchange_fee)
 
-    def get_amount_str(self) -> str:
+    def get_amount_str(self, rates: EventRates | None = None) -> str:
         """Return a formatted string of the amount, with conversion if applicable."""
+        if rates is not None:
+            return rates.amount_str(self.amount, self.currency_id)
         amount_str = self.eventcurrency.get_amount_as_str(self.amount)
         if self.currency == self.event.base_currency:
             return amount_str
@@ -982,8 +1296,8 @@ class Settlement(Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this settlement's receipt thumbnail."""
-        if self.image:
-            return self.image.get_thumbnail_url(size)
+        if self.image_id:
+            return resolve_thumbnail_url(self.image_id, size)
         return ''
 
     def avatar_data_uri(self, size: int) -> str:
@@ -1001,13 +1315,21 @@ class Settlement(Entity, db.Model):
         is_recipient = eventuser is not None and eventuser == self.recipient and not self.event.closed
         return is_admin or is_recipient
 
-    def get_amount(self) -> float:
-        """Return the settlement amount converted to the event's base currency."""
+    def get_amount(self, rates: EventRates | None = None) -> float:
+        """Return the settlement amount converted to the event's base currency.
+
+        Pass the event's *rates* (see :meth:`Event.get_rates`) to avoid
+        loading the currency rates from the database.
+        """
+        if rates is not None:
+            return rates.convert(self.amount, self.currency_id)
         return self.eventcurrency.get_amount_in(
             self.amount, self.event.base_eventcurrency, self.event.exchange_fee)
 
-    def get_amount_str(self) -> str:
+    def get_amount_str(self, rates: EventRates | None = None) -> str:
         """Return a formatted string of the amount, with conversion if applicable."""
+        if rates is not None:
+            return rates.amount_str(self.amount, self.currency_id)
         amount_str = self.eventcurrency.get_amount_as_str(self.amount)
         if self.currency == self.event.base_currency:
             return amount_str
@@ -1349,8 +1671,8 @@ class User(PaginatedAPIMixin, UserMixin, Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this user's avatar at *size* pixels."""
-        if self.profile_picture:
-            return self.profile_picture.get_thumbnail_url(size)
+        if self.profile_picture_id:
+            return resolve_thumbnail_url(self.profile_picture_id, size)
         return self.gravatar(size)
 
     def gravatar(self, size: int) -> str:
@@ -1522,8 +1844,8 @@ class EventUser(Entity, db.Model):
 
     def avatar(self, size: int) -> str:
         """Return the URL for this participant's avatar at *size* pixels."""
-        if self.profile_picture:
-            return self.profile_picture.get_thumbnail_url(size)
+        if self.profile_picture_id:
+            return resolve_thumbnail_url(self.profile_picture_id, size)
         return self.gravatar(size)
 
     def gravatar(self, size: int) -> str:
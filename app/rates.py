@@ -0,0 +1,92 @@
+"""Event-scoped currency rate table.
+
+Converting or formatting an amount through :class:`~app.models.EventCurrency`
+lazy-loads the ``eventcurrency`` relationship of every expense or settlement
+and the event's base currency.  :class:`EventRates` loads all of an event's
+rates, currency codes and exponents in one query so that whole lists can be
+converted and formatted without further database access.  Build it once per
+request (``event.get_rates()``) and pass it to the model helpers, the API
+serializers or the templates.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from app import db
+
+if TYPE_CHECKING:
+    from app.models import Event
+
+
+@dataclass(frozen=True)
+class CurrencyRate:
+    """Rate and formatting data of one currency within an event."""
+
+    inCHF: float
+    exponent: int
+    code: str
+
+
+class EventRates:
+    """Conversion factors and formatting for all currencies of one event."""
+
+    def __init__(self, base_currency_id: int, exchange_fee: float | None,
+                 rates: dict[int, CurrencyRate]) -> None:
+        self.base_currency_id = base_currency_id
+        self.exchange_fee = exchange_fee or 0
+        self.rates = rates
+        base_rate = rates[base_currency_id].inCHF if base_currency_id in rates else None
+        fee = 1 + self.exchange_fee / 100
+        self.factors: dict[int, float] = {
+            currency_id: 1.0 if currency_id == base_currency_id else fee * rate.inCHF / base_rate
+            for currency_id, rate in rates.items()
+        }
+
+    @classmethod
+    def for_event(cls, event: Event) -> EventRates:
+        """Load the rate table of *event* in a single query."""
+        from app.models import Currency, EventCurrency
+
+        rows = (
+            db.session.query(EventCurrency.currency_id, EventCurrency.inCHF, Currency.exponent, Currency.code)
+            .join(Currency, Currency.id == EventCurrency.currency_id)
+            .filter(EventCurrency.event_id == event.id)
+            .all()
+        )
+        rates = {
+            currency_id: CurrencyRate(inCHF=inCHF, exponent=exponent or 0, code=code)
+            for currency_id, inCHF, exponent, code in rows
+        }
+        return cls(event.base_currency_id, event.exchange_fee, rates)
+
+    @property
+    def base(self) -> CurrencyRate:
+        """Return the rate entry of the event's base currency."""
+        return self.rates[self.base_currency_id]
+
+    def code(self, currency_id: int) -> str | None:
+        """Return the ISO code of *currency_id*, or ``None`` if unknown."""
+        rate = self.rates.get(currency_id)
+        return rate.code if rate else None
+
+    def convert(self, amount: float, currency_id: int) -> float:
+        """Convert *amount* of *currency_id* into the base currency, including the exchange fee."""
+        return amount * self.factors[currency_id]
+
+    def format(self, amount: float, currency_id: int) -> str:
+        """Format *amount* in *currency_id*, e.g. ``'EUR 12.50'``."""
+        rate = self.rates[currency_id]
+        return f'{rate.code} {amount:.{rate.exponent}f}'
+
+    def format_in_base(self, amount: float, currency_id: int) -> str:
+        """Format *amount* of *currency_id* converted into the base currency."""
+        return self.format(self.convert(amount, currency_id), self.base_currency_id)
+
+    def amount_str(self, amount: float, currency_id: int) -> str:
+        """Format *amount*, appending the base-currency value for foreign currencies."""
+        amount_str = self.format(amount, currency_id)
+        if currency_id == self.base_currency_id:
+            return amount_str
+        return f'{amount_str} ({self.format_in_base(amount, currency_id)})'
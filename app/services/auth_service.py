@@ -1,5 +1,6 @@
 # coding=utf-8
 """Auth service — business logic for authentication, registration, and WebAuthn."""
+from __future__ import annotations
 
 
 def _resolve_user_from_handle(raw: bytes) -> User | None:
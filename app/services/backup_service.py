@@ -17,7 +17,9 @@ from flask import current_app
 from sqlalchemy import or_
 
 from app import db
+from app.balance_ledger import rebuild_event_ledger
 from app.models import (
+    SETTLEMENT_MODE_ACCOUNTANT,
     BackupSegment,
     BackupSet,
     Challenge,
@@ -39,6 +41,7 @@ from app.models import (
     User,
 )
 from app.storage import get_storage_provider
+from app.thumbnails import invalidate_thumbnail_index
 
 # ---------------------------------------------------------------------------
 # Format version — bump when serialized schema changes
@@ -172,6 +175,8 @@ def _thumbnail_to_dict(thumb: Thumbnail) -> dict[str, Any]:
         'size': thumb.size,
         'format': thumb.format,
         'mode': thumb.mode,
+        'on_demand': thumb.on_demand,
+        'last_accessed_at': _dt(thumb.last_accessed_at),
         'db_created_at': _dt(thumb.db_created_at),
         'db_updated_at': _dt(thumb.db_updated_at),
         'db_created_by': thumb.db_created_by,
@@ -467,6 +472,7 @@ def _serialize_event(event: Event) -> dict[str, Any]:
         'description': event.description,
         'date': _dt(event.date),
         'closed': event.closed,
+        'settlement_mode': event.settlement_mode,
         'admin_user_guid': str(event.admin.guid) if event.admin else None,
         'base_currency_guid': str(event.base_currency.guid) if event.base_currency else None,
         'base_currency_code': event.base_currency.code if event.base_currency else None,
@@ -899,10 +905,7 @@ def _get_or_create_file(file_dict: dict, media_map: dict[str, str],
     b64 = media_map.get(file_dict['storage_key'])
     if b64:
         try:
-            provider = get_storage_provider(backend_name)
-            provider.save(file_dict['storage_key'],
-                          io.BytesIO(base64.b64decode(b64)),
-                          mime_type=file_dict.get('mime_type'))
+            file_obj.save_content(io.BytesIO(base64.b64decode(b64)))
         except Exception as exc:
             current_app.logger.warning(
                 f'restore: could not write file {file_dict["storage_key"]}: {exc}',
@@ -972,11 +975,14 @@ def _restore_media(objects: dict, backend_name: str,
             thumb.guid = t_dict['guid']
             thumb.format = t_dict.get('format')
             thumb.mode = t_dict.get('mode')
+            thumb.on_demand = t_dict.get('on_demand')
+            thumb.last_accessed_at = _parse_dt(t_dict.get('last_accessed_at'))
             thumb.db_created_at = _parse_dt(t_dict.get('db_created_at'))
             thumb.db_updated_at = _parse_dt(t_dict.get('db_updated_at'))
             db.session.add(thumb)
 
     db.session.flush()
+    invalidate_thumbnail_index(*(image.id for image in restored_images.values()))
     return restored_files, restored_images
 
 
@@ -1181,6 +1187,7 @@ def restore_event(objects: dict, strategy: str, backend_name: str,
             fileshare_link=event_dict.get('fileshare_link') or '',
             closed=event_dict.get('closed', False),
             description=event_dict.get('description') or '',
+            settlement_mode=event_dict.get('settlement_mode') or SETTLEMENT_MODE_ACCOUNTANT,
             db_created_by=event_dict.get('db_created_by', 'restore'),
         )
         event.guid = event_dict['guid']
@@ -1325,6 +1332,7 @@ def restore_event(objects: dict, strategy: str, backend_name: str,
         posts_restored += 1
 
     db.session.flush()
+    rebuild_event_ledger(event)
     return {
         'eventusers': len(eu_guid_to_obj),
         'expenses': expenses_restored,
@@ -8,10 +8,19 @@ from datetime import datetime, timezone
 from typing import Any
 
 from flask import current_app
+from sqlalchemy.orm import selectinload
 
 from app import db
-from app.media.processor import process_and_store_image
+from app.balance_ledger import (
+    apply_ledger_delta,
+    expense_contribution,
+    open_ledger_account,
+    rebuild_event_ledger,
+    settlement_contribution,
+)
+from app.media.processor import process_and_store_image, queue_thumbnails
 from app.models import (
+    SETTLEMENT_MODE_ACCOUNTANT,
     Currency,
     Event,
     EventCurrency,
@@ -23,6 +32,8 @@ from app.models import (
     Settlement,
     User,
 )
+from app.rates import EventRates
+from app.thumbnails import resolve_thumbnail_urls
 
 
 # ---------------------------------------------------------------------------
@@ -93,6 +104,16 @@ class BalanceResult:
     draft_settlements: list[Any] = field(default_factory=list)
     balances_str: list[Any] = field(default_factory=list)
     total_expenses_str: list[Any] = field(default_factory=list)
+    rates: EventRates | None = None
+
+
+@dataclass
+class EventCard:
+    """An event with the data shown on its list card, loaded in bulk."""
+
+    event: Event
+    stats: dict[str, int]
+    image_url: str
 
 
 # ---------------------------------------------------------------------------
@@ -159,14 +180,17 @@ def list_events(
     if per_page is None:
         per_page = current_app.config['ITEMS_PER_PAGE']
 
-    if is_admin:
-        pagination = Event.query.order_by(Event.closed.asc(), Event.date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False,
-        )
-    else:
-        pagination = user.events_admin.order_by(Event.closed.asc(), Event.date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False,
+    query = Event.query if is_admin else user.events_admin
+    pagination = (
+        query.options(
+            selectinload(Event.base_currency),
+            selectinload(Event.admin),
+            selectinload(Event.accountant),
+            selectinload(Event.image),
         )
+        .order_by(Event.closed.asc(), Event.date.desc())
+        .paginate(page=page, per_page=per_page, error_out=False)
+    )
 
     return PaginatedResult(
         items=pagination.items,
@@ -178,6 +202,50 @@ def list_events(
     )
 
 
+def _count_by_event(model: Any, event_ids: list[int], *criteria: Any) -> dict[int, int]:
+    """Return *event_id → row count* of *model* for *event_ids* in one GROUP BY query."""
+    rows = (
+        db.session.query(model.event_id, db.func.count(model.id))
+        .filter(model.event_id.in_(event_ids), *criteria)
+        .group_by(model.event_id)
+        .all()
+    )
+    return dict(rows)
+
+
+def load_event_cards(events: list[Event], thumbnail_size: int) -> list[EventCard]:
+    """Return an :class:`EventCard` for each of *events*, in order.
+
+    Counts are fetched with one GROUP BY query per table and all cover
+    thumbnails are resolved in bulk through the thumbnail index, instead of
+    :meth:`Event.get_stats` and :meth:`Event.avatar` per event.  Load
+    *events* through :func:`list_events` so their related rows are already
+    eager-loaded.
+    """
+    if not events:
+        return []
+    event_ids = [event.id for event in events]
+    users = _count_by_event(EventUser, event_ids)
+    posts = _count_by_event(Post, event_ids)
+    expenses = _count_by_event(Expense, event_ids)
+    settlements = _count_by_event(Settlement, event_ids, Settlement.draft == False)  # noqa: E712
+    image_urls = resolve_thumbnail_urls([event.image_id for event in events], thumbnail_size)
+
+    return [
+        EventCard(
+            event=event,
+            stats={
+                'users': users.get(event.id, 0),
+                'posts': posts.get(event.id, 0),
+                'expenses': expenses.get(event.id, 0),
+                'settlements': settlements.get(event.id, 0),
+            },
+            image_url=image_urls.get(event.image_id, ''),
+        )
+        for event in events
+    ]
+
+
 # ---------------------------------------------------------------------------
 # Event CRUD
 # ---------------------------------------------------------------------------
@@ -197,6 +265,7 @@ def create_event(
     fileshare_link: str,
     description: str,
     created_by: str,
+    settlement_mode: str = SETTLEMENT_MODE_ACCOUNTANT,
 ) -> EventResult:
     """Create a new event with its admin as the first EventUser."""
     base_currency = db.session.get(Currency, base_currency_id)
@@ -211,6 +280,7 @@ def create_event(
         closed=False,
         fileshare_link=fileshare_link,
         description=description,
+        settlement_mode=settlement_mode,
         db_created_by=created_by,
     )
     eventuser = EventUser(
@@ -227,6 +297,7 @@ def create_event(
     db.session.add(event)
     db.session.commit()
     event.accountant = eventuser
+    rebuild_event_ledger(event)
     db.session.commit()
     return EventResult(success=True, event=event)
 
@@ -241,9 +312,16 @@ def update_event(
     exchange_fee: float,
     accountant_id: int,
     currency_ids: list[int],
+    settlement_mode: str | None = None,
 ) -> EventResult:
-    """Update an existing event's details and currencies."""
+    """Update an existing event's details and currencies.
+
+    *settlement_mode* is left unchanged when ``None``.  The balance ledger
+    is only rebuilt when the exchange fee, base currency or currency set
+    changes.
+    """
     event = Event.get_by_guid_or_404(guid)
+    conversion_before = (event.exchange_fee, event.base_currency_id, {c.id for c in event.currencies})
     event.name = name
     event.date = date
     event.fileshare_link = fileshare_link
@@ -251,6 +329,8 @@ def update_event(
     event.base_currency = db.session.get(Currency, base_currency_id)
     event.exchange_fee = exchange_fee
     event.accountant = db.session.get(EventUser, accountant_id)
+    if settlement_mode is not None:
+        event.settlement_mode = settlement_mode
 
     # Add new currencies
     for currency_id in currency_ids:
@@ -265,19 +345,23 @@ def update_event(
             event.eventcurrencies.remove(eventcurrency)
 
     event.add_currency(event.base_currency)
+    if (event.exchange_fee, event.base_currency.id, {c.id for c in event.currencies}) != conversion_before:
+        rebuild_event_ledger(event)
     db.session.commit()
     return EventResult(success=True, event=event)
 
 
-def update_event_picture(guid: str, file_stream: Any, filename: str) -> Image:
+def update_event_picture(guid: str, file_stream: Any, filename: str, uploader: User | None = None) -> Image:
     """Upload or replace the event cover picture.
 
-    Returns the newly created :class:`Image`.
+    Thumbnails are generated in the background; *uploader* is notified
+    when they are ready.  Returns the newly created :class:`Image`.
     """
     event = Event.get_by_guid_or_404(guid)
     new_image = process_and_store_image(file_stream, filename)
     event.image = new_image
     db.session.commit()
+    queue_thumbnails(new_image, notify=uploader)
     return new_image
 
 
@@ -345,6 +429,7 @@ def set_currency_rate(event_guid: str, currency_guid: str, rate: float) -> None:
         currency_id=currency.id, event_id=event.id,
     ).first_or_404()
     eventcurrency.inCHF = rate
+    rebuild_event_ledger(event)
     db.session.commit()
 
 
@@ -388,6 +473,7 @@ def add_event_user(
         user_id=user_id,
     )
     event.add_user(eventuser)
+    open_ledger_account(event, eventuser)
     db.session.commit()
     return EventUserResult(success=True, eventuser=eventuser)
 
@@ -396,6 +482,7 @@ def readd_event_user(event: Event, user_guid: str) -> EventUserResult:
     """Re-add an existing event user back to the event."""
     eventuser = EventUser.get_by_guid_or_404(user_guid)
     event.add_user(eventuser)
+    rebuild_event_ledger(event)
     db.session.commit()
     return EventUserResult(success=True, eventuser=eventuser)
 
@@ -422,11 +509,14 @@ def update_event_user_profile(
 ) -> EventUserResult:
     """Update an event user's profile."""
     eventuser = EventUser.get_by_guid_or_404(guid)
+    weighting_changed = eventuser.weighting != weighting
     eventuser.username = username
     eventuser.email = email
     eventuser.weighting = weighting
     eventuser.about_me = about_me
     eventuser.locale = locale
+    if weighting_changed and eventuser.event is not None:
+        rebuild_event_ledger(eventuser.event)
     db.session.commit()
     return EventUserResult(success=True, eventuser=eventuser)
 
@@ -456,12 +546,13 @@ def update_event_user_bank_account(
     return EventUserResult(success=True, eventuser=eventuser)
 
 
-def update_event_user_picture(guid: str, file_stream: Any, filename: str) -> Image:
-    """Upload or replace an event user's profile picture."""
+def update_event_user_picture(guid: str, file_stream: Any, filename: str, uploader: User | None = None) -> Image:
+    """Upload or replace an event user's profile picture; thumbnails follow in the background."""
     eventuser = EventUser.get_by_guid_or_404(guid)
     new_image = process_and_store_image(file_stream, filename)
     eventuser.profile_picture = new_image
     db.session.commit()
+    queue_thumbnails(new_image, notify=uploader)
     return new_image
 
 
@@ -469,15 +560,26 @@ def update_event_user_picture(guid: str, file_stream: Any, filename: str) -> Ima
 # Balance
 # ---------------------------------------------------------------------------
 
-def get_balance(event_guid: str) -> BalanceResult:
-    """Calculate the event balance, including draft settlements."""
+def get_balance(event_guid: str, recalculate: bool = False) -> BalanceResult:
+    """Return the event balance, including draft settlements.
+
+    Stored drafts are only rewritten where they differ from the current
+    balance, so repeated reads of an unchanged event do not write.  Pass
+    *recalculate* to discard and regenerate all drafts.
+    """
     event = Event.get_by_guid_or_404(event_guid)
-    draft_settlements = event.calculate_balance()
-    balances_str, total_expenses_str = event.get_balance()
+    sheet = event.get_balance_sheet()
+    if recalculate:
+        draft_settlements = event.calculate_balance(sheet)
+    else:
+        draft_settlements = event.sync_draft_settlements(sheet)
+    rates = event.get_rates()
+    balances_str, total_expenses_str = event.get_balance(sheet, rates)
     return BalanceResult(
         draft_settlements=draft_settlements,
         balances_str=balances_str,
         total_expenses_str=total_expenses_str,
+        rates=rates,
     )
 
 
@@ -539,6 +641,7 @@ def create_expense(
     if image:
         expense.image = image
     db.session.add(expense)
+    apply_ledger_delta(event, {}, expense_contribution(expense))
     db.session.commit()
     return ExpenseResult(success=True, expense=expense)
 
@@ -553,11 +656,13 @@ def update_expense(
 ) -> ExpenseResult:
     """Update an existing expense."""
     expense = Expense.get_by_guid_or_404(guid)
+    before = expense_contribution(expense)
     expense.currency = db.session.get(Currency, currency_id)
     expense.amount = amount
     expense.affected_users = [db.session.get(EventUser, uid) for uid in affected_user_ids]
     expense.date = date
     expense.description = description
+    apply_ledger_delta(expense.event, before, expense_contribution(expense))
     db.session.commit()
     return ExpenseResult(success=True, expense=expense)
 
@@ -568,17 +673,20 @@ def remove_expense(guid: str) -> ExpenseResult:
     event = expense.event
     amount_str = expense.get_amount_str()
     if expense in event.expenses:
+        before = expense_contribution(expense)
         event.expenses.remove(expense)
+        apply_ledger_delta(event, before, {})
         db.session.commit()
     return ExpenseResult(success=True, expense=expense)
 
 
-def add_receipt(expense_guid: str, file_stream: Any, filename: str) -> Image:
-    """Upload a receipt image for an expense."""
+def add_receipt(expense_guid: str, file_stream: Any, filename: str, uploader: User | None = None) -> Image:
+    """Upload a receipt image for an expense; thumbnails follow in the background."""
     expense = Expense.get_by_guid_or_404(expense_guid)
     new_image = process_and_store_image(file_stream, filename)
     expense.image = new_image
     db.session.commit()
+    queue_thumbnails(new_image, notify=uploader)
     return new_image
 
 
@@ -609,8 +717,11 @@ def list_expense_users(
 
 def add_expense_users(expense: Expense, user_ids: list[int]) -> list[EventUser]:
     """Add users to an expense's affected list."""
-    users = [db.session.get(EventUser, uid) for uid in user_ids]
+    by_id = {u.id: u for u in EventUser.query.filter(EventUser.id.in_(user_ids))}
+    users = [by_id[uid] for uid in user_ids if uid in by_id]
+    before = expense_contribution(expense)
     expense.add_users(users)
+    apply_ledger_delta(expense.event, before, expense_contribution(expense))
     db.session.commit()
     return users
 
@@ -619,7 +730,9 @@ def add_expense_user(expense_guid: str, user_guid: str) -> EventUser:
     """Add a single user to an expense's affected list."""
     expense = Expense.get_by_guid_or_404(expense_guid)
     user = EventUser.get_by_guid_or_404(user_guid)
+    before = expense_contribution(expense)
     expense.add_user(user)
+    apply_ledger_delta(expense.event, before, expense_contribution(expense))
     db.session.commit()
     return user
 
@@ -631,8 +744,10 @@ def remove_expense_user(expense_guid: str, user_guid: str) -> EventUserResult:
     """
     expense = Expense.get_by_guid_or_404(expense_guid)
     user = EventUser.get_by_guid_or_404(user_guid)
+    before = expense_contribution(expense)
     if expense.remove_user(user):
         return EventUserResult(success=False, eventuser=user, error='Cannot remove user')
+    apply_ledger_delta(expense.event, before, expense_contribution(expense))
     db.session.commit()
     return EventUserResult(success=True, eventuser=user)
 
@@ -692,6 +807,7 @@ def create_settlement(
     if image:
         settlement.image = image
     db.session.add(settlement)
+    apply_ledger_delta(event, {}, settlement_contribution(settlement))
     db.session.commit()
     return SettlementResult(success=True, settlement=settlement)
 
@@ -705,10 +821,12 @@ def update_settlement(
 ) -> SettlementResult:
     """Update an existing settlement."""
     settlement = Settlement.get_by_guid_or_404(guid)
+    before = settlement_contribution(settlement)
     settlement.currency = db.session.get(Currency, currency_id)
     settlement.amount = amount
     settlement.recipient = db.session.get(EventUser, recipient_id)
     settlement.description = description
+    apply_ledger_delta(settlement.event, before, settlement_contribution(settlement))
     db.session.commit()
     return SettlementResult(success=True, settlement=settlement)
 
@@ -718,8 +836,10 @@ def execute_draft_settlement(guid: str, confirming_username: str) -> SettlementR
     from flask_babel import _
 
     settlement = Settlement.get_by_guid_or_404(guid)
+    before = settlement_contribution(settlement)
     settlement.draft = False
     settlement.description = _('Confirmed by user %(username)s', username=confirming_username)
+    apply_ledger_delta(settlement.event, before, settlement_contribution(settlement))
     db.session.commit()
     return SettlementResult(success=True, settlement=settlement)
 
@@ -729,7 +849,9 @@ def remove_settlement(guid: str) -> SettlementResult:
     settlement = Settlement.get_by_guid_or_404(guid)
     event = settlement.event
     if settlement in event.settlements:
+        before = settlement_contribution(settlement)
         event.settlements.remove(settlement)
+        apply_ledger_delta(event, before, {})
         db.session.commit()
     return SettlementResult(success=True, settlement=settlement)
 
@@ -741,7 +863,8 @@ def remove_settlement(guid: str) -> SettlementResult:
 def convert_currencies(event_guid: str) -> Event:
     """Convert all event transactions to the base currency."""
     event = Event.get_by_guid_or_404(event_guid)
-    event.convert_currencies()
+    event.convert_currencies_to_base()
+    rebuild_event_ledger(event)
     db.session.commit()
     return event
 
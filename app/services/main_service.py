@@ -10,7 +10,7 @@ from typing import Any
 from flask import current_app
 
 from app import db
-from app.media.processor import process_and_store_image
+from app.media.processor import process_and_store_image, queue_thumbnails
 from app.models import (
     Currency,
     Event,
@@ -27,6 +27,7 @@ from app.models import (
     Task,
     User,
 )
+from app.thumbnails import invalidate_thumbnail_index
 
 
 # ---------------------------------------------------------------------------
@@ -94,6 +95,7 @@ def rotate_image(guid: str, degree: int) -> Image:
     """Rotate an image by *degree* degrees."""
     img = Image.get_by_guid_or_404(guid)
     img.rotate_image(degree)
+    invalidate_thumbnail_index(img.id)
     return img
 
 
@@ -341,7 +343,7 @@ def launch_task(user: User, key: str, **kwargs: Any) -> TaskResult:
     """Launch a background task identified by *key* for *user*.
 
     Supported keys: ``WASTE_TIME``, ``CHECK_CURRENCIES``, ``UPDATE_CURRENCIES``,
-    ``TYPE_ERROR``.
+    ``SCRUB_STORAGE``, ``TYPE_ERROR``.
     """
     from flask_babel import _
 
@@ -360,6 +362,12 @@ def launch_task(user: User, key: str, **kwargs: Any) -> TaskResult:
             task = user.launch_task('update_rates_yahoo', _('Updating currencies...'))
         else:
             return TaskResult(success=False, error=f'Unknown source: {source}')
+    elif key == 'SCRUB_STORAGE':
+        task = user.launch_task(
+            'scrub_storage',
+            _('Verifying stored files...'),
+            job_timeout=current_app.config['STORAGE_SCRUB_MAX_DURATION'] + 600,
+        )
     elif key == 'TYPE_ERROR':
         amount = kwargs.get('amount', 1)
         task = None
@@ -406,12 +414,14 @@ def update_profile(user: User, username: str, about_me: str, locale: str) -> Non
 def update_profile_picture(user: User, file_stream: Any, filename: str) -> Image:
     """Process and store a new profile picture for *user*.
 
-    Returns the newly created :class:`Image`.
+    Thumbnails are generated in the background and *user* is notified when
+    they are ready.  Returns the newly created :class:`Image`.
     Raises on processing failure.
     """
     new_image = process_and_store_image(file_stream, filename)
     user.profile_picture = new_image
     db.session.commit()
+    queue_thumbnails(new_image, notify=user)
     return new_image
 
 
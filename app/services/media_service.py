@@ -3,13 +3,89 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from tempfile import SpooledTemporaryFile
+from typing import IO, TYPE_CHECKING
 
 import redis
 from flask import current_app
+from sqlalchemy.orm import aliased
 
 from app import db
-from app.models import File
+from app.models import (
+    THUMBNAIL_ALTERNATE_MIME_TYPES,
+    File,
+    Image,
+    Thumbnail,
+    alternate_thumbnail_formats,
+    variant_sizes,
+)
+from app.storage import content_addressed_key, get_storage_provider
+
+if TYPE_CHECKING:
+    from app.media.disk_cache import MediaDiskCache
+
+# app.media imports this module (via serving), so its modules are imported
+# where they are used.
+
+
+MEDIA_CACHE_MAX_BYTES = 5 * 1024 * 1024
+"""Files up to this size are cached in Redis; larger ones are always streamed."""
+
+MEDIA_CACHE_ADMIT_AFTER = 2
+"""Requests within ``MEDIA_CACHE_ADMISSION_WINDOW`` before a file is admitted to Redis."""
+
+# Redis keys of the media cache.  Entries live under ``media_cache:<member>``,
+# where the member is the file hash, so identical files share one entry.
+_CACHE_PREFIX = 'media_cache:'
+_CACHE_SEEN_PREFIX = 'media_cache_seen:'
+_CACHE_LRU = 'media_cache_lru'
+_CACHE_SIZES = 'media_cache_sizes'
+_CACHE_STATS = 'media_cache_stats'
+
+_CACHE_GET_SCRIPT = """
+local payload = redis.call('GET', KEYS[1])
+if payload then
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[3], 'hits', 1)
+else
+    redis.call('HINCRBY', KEYS[3], 'misses', 1)
+end
+return payload
+"""
+"""Read an entry, refresh its LRU position and count the hit or miss."""
+
+_CACHE_ADMIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4])
+redis.call('HSET', KEYS[3], ARGV[4], ARGV[2])
+local total = redis.call('HINCRBY', KEYS[4], 'bytes', ARGV[2])
+local budget = tonumber(ARGV[5])
+while total > budget do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then
+        break
+    end
+    local size = tonumber(redis.call('HGET', KEYS[3], oldest[1]) or '0')
+    redis.call('DEL', ARGV[6] .. oldest[1])
+    redis.call('HDEL', KEYS[3], oldest[1])
+    total = redis.call('HINCRBY', KEYS[4], 'bytes', -size)
+    redis.call('HINCRBY', KEYS[4], 'evictions', 1)
+end
+return 1
+"""
+"""Store an entry and evict least recently used ones until the byte budget holds."""
+
+PRESIGNED_URL_REUSE = 0.8
+"""Fraction of a presigned URL's lifetime during which the cached URL is handed out."""
+
+_VERIFY_CHUNK_SIZE = 64 * 1024
 
 
 # ---------------------------------------------------------------------------
@@ -25,6 +101,35 @@ class FileResult:
     original_filename: str
 
 
+@dataclass
+class MediaCacheStats:
+    """Occupancy and effectiveness of the Redis media cache."""
+
+    entries: int
+    bytes: int
+    budget: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class CollapseResult:
+    """Outcome of :func:`collapse_duplicate_files` (or what it would do, on a dry run)."""
+
+    files: int = 0
+    """Rows pointed at another object holding the same content."""
+    objects_removed: int = 0
+    bytes_reclaimed: int = 0
+    failures: list[tuple[str, str]] = field(default_factory=list)
+    """*(file_hash, reason)* of content left as it was."""
+
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -46,10 +151,47 @@ def _get_redis_connection() -> redis.Redis:
 # Public API
 # ---------------------------------------------------------------------------
 
+def get_file(file_id: int) -> File | None:
+    """Return the :class:`File` record for *file_id*, or ``None``."""
+    return db.session.get(File, file_id)
+
+
+def get_file_alternatives(file_obj: File) -> dict[str, File]:
+    """Return the alternate encodings of thumbnail *file_obj*, keyed by MIME type.
+
+    Empty for files that are not a primary thumbnail or have no alternates.
+    """
+    primary = aliased(Thumbnail)
+    rows = (
+        db.session.query(Thumbnail.format, File)
+        .join(File, File.id == Thumbnail.file_id)
+        .join(primary, db.and_(primary.image_id == Thumbnail.image_id, primary.size == Thumbnail.size))
+        .filter(primary.file_id == file_obj.id, primary.is_primary(),
+                Thumbnail.format.in_(alternate_thumbnail_formats()))
+        .all()
+    )
+    return {THUMBNAIL_ALTERNATE_MIME_TYPES[fmt]: alternate for fmt, alternate in rows}
+
+
+def open_file_stream(file_obj: File, start: int = 0) -> IO[bytes] | None:
+    """Open *file_obj* in storage, positioned at byte *start*.
+
+    Returns ``None`` (and flags the file) when the object cannot be read.
+    """
+    try:
+        stream = file_obj.get_provider().get_file_stream(file_obj.storage_key, start=start)
+    except Exception as e:
+        file_obj.mark_read_error(e)
+        return None
+    file_obj.clear_read_error()
+    return stream
+
+
 def get_file_bytes(file_id: int) -> FileResult | None:
-    """Retrieve file content by database ID using a two-tier cache strategy.
+    """Retrieve file content by database ID using a tiered cache strategy.
 
-    Tier 1: Redis in-memory cache (24 h TTL, max 5 MB per file).
+    Tier 1: Redis in-memory cache (max 5 MB per file, see :func:`get_cached_file_bytes`).
+    Tier 2: local disk cache for remote (S3) files, see :mod:`app.media.disk_cache`.
     Falls back to the storage provider on cache miss.
 
     Returns ``None`` when the file ID does not exist.
@@ -57,13 +199,33 @@ def get_file_bytes(file_id: int) -> FileResult | None:
     file_obj = db.session.get(File, file_id)
     if file_obj is None:
         return None
+    return get_cached_file_bytes(file_obj)
+
+
+def _cache_member(file_obj: File) -> str:
+    """Return the media cache member of *file_obj*: its content hash, if known."""
+    return file_obj.file_hash or f"file-{file_obj.id}"
+
+
+def get_cached_file_bytes(file_obj: File) -> FileResult | None:
+    """Return the content of *file_obj*, served from Redis when cached.
 
+    Redis holds at most ``MEDIA_CACHE_MAX_MEMORY`` bytes of media in total,
+    evicting the least recently used entries beyond that.  A file is only
+    admitted on its second request within ``MEDIA_CACHE_ADMISSION_WINDOW``,
+    so one-off reads (e.g. a burst of fresh uploads) do not push out the
+    working set or the rate-limiter and queue keys sharing the database.
+
+    Returns ``None`` when the object cannot be read from storage.
+    """
     r = _get_redis_connection()
-    cache_key = f"media_cache:{file_obj.id}"
+    member = _cache_member(file_obj)
 
     # Tier 1 — Redis
     try:
-        cached_data = r.get(cache_key)
+        cached_data = r.register_script(_CACHE_GET_SCRIPT)(
+            keys=[_CACHE_PREFIX + member, _CACHE_LRU, _CACHE_STATS], args=[time.time(), member],
+        )
         if cached_data:
             return FileResult(
                 file_bytes=cached_data,
@@ -73,22 +235,37 @@ def get_file_bytes(file_id: int) -> FileResult | None:
     except Exception as e:
         current_app.logger.warning(f"Redis cache read failed: {e}")
 
-    # Cache miss — fetch from storage provider
+    # Tier 2 — local disk, for remote objects only
     provider = file_obj.get_provider()
+    disk_cache = get_disk_cache_for(file_obj)
+    file_bytes = None
+    if disk_cache is not None:
+        try:
+            file_bytes = disk_cache.read(file_obj.file_hash)
+        except Exception as e:
+            current_app.logger.warning(f"Disk cache read failed: {e}")
 
-    try:
-        file_stream = provider.get_file_stream(file_obj.storage_key)
-        file_bytes = file_stream.read()
-    except Exception as e:
-        file_obj.mark_read_error(e)
-        return None
+    # Cache miss — fetch from storage provider
+    if file_bytes is None:
+        try:
+            file_stream = provider.get_file_stream(file_obj.storage_key)
+            file_bytes = file_stream.read()
+        except Exception as e:
+            file_obj.mark_read_error(e)
+            return None
 
-    file_obj.clear_read_error()
+        file_obj.clear_read_error()
+
+        if disk_cache is not None:
+            try:
+                disk_cache.put(file_obj.file_hash, file_bytes)
+            except Exception as e:
+                current_app.logger.warning(f"Disk cache write failed: {e}")
 
-    # Store in Redis for subsequent requests (files < 5 MB only)
+    # Store in Redis once the file proves popular (files < 5 MB only)
     try:
-        if len(file_bytes) < 5 * 1024 * 1024:
-            r.setex(cache_key, 86400, file_bytes)
+        if len(file_bytes) < MEDIA_CACHE_MAX_BYTES:
+            _admit_to_cache(r, member, file_bytes)
     except Exception as e:
         current_app.logger.warning(f"Redis cache write failed: {e}")
 
@@ -97,3 +274,269 @@ def get_file_bytes(file_id: int) -> FileResult | None:
         mime_type=file_obj.mime_type,
         original_filename=file_obj.original_filename,
     )
+
+
+def _admit_to_cache(r: redis.Redis, member: str, file_bytes: bytes) -> bool:
+    """Count a miss for *member* and cache *file_bytes* once it has been requested often enough.
+
+    Returns whether the entry was stored.
+    """
+    seen_key = _CACHE_SEEN_PREFIX + member
+    pipe = r.pipeline(transaction=False)
+    pipe.incr(seen_key)
+    pipe.expire(seen_key, current_app.config['MEDIA_CACHE_ADMISSION_WINDOW'])
+    seen, _ = pipe.execute()
+    if seen < MEDIA_CACHE_ADMIT_AFTER:
+        return False
+    return bool(r.register_script(_CACHE_ADMIT_SCRIPT)(
+        keys=[_CACHE_PREFIX + member, _CACHE_LRU, _CACHE_SIZES, _CACHE_STATS],
+        args=[file_bytes, len(file_bytes), time.time(), member,
+              current_app.config['MEDIA_CACHE_MAX_MEMORY'], _CACHE_PREFIX],
+    ))
+
+
+def get_media_cache_stats() -> MediaCacheStats:
+    """Return occupancy and hit statistics of the Redis media cache."""
+    r = _get_redis_connection()
+    pipe = r.pipeline(transaction=False)
+    pipe.zcard(_CACHE_LRU)
+    pipe.hgetall(_CACHE_STATS)
+    entries, stats = pipe.execute()
+    return MediaCacheStats(
+        entries=entries,
+        bytes=int(stats.get(b'bytes', 0)),
+        budget=current_app.config['MEDIA_CACHE_MAX_MEMORY'],
+        hits=int(stats.get(b'hits', 0)),
+        misses=int(stats.get(b'misses', 0)),
+        evictions=int(stats.get(b'evictions', 0)),
+    )
+
+
+def _delete_matching(r: redis.Redis, pattern: str, batch_size: int = 1000) -> int:
+    """Delete all keys matching *pattern* without blocking Redis with ``KEYS``; return how many."""
+    deleted = 0
+    batch: list[bytes] = []
+    for key in r.scan_iter(match=pattern, count=batch_size):
+        batch.append(key)
+        if len(batch) == batch_size:
+            deleted += r.delete(*batch)
+            batch = []
+    if batch:
+        deleted += r.delete(*batch)
+    return deleted
+
+
+def flush_media_cache() -> int:
+    """Remove every media cache entry, admission counter and statistic; return the entries removed."""
+    r = _get_redis_connection()
+    removed = _delete_matching(r, f'{_CACHE_PREFIX}*')
+    _delete_matching(r, f'{_CACHE_SEEN_PREFIX}*')
+    r.delete(_CACHE_LRU, _CACHE_SIZES, _CACHE_STATS)
+    return removed
+
+
+def get_disk_cache_for(file_obj: File) -> MediaDiskCache | None:
+    """Return the disk cache if *file_obj* may be cached there.
+
+    Only remote objects with a content hash qualify; local files are
+    already on disk.
+    """
+    if not file_obj.file_hash:
+        return None
+    from app.media.disk_cache import get_media_disk_cache
+
+    disk_cache = get_media_disk_cache()
+    if disk_cache is None or file_obj.get_provider().get_local_path(file_obj.storage_key) is not None:
+        return None
+    return disk_cache
+
+
+def get_presigned_url(file_obj: File) -> str | None:
+    """Return a presigned URL for *file_obj*, reusing a cached one while it is fresh.
+
+    URLs live ``MEDIA_PRESIGNED_URL_TTL`` seconds and are cached in Redis
+    for :data:`PRESIGNED_URL_REUSE` of that, so every URL handed out stays
+    valid for at least the remaining fraction.  Returns ``None`` when the
+    backend cannot presign, letting the caller serve the bytes itself.
+    """
+    r = _get_redis_connection()
+    cache_key = f"media_presigned:{file_obj.id}"
+
+    try:
+        cached_url = r.get(cache_key)
+        if cached_url:
+            return cached_url.decode()
+    except Exception as e:
+        current_app.logger.warning(f"Redis cache read failed: {e}")
+
+    ttl = current_app.config['MEDIA_PRESIGNED_URL_TTL']
+    try:
+        url = file_obj.get_provider().get_presigned_url(file_obj.storage_key, expires=ttl)
+    except Exception as e:
+        current_app.logger.warning(f"Presigning file {file_obj.id} failed: {e}")
+        return None
+    if url is None:
+        return None
+
+    try:
+        r.set(cache_key, url, ex=max(int(ttl * PRESIGNED_URL_REUSE), 1))
+    except Exception as e:
+        current_app.logger.warning(f"Redis cache write failed: {e}")
+    return url
+
+
+def get_variant_file_id(file_id: int, size: int) -> int | None:
+    """Return the file to serve for image file *file_id* resized to fit *size*.
+
+    Existing thumbnails of exactly *size* are reused; otherwise an
+    on-demand variant is generated and stored on first request.  Vector
+    images and sizes at or above the original dimensions map to the
+    original, as does a variant that fails to generate.  Returns ``None``
+    when ``THUMBNAIL_VARIANTS`` is off, for unknown files, files that are
+    not images, and sizes not in :func:`~app.models.variant_sizes`.
+    """
+    from app.media.processor import create_thumbnail_variant, touch_thumbnail_variant
+
+    if not current_app.config.get('THUMBNAIL_VARIANTS', False) or size not in variant_sizes():
+        return None
+    image = Image.query.filter_by(file_id=file_id).first()
+    if image is None:
+        return None
+    if image.is_vector or size >= max(image.width or 0, image.height or 0):
+        return file_id
+
+    thumbnail = image.thumbnails.filter(Thumbnail.is_primary(), Thumbnail.size == size).first()
+    if thumbnail is not None:
+        touch_thumbnail_variant(thumbnail)
+        return thumbnail.file_id
+
+    try:
+        thumbnail = create_thumbnail_variant(image, size)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Creating {size}px variant of file {file_id} failed: {e}")
+        return file_id
+    return thumbnail.file_id
+
+
+# ---------------------------------------------------------------------------
+# Duplicate content
+# ---------------------------------------------------------------------------
+
+def find_duplicate_hashes(after: str = '', limit: int = 500) -> list[str]:
+    """Return up to *limit* content hashes, in order and greater than *after*, stored under several keys."""
+    rows = (
+        db.session.query(File.file_hash)
+        .filter(File.file_hash.isnot(None), File.file_hash > after)
+        .group_by(File.file_hash)
+        .having(db.func.count(db.distinct(File.storage_key)) > 1)
+        .order_by(File.file_hash)
+        .limit(limit)
+    )
+    return [file_hash for (file_hash,) in rows]
+
+
+def _read_verified(file_obj: File, storage_key: str) -> IO[bytes] | None:
+    """Return a spooled copy of *storage_key* if its content matches :attr:`File.file_hash`, else ``None``."""
+    spool = SpooledTemporaryFile(max_size=current_app.config.get('UPLOAD_SPOOL_MAX_MEMORY', 1024 * 1024))
+    digest = hashlib.new(file_obj.hash_algorithm or 'sha256')
+    try:
+        stream = file_obj.get_provider().get_file_stream(storage_key)
+        while chunk := stream.read(_VERIFY_CHUNK_SIZE):
+            digest.update(chunk)
+            spool.write(chunk)
+    except Exception as e:
+        current_app.logger.warning(f"Reading {storage_key} for deduplication failed: {e}")
+        spool.close()
+        return None
+    if digest.hexdigest() != file_obj.file_hash:
+        spool.close()
+        return None
+    spool.seek(0)
+    return spool
+
+
+def collapse_duplicate_files(file_hashes: list[str], dry_run: bool = False) -> CollapseResult:
+    """Point all rows holding the same content at one stored object and delete the other copies.
+
+    Rows are grouped by hash and backend.  The kept object is the
+    content-addressed key when ``STORAGE_CONTENT_ADDRESSED`` is on (copied
+    there if needed), otherwise the key of the oldest readable row; either
+    way its bytes are verified against the hash first, so rows whose own object was
+    lost are repaired rather than broken.  The rows are committed before any
+    object is deleted, and objects still referenced by other rows are kept.
+    """
+    result = CollapseResult()
+    content_addressed = current_app.config.get('STORAGE_CONTENT_ADDRESSED')
+    groups: dict[tuple[str, str], list[File]] = defaultdict(list)
+    for file_obj in File.query.filter(File.file_hash.in_(file_hashes)).order_by(File.id):
+        groups[file_obj.file_hash, file_obj.storage_backend].append(file_obj)
+
+    obsolete: dict[tuple[str, str], int] = {}
+    moved: list[File] = []
+    for (file_hash, backend), files in groups.items():
+        keys = list(dict.fromkeys(f.storage_key for f in files))
+        if len(keys) < 2:
+            continue
+        target = content_addressed_key(file_hash, files[0].hash_algorithm or 'sha256') if content_addressed else keys[0]
+
+        if not dry_run:
+            # Prefer an object already at the target; any verified copy will do otherwise
+            candidates = sorted(keys, key=lambda key: key != target)
+            keeper, spool = next(
+                ((key, spool) for key in candidates if (spool := _read_verified(files[0], key)) is not None),
+                (None, None),
+            )
+            if keeper is None:
+                result.failures.append((file_hash, f'no readable copy on {backend}'))
+                continue
+            if not content_addressed:
+                target = keeper
+            try:
+                if keeper != target:
+                    files[0].get_provider().save(target, spool, files[0].mime_type)
+            except Exception as e:
+                result.failures.append((file_hash, f'copying to {target} failed: {e}'))
+                continue
+            finally:
+                spool.close()
+
+        for file_obj in files:
+            if file_obj.storage_key == target:
+                continue
+            obsolete.setdefault((backend, file_obj.storage_key), file_obj.file_size or 0)
+            if not dry_run:
+                file_obj.storage_key = target
+                file_obj.read_error = False
+                moved.append(file_obj)
+            result.files += 1
+
+    if dry_run:
+        result.objects_removed = len(obsolete)
+        result.bytes_reclaimed = sum(obsolete.values())
+        return result
+
+    db.session.commit()
+    _forget_presigned_urls(moved)
+    for (backend, storage_key), size in obsolete.items():
+        if File.query.filter_by(storage_backend=backend, storage_key=storage_key).count():
+            continue
+        try:
+            get_storage_provider(backend).delete(storage_key)
+        except Exception as e:
+            current_app.logger.warning(f"Deleting duplicate object {storage_key} failed: {e}")
+            continue
+        result.objects_removed += 1
+        result.bytes_reclaimed += size
+    return result
+
+
+def _forget_presigned_urls(files: list[File]) -> None:
+    """Drop cached presigned URLs of *files*, which may point at deleted objects."""
+    if not files:
+        return
+    try:
+        _get_redis_connection().delete(*(f"media_presigned:{file_obj.id}" for file_obj in files))
+    except Exception as e:
+        current_app.logger.warning(f"Redis cache delete failed: {e}")
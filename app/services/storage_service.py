@@ -0,0 +1,306 @@
+# coding=utf-8
+"""Storage service — reconciling the storage backends with the database."""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Callable
+
+from flask import current_app
+
+from app import db
+from app.models import BackupSegment, BackupSet, File
+from app.storage import (
+    S3_DELETE_BATCH_SIZE,
+    StorageProvider,
+    StoredObject,
+    get_storage_provider,
+    is_missing_object_error,
+)
+
+ORPHAN_MIN_AGE = timedelta(hours=24)
+"""Objects younger than this are never swept: their row may not be committed yet."""
+
+MEDIA_PREFIXES = ('cas', 'flags', 'icons')
+"""Media key prefixes besides ``IMAGE_IMG_PATH`` and ``IMAGE_TIMG_PATH``."""
+
+SCRUB_CHUNK_SIZE = 256 * 1024
+"""Bytes read (and charged to the bandwidth limit) at a time while scrubbing."""
+
+SCRUB_READ_ATTEMPTS = 3
+"""Reads of one object before an error other than "not found" aborts the scrub."""
+
+SCRUB_RETRY_DELAY = 1.0
+"""Seconds before the first retry of a failed read; doubled for each further retry."""
+
+
+# ---------------------------------------------------------------------------
+# Result data classes
+# ---------------------------------------------------------------------------
+
+@dataclass
+class SweepResult:
+    """Outcome of :func:`sweep_orphans` (or what it would do, on a dry run)."""
+
+    scanned: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    deleted: int = 0
+    failed: list[str] = field(default_factory=list)
+    """Keys of orphans that could not be deleted."""
+
+
+@dataclass
+class ScrubResult:
+    """Outcome of one :func:`scrub_files` batch."""
+
+    checked: int = 0
+    bytes_read: int = 0
+    last_id: int = 0
+    """Highest file ID in the batch; the next batch starts after it."""
+    missing: list[int] = field(default_factory=list)
+    corrupted: list[int] = field(default_factory=list)
+    """IDs of files whose content no longer matches ``file_hash``."""
+    recovered: list[int] = field(default_factory=list)
+    """IDs of files flagged with ``read_error`` that read correctly again."""
+
+
+# ---------------------------------------------------------------------------
+# Orphan sweeping
+# ---------------------------------------------------------------------------
+
+def get_sweep_locations() -> list[tuple[str, str]]:
+    """Return the *(backend, prefix)* pairs the app stores objects under.
+
+    Media prefixes are swept on every backend that holds files, backups on
+    every backend that holds backup sets.  Nothing else is touched; in
+    particular the root of the local backend (by default the app package
+    itself) is never walked as a whole.
+    """
+    media_backends = {current_app.config.get('STORAGE_DEFAULT_BACKEND', 'local')}
+    media_backends.update(backend for (backend,) in db.session.query(File.storage_backend).distinct() if backend)
+    backup_backends = {current_app.config.get('BACKUP_STORAGE_BACKEND') or
+                       current_app.config.get('STORAGE_DEFAULT_BACKEND', 'local')}
+    backup_backends.update(backend for (backend,) in db.session.query(BackupSet.storage_backend).distinct())
+
+    media_prefixes = (current_app.config.get('IMAGE_IMG_PATH'), current_app.config.get('IMAGE_TIMG_PATH'),
+                      *MEDIA_PREFIXES)
+    locations = [(backend, prefix) for backend in sorted(media_backends) for prefix in media_prefixes]
+    locations += [(backend, current_app.config.get('BACKUP_STORAGE_PATH', 'backups'))
+                  for backend in sorted(backup_backends)]
+    return list(dict.fromkeys((backend, prefix.strip('/')) for backend, prefix in locations
+                              if prefix and prefix.strip('/')))
+
+
+def _referenced_keys(backend: str, storage_keys: list[str]) -> set[str]:
+    """Return those of *storage_keys* on *backend* that a file or backup segment points at."""
+    files = db.session.query(File.storage_key).filter(
+        File.storage_backend == backend, File.storage_key.in_(storage_keys),
+    )
+    segments = db.session.query(BackupSegment.storage_key).join(BackupSet).filter(
+        BackupSet.storage_backend == backend, BackupSegment.storage_key.in_(storage_keys),
+    )
+    return {storage_key for (storage_key,) in files.union(segments)}
+
+
+def sweep_orphans(
+    backend: str,
+    prefix: str,
+    dry_run: bool = False,
+    min_age: timedelta = ORPHAN_MIN_AGE,
+    batch_size: int = 500,
+    progress: Callable[[SweepResult], None] | None = None,
+) -> SweepResult:
+    """Delete objects below *prefix* on *backend* that no row references.
+
+    The listing is streamed and checked against ``files.storage_key`` and
+    ``backup_segments.storage_key`` *batch_size* keys per query; orphans
+    are deleted :data:`~app.storage.S3_DELETE_BATCH_SIZE` at a time.
+    Objects younger than *min_age* are skipped.  *progress* is called with
+    the running totals after every batch.
+    """
+    provider = get_storage_provider(backend)
+    cutoff = datetime.now(timezone.utc) - min_age
+    result = SweepResult()
+    pending: list[str] = []
+
+    def flush() -> None:
+        if not dry_run and pending:
+            failed = provider.delete_many(pending)
+            result.deleted += len(pending) - len(failed)
+            result.failed += failed
+        pending.clear()
+
+    objects = provider.iter_objects(prefix)
+    while batch := list(islice(objects, batch_size)):
+        result.scanned += len(batch)
+        candidates: dict[str, StoredObject] = {obj.storage_key: obj for obj in batch if obj.last_modified < cutoff}
+        referenced = _referenced_keys(backend, list(candidates)) if candidates else set()
+        for storage_key, obj in candidates.items():
+            if storage_key in referenced:
+                continue
+            result.orphans += 1
+            result.orphan_bytes += obj.size
+            pending.append(storage_key)
+        if len(pending) >= S3_DELETE_BATCH_SIZE:
+            flush()
+        if progress is not None:
+            progress(result)
+    flush()
+
+    if result.failed:
+        current_app.logger.warning(f"Sweeping {backend}:{prefix} left {len(result.failed)} orphan(s) undeleted")
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Integrity scrubbing
+# ---------------------------------------------------------------------------
+
+class RateLimiter:
+    """Token bucket shared between threads, granting *rate* units per second.
+
+    A *rate* of 0 disables the limit.  Up to one second's worth of tokens
+    can be saved up, so short bursts are smoothed rather than refused.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        """Block until *amount* units may be used."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate
+        # Tokens are taken before sleeping, so later callers queue behind this one
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _verify_object(
+    provider: StorageProvider,
+    storage_key: str,
+    file_hash: str | None,
+    hash_algorithm: str,
+    reads: RateLimiter,
+    bandwidth: RateLimiter,
+) -> tuple[str, int]:
+    """Read one object and compare it with *file_hash*.
+
+    Runs in a worker thread, so it must not touch the session.  Returns
+    ``'ok'``, ``'missing'`` or ``'corrupted'`` and the number of bytes read.
+    Only a "not found" error (see :func:`~app.storage.is_missing_object_error`)
+    counts as missing; other errors are retried up to
+    :data:`SCRUB_READ_ATTEMPTS` times and then raised.
+    """
+    size = 0
+    for attempt in range(SCRUB_READ_ATTEMPTS):
+        reads.acquire()
+        digest = hashlib.new(hash_algorithm)
+        try:
+            stream = provider.get_file_stream(storage_key)
+            try:
+                while chunk := stream.read(SCRUB_CHUNK_SIZE):
+                    bandwidth.acquire(len(chunk))
+                    digest.update(chunk)
+                    size += len(chunk)
+            finally:
+                stream.close()
+        except Exception as e:
+            if is_missing_object_error(e):
+                return 'missing', size
+            if attempt == SCRUB_READ_ATTEMPTS - 1:
+                raise
+            time.sleep(SCRUB_RETRY_DELAY * 2 ** attempt)
+            continue
+        break
+    if file_hash and digest.hexdigest() != file_hash:
+        return 'corrupted', size
+    return 'ok', size
+
+
+def scrub_files(
+    after_id: int,
+    limit: int,
+    executor: Executor,
+    reads: RateLimiter,
+    bandwidth: RateLimiter,
+) -> ScrubResult:
+    """Verify the objects of up to *limit* files with an ID above *after_id*.
+
+    Objects are read in *executor* within the *reads* (per second) and
+    *bandwidth* (bytes per second) limits; rows sharing an object are
+    checked once.  ``read_error`` is then set or cleared with bulk updates
+    and committed.  Files without a hash are only checked for readability.
+
+    A read that keeps failing for any reason other than a missing object
+    is logged and raised before anything is flagged, so a storage outage
+    aborts the run instead of marking the whole batch unreadable.
+    """
+    result = ScrubResult()
+    rows = (
+        db.session.query(File.id, File.storage_backend, File.storage_key, File.file_hash,
+                         File.hash_algorithm, File.read_error)
+        .filter(File.id > after_id)
+        .order_by(File.id)
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return result
+    result.checked = len(rows)
+    result.last_id = rows[-1].id
+
+    objects: dict[tuple[str, str, str | None, str], list] = defaultdict(list)
+    for row in rows:
+        objects[row.storage_backend, row.storage_key, row.file_hash, row.hash_algorithm or 'sha256'].append(row)
+    futures = {
+        obj: executor.submit(_verify_object, get_storage_provider(obj[0]), obj[1], obj[2], obj[3], reads, bandwidth)
+        for obj in objects
+    }
+
+    for obj, future in futures.items():
+        try:
+            outcome, size = future.result()
+        except Exception as e:
+            current_app.logger.warning(f"Storage scrub could not read {obj[0]}:{obj[1]}, aborting the batch: {e}")
+            raise
+        result.bytes_read += size
+        ids = [row.id for row in objects[obj]]
+        if outcome == 'missing':
+            result.missing += ids
+        elif outcome == 'corrupted':
+            result.corrupted += ids
+        else:
+            result.recovered += [row.id for row in objects[obj] if row.read_error]
+
+    broken = result.missing + result.corrupted
+    broken_ids = set(broken)
+    newly_broken = [row.id for row in rows if row.id in broken_ids and not row.read_error]
+    if broken:
+        File.query.filter(File.id.in_(broken)).update({File.read_error: True}, synchronize_session=False)
+    if result.recovered:
+        File.query.filter(File.id.in_(result.recovered)).update({File.read_error: False}, synchronize_session=False)
+    db.session.commit()
+
+    if newly_broken:
+        # One ERROR (and alert email) per batch, like File.mark_read_error does per file
+        current_app.logger.error(
+            f"Storage scrub flagged {len(newly_broken)} unreadable or corrupted file(s): {newly_broken}"
+        )
+    return result
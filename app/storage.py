@@ -1,11 +1,17 @@
-"""Unified storage abstraction supporting local filesystem and S3-compatible backends."""
+"""Unified storage abstraction supporting local filesystem and S3-compatible backends.
+
+Providers are shared: :func:`get_storage_provider` creates one instance per
+backend and app on first use, so S3 clients keep their connection pool.
+"""
 
 from __future__ import annotations
 
 import os
 import re
 import shutil
-from typing import IO, TYPE_CHECKING
+import threading
+from datetime import datetime, timezone
+from typing import IO, TYPE_CHECKING, Iterator, NamedTuple
 
 from flask import current_app
 
@@ -16,10 +22,38 @@ if TYPE_CHECKING:
 try:
     import boto3
     from botocore.config import Config
-    from botocore.exceptions import ClientError  # noqa: F401
+    from botocore.exceptions import ClientError
 except ImportError:
     boto3 = None  # type: ignore[assignment]
 
+S3_DELETE_BATCH_SIZE = 1000
+"""Most keys S3 accepts in one ``DeleteObjects`` request."""
+
+S3_MISSING_OBJECT_CODES = ('404', 'NoSuchKey', 'NotFound')
+"""``ClientError`` codes meaning the object does not exist."""
+
+
+def is_missing_object_error(error: Exception) -> bool:
+    """Return whether *error*, raised while accessing an object, means it does not exist.
+
+    Throttling, timeouts, server and credential errors do not: the object
+    may be fine and the access should be retried later.
+    """
+    if isinstance(error, FileNotFoundError):
+        return True
+    if boto3 is not None and isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in S3_MISSING_OBJECT_CODES
+    return False
+
+
+class StoredObject(NamedTuple):
+    """An object found by :meth:`StorageProvider.iter_objects`."""
+
+    storage_key: str
+    size: int
+    last_modified: datetime
+    """Modification time, timezone-aware UTC."""
+
 
 class StorageProvider:
     """Base interface for storage providers.
@@ -34,6 +68,10 @@ class StorageProvider:
     def delete(self, storage_key: str) -> None:
         raise NotImplementedError
 
+    def exists(self, storage_key: str) -> bool:
+        """Return whether an object is stored under *storage_key*."""
+        raise NotImplementedError
+
     def get_url(self, storage_key: str) -> str:
         raise NotImplementedError
 
@@ -41,10 +79,28 @@ class StorageProvider:
         """Return a local file path if available (useful for PIL processing)."""
         raise NotImplementedError
 
-    def get_file_stream(self, storage_key: str) -> IO[bytes]:
-        """Return a readable byte stream of the file."""
+    def get_file_stream(self, storage_key: str, start: int = 0) -> IO[bytes]:
+        """Return a readable byte stream of the file, beginning at byte *start*."""
+        raise NotImplementedError
+
+    def get_presigned_url(self, storage_key: str, expires: int) -> str | None:
+        """Return a URL granting direct read access for *expires* seconds, or ``None`` if unsupported."""
+        raise NotImplementedError
+
+    def iter_objects(self, prefix: str = '') -> Iterator[StoredObject]:
+        """Yield every object below the directory-like *prefix*, fetching the listing lazily."""
         raise NotImplementedError
 
+    def delete_many(self, storage_keys: list[str]) -> list[str]:
+        """Delete *storage_keys*; return the keys that could not be deleted."""
+        failed = []
+        for storage_key in storage_keys:
+            try:
+                self.delete(storage_key)
+            except Exception:
+                failed.append(storage_key)
+        return failed
+
 
 class LocalStorageProvider(StorageProvider):
     """Store files on the local filesystem."""
@@ -75,6 +131,10 @@ class LocalStorageProvider(StorageProvider):
         if os.path.exists(full_path):
             os.remove(full_path)
 
+    def exists(self, storage_key: str) -> bool:
+        """Return whether a file is stored under *storage_key*."""
+        return os.path.isfile(self._get_full_path(storage_key))
+
     def get_url(self, storage_key: str) -> str:
         """Return a URL path suitable for serving via the local web server."""
         return os.path.join(self.base_url, storage_key).replace('\\', '/').replace('//', '/')
@@ -83,16 +143,54 @@ class LocalStorageProvider(StorageProvider):
         """Return the absolute local filesystem path."""
         return self._get_full_path(storage_key)
 
-    def get_file_stream(self, storage_key: str) -> IO[bytes]:
-        """Return an open binary file handle for *storage_key*."""
+    def get_file_stream(self, storage_key: str, start: int = 0) -> IO[bytes]:
+        """Return an open binary file handle for *storage_key*, positioned at *start*."""
         full_path = self._get_full_path(storage_key)
-        return open(full_path, 'rb')
+        stream = open(full_path, 'rb')
+        if start:
+            stream.seek(start)
+        return stream
+
+    def get_presigned_url(self, storage_key: str, expires: int) -> None:
+        """Local files cannot be accessed without the app; return ``None``."""
+        return None
+
+    def iter_objects(self, prefix: str = '') -> Iterator[StoredObject]:
+        """Walk the directory *prefix* with :func:`os.scandir`, one directory open at a time.
+
+        Keys use forward slashes; a missing directory yields nothing.
+        """
+        pending = [prefix.strip('/')]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = os.scandir(self._get_full_path(directory))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    storage_key = f'{directory}/{entry.name}' if directory else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(storage_key)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        yield StoredObject(
+                            storage_key, stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                        )
 
 
 class S3StorageProvider(StorageProvider):
     """Store files in an S3-compatible object store."""
 
-    def __init__(self, bucket_name: str, region_name: str | None, endpoint_url: str | None = None) -> None:
+    def __init__(
+        self,
+        bucket_name: str,
+        region_name: str | None,
+        endpoint_url: str | None = None,
+        max_pool_connections: int = 10,
+        max_attempts: int = 3,
+        retry_mode: str = 'standard',
+    ) -> None:
         if boto3 is None:
             raise ImportError(
                 "The 'boto3' library is required for S3 storage. "
@@ -105,6 +203,8 @@ class S3StorageProvider(StorageProvider):
         oci_compat_config = Config(
             request_checksum_calculation='WHEN_REQUIRED',
             response_checksum_validation='WHEN_REQUIRED',
+            max_pool_connections=max_pool_connections,
+            retries={'total_max_attempts': max_attempts, 'mode': retry_mode},
         )
 
         self.s3: S3Client = boto3.client(
@@ -150,6 +250,16 @@ class S3StorageProvider(StorageProvider):
         storage_key = self._sanitize_key(storage_key)
         self.s3.delete_object(Bucket=self.bucket_name, Key=storage_key)
 
+    def exists(self, storage_key: str) -> bool:
+        """Return whether the bucket holds *storage_key*, using ``HeadObject``."""
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=self._sanitize_key(storage_key))
+        except ClientError as e:
+            if is_missing_object_error(e):
+                return False
+            raise
+        return True
+
     def get_url(self, storage_key: str) -> str:
         """Return the public URL for the S3 object."""
         storage_key = self._sanitize_key(storage_key)
@@ -164,14 +274,49 @@ class S3StorageProvider(StorageProvider):
         """
         return None
 
-    def get_file_stream(self, storage_key: str) -> StreamingBody:
-        """Return a streaming body for the S3 object."""
+    def get_file_stream(self, storage_key: str, start: int = 0) -> StreamingBody:
+        """Return a streaming body for the S3 object, beginning at byte *start*."""
         storage_key = self._sanitize_key(storage_key)
-        response = self.s3.get_object(Bucket=self.bucket_name, Key=storage_key)
+        extra_args: dict[str, str] = {'Range': f'bytes={start}-'} if start else {}
+        response = self.s3.get_object(Bucket=self.bucket_name, Key=storage_key, **extra_args)
         return response['Body']
 
+    def get_presigned_url(self, storage_key: str, expires: int) -> str:
+        """Return a presigned ``GET`` URL for the object, valid for *expires* seconds."""
+        storage_key = self._sanitize_key(storage_key)
+        return self.s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': storage_key},
+            ExpiresIn=expires,
+        )
 
-def get_storage_provider(backend_name: str) -> StorageProvider:
+    def iter_objects(self, prefix: str = '') -> Iterator[StoredObject]:
+        """Yield the objects below *prefix*, one ``ListObjectsV2`` page (up to 1,000 keys) at a time."""
+        prefix = self._sanitize_key(prefix).rstrip('/')
+        pages = self.s3.get_paginator('list_objects_v2').paginate(
+            Bucket=self.bucket_name, Prefix=f'{prefix}/' if prefix else '',
+        )
+        for page in pages:
+            for item in page.get('Contents', []):
+                yield StoredObject(item['Key'], item['Size'], item['LastModified'])
+
+    def delete_many(self, storage_keys: list[str]) -> list[str]:
+        """Delete *storage_keys* with ``DeleteObjects``, :data:`S3_DELETE_BATCH_SIZE` keys per request."""
+        failed = []
+        for i in range(0, len(storage_keys), S3_DELETE_BATCH_SIZE):
+            chunk = [self._sanitize_key(key) for key in storage_keys[i:i + S3_DELETE_BATCH_SIZE]]
+            response = self.s3.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True},
+            )
+            failed += [error['Key'] for error in response.get('Errors', [])]
+        return failed
+
+
+_registry_lock = threading.Lock()
+
+
+def _create_storage_provider(backend_name: str) -> StorageProvider:
     """Factory: instantiate the correct provider based on *backend_name*.
 
     Supported values: ``'local'``, ``'s3'``.
@@ -186,5 +331,34 @@ def get_storage_provider(backend_name: str) -> StorageProvider:
             bucket_name=current_app.config['S3_BUCKET_NAME'],
             region_name=current_app.config.get('S3_REGION'),
             endpoint_url=current_app.config.get('S3_ENDPOINT_URL'),
+            max_pool_connections=current_app.config.get('S3_MAX_POOL_CONNECTIONS', 10),
+            max_attempts=current_app.config.get('S3_MAX_ATTEMPTS', 3),
+            retry_mode=current_app.config.get('S3_RETRY_MODE', 'standard'),
         )
     raise ValueError(f"Unknown storage backend: {backend_name}")
+
+
+def get_storage_provider(backend_name: str) -> StorageProvider:
+    """Return the shared provider for *backend_name*, creating it on first use.
+
+    Instances are kept per app in ``app.extensions['storage_providers']``;
+    creation is serialised so concurrent threads never build a second client.
+    Raises ``ValueError`` for unknown backends.
+    """
+    providers = current_app.extensions.setdefault('storage_providers', {})
+    provider = providers.get(backend_name)
+    if provider is None:
+        with _registry_lock:
+            provider = providers.get(backend_name)
+            if provider is None:
+                provider = providers[backend_name] = _create_storage_provider(backend_name)
+    return provider
+
+
+def content_addressed_key(file_hash: str, hash_algorithm: str = 'sha256') -> str:
+    """Return the storage key of content with digest *file_hash*.
+
+    Used when ``STORAGE_CONTENT_ADDRESSED`` is on; two levels of two-character
+    prefixes keep directory listings and S3 key ranges evenly spread.
+    """
+    return f'cas/{hash_algorithm}/{file_hash[:2]}/{file_hash[2:4]}/{file_hash}'
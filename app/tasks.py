@@ -19,13 +19,17 @@ from yahoofinancials import YahooFinancials
 from sqlalchemy.exc import SQLAlchemyError
 
 from app import create_app, db, scheduler
+from app.balance import BalanceSheet
 from app.db_logging import log_add
 from app.email import send_email
+from app.media.processor import create_thumbnails, evict_idle_thumbnail_variants
 from app.models import (
     BackupSet,
     Currency,
     Event,
     EventUser,
+    File,
+    Image,
     Log,
     Post,
     Task,
@@ -38,6 +42,9 @@ if TYPE_CHECKING:
 app = create_app()
 app.app_context().push()
 
+SCRUB_CHECKPOINT_KEY = 'storage_scrub:last_id'
+"""Redis key holding the ID of the last file verified by :func:`scrub_storage`."""
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -181,13 +188,19 @@ def get_balance_pdf(
     locale: str,
     timenow: str | None = None,
     recalculate: bool = False,
+    sheet: BalanceSheet | None = None,
 ) -> bytes:
-    """Render the balance sheet for *event* as a PDF and return the bytes."""
+    """Render the balance sheet for *event* as a PDF and return the bytes.
+
+    Pass a precomputed *sheet* to render several PDFs of the same event
+    without recomputing its balances each time.
+    """
+    if sheet is None:
+        sheet = event.get_balance_sheet()
     if recalculate:
-        event.calculate_balance()
-    else:
-        event.settlements.filter_by(draft=True).all()
-    balances_str, total_expenses_str = event.get_balance()
+        event.sync_draft_settlements(sheet)
+    rates = event.get_rates()
+    balances_str, total_expenses_str = event.get_balance(sheet, rates)
 
     if timenow is None:
         timenow = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
@@ -202,6 +215,7 @@ def get_balance_pdf(
             stats=event.get_stats(),
             balances_str=balances_str,
             total_expenses_str=total_expenses_str,
+            rates=rates,
         )
         pdf: bytes = HTML(string=html).write_pdf(presentational_hints=True)
 
@@ -259,15 +273,21 @@ def send_reminders(guid: str, event_guid: str) -> None:
         event = Event.get_by_guid_or_404(event_guid)
 
         _set_task_progress(0)
-        draft_settlements = event.calculate_balance()
+        sheet = event.get_balance_sheet()
+        draft_settlements = event.sync_draft_settlements(sheet)
         timenow = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         total_payments = len(draft_settlements)
 
+        # The balance PDF only depends on the locale, so render it once per locale.
+        pdfs: dict[str, bytes] = {}
         i = 0
         for settlement in draft_settlements:
             if settlement.sender.email:
                 with force_locale(settlement.sender.locale):
-                    pdf = get_balance_pdf(event, settlement.sender.locale, timenow)
+                    pdf = pdfs.get(settlement.sender.locale)
+                    if pdf is None:
+                        pdf = get_balance_pdf(event, settlement.sender.locale, timenow, sheet=sheet)
+                        pdfs[settlement.sender.locale] = pdf
 
                     send_email(
                         _('Please settle your depts!'),
@@ -542,6 +562,95 @@ def housekeeping(guid: str) -> None:
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
 
 
+@_clean_session
+def generate_thumbnails(image_id: int, guid: str | None = None) -> None:
+    """Create the thumbnails of image *image_id*; notify user *guid* when ready."""
+    try:
+        image = db.session.get(Image, image_id)
+        if image is None:
+            app.logger.warning(f'generate_thumbnails: image {image_id} not found')
+            return
+        user = User.query.filter(User.guid == guid).first() if guid else None
+        create_thumbnails(image, notify=user)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.error('generate_thumbnails: unhandled exception', exc_info=sys.exc_info())
+
+
+@_clean_session
+def evict_thumbnail_variants(guid: str) -> None:
+    """Delete on-demand thumbnail variants that have not been served recently."""
+    try:
+        user = User.get_by_guid_or_404(guid)
+        _set_task_progress(0)
+        evicted = evict_idle_thumbnail_variants(app.config['THUMBNAIL_VARIANT_MAX_IDLE_DAYS'])
+        db.session.commit()
+        message = f'{evicted} idle thumbnail variants evicted'
+        log_add('INFORMATION', 'scheduler.task', 'evict_thumbnail_variants', message, user)
+        _set_task_progress(100)
+    except Exception:
+        db.session.rollback()
+        _set_task_progress(100)
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+
+
+@_clean_session
+def scrub_storage(guid: str) -> None:
+    """Verify stored files against their hashes and flag missing or corrupted ones.
+
+    Files are checked in ID order, resuming after the last batch of the
+    previous run (kept in Redis under :data:`SCRUB_CHECKPOINT_KEY`).  A run
+    stops after ``STORAGE_SCRUB_MAX_DURATION`` seconds; once every file has
+    been checked the checkpoint is cleared and the next run starts over.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.services.storage_service import RateLimiter, scrub_files
+
+    try:
+        user = User.get_by_guid_or_404(guid)
+        _set_task_progress(0)
+        last_id = int(app.redis.get(SCRUB_CHECKPOINT_KEY) or 0)
+        remaining = File.query.filter(File.id > last_id).count()
+        reads = RateLimiter(app.config['STORAGE_SCRUB_MAX_READS_PER_SECOND'])
+        bandwidth = RateLimiter(app.config['STORAGE_SCRUB_MAX_BYTES_PER_SECOND'])
+        max_duration = app.config['STORAGE_SCRUB_MAX_DURATION']
+
+        checked = bytes_read = missing = corrupted = recovered = 0
+        started = time.monotonic()
+        finished = False
+        with ThreadPoolExecutor(max_workers=max(app.config['STORAGE_SCRUB_WORKERS'], 1)) as executor:
+            while time.monotonic() - started < max_duration:
+                result = scrub_files(last_id, app.config['STORAGE_SCRUB_BATCH_SIZE'], executor, reads, bandwidth)
+                if not result.checked:
+                    finished = True
+                    break
+                last_id = result.last_id
+                app.redis.set(SCRUB_CHECKPOINT_KEY, last_id)
+                checked += result.checked
+                bytes_read += result.bytes_read
+                missing += len(result.missing)
+                corrupted += len(result.corrupted)
+                recovered += len(result.recovered)
+                _set_task_progress(min(99, 100 * checked // max(remaining, 1)))
+        if finished:
+            app.redis.delete(SCRUB_CHECKPOINT_KEY)
+
+        rate = bytes_read / max(time.monotonic() - started, 1e-9) / 1024 ** 2
+        message = (
+            f'{checked} files checked up to id {last_id} ({rate:.1f} MiB/s), {missing} missing, '
+            f'{corrupted} corrupted, {recovered} readable again; '
+            + ('all files checked' if finished else 'continuing in the next run')
+        )
+        log_add('INFORMATION', 'scheduler.task', 'scrub_storage', message, user)
+        _set_task_progress(100)
+    except Exception:
+        db.session.rollback()
+        _set_task_progress(100)
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+
+
 # ---------------------------------------------------------------------------
 # APScheduler cron jobs
 # ---------------------------------------------------------------------------
@@ -555,6 +664,26 @@ def j_housekeeping() -> None:
         db.session.commit()
 
 
+@scheduler.task('cron', id='j_evict_thumbnail_variants', day='*', hour='3', minute='30')
+def j_evict_thumbnail_variants() -> None:
+    """Evict idle on-demand thumbnail variants every day at 03:30."""
+    with scheduler.app.app_context():
+        admin = User.query.filter(User.username == 'admin').first()
+        admin.launch_task('evict_thumbnail_variants', _('Evicting idle thumbnail variants...'))
+        db.session.commit()
+
+
+@scheduler.task('cron', id='j_scrub_storage', day='*', hour='1')
+def j_scrub_storage() -> None:
+    """Verify stored files against their hashes every day at 01:00."""
+    with scheduler.app.app_context():
+        admin = User.query.filter(User.username == 'admin').first()
+        # RQ's default 180 s timeout would cut the run short
+        admin.launch_task('scrub_storage', _('Verifying stored files...'),
+                          job_timeout=scheduler.app.config['STORAGE_SCRUB_MAX_DURATION'] + 600)
+        db.session.commit()
+
+
 @scheduler.task('cron', id='j_check_currencies', day_of_week='2', hour='4')
 def j_check_currencies() -> None:
     """Check currency availability on Yahoo every Tuesday at 04:00."""
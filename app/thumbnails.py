@@ -0,0 +1,225 @@
+"""Thumbnail resolution index.
+
+Resolving the thumbnail of an image used to query all of its thumbnails on
+every :meth:`~app.models.Image.get_thumbnail_url` call.  This module keeps an
+index *image_id → (is_vector, file_id, ((size, file_id), …))* with the
+thumbnails sorted by size, cached in-process (short TTL) and in Redis, and
+loads missing entries for any number of images in a single query.
+
+Call :func:`invalidate_thumbnail_index` whenever thumbnails of an image are
+created, rotated or deleted.  Inside a transaction the entries are dropped
+again once it ends, so a reader that cached the old rows before the commit
+cannot keep serving them for ``THUMBNAIL_INDEX_TTL``.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from flask import current_app
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session, SessionTransaction
+
+from app import db
+
+_REDIS_PREFIX = 'thumbnail_index:'
+_LOCAL_MAX_ENTRIES = 4096
+_PENDING_KEY = 'thumbnail_index_invalidations'
+"""``Session.info`` key of the image ids to invalidate when the transaction ends."""
+
+
+class ThumbnailIndexEntry(NamedTuple):
+    """Cached thumbnail data of one image."""
+
+    is_vector: bool
+    file_id: int | None
+    thumbnails: tuple[tuple[int, int], ...]
+    """*(size, file_id)* pairs sorted by ascending size."""
+
+    def file_id_for(self, desired_size: int) -> int | None:
+        """Return the file of the smallest thumbnail larger than *desired_size*, else the original."""
+        if not self.is_vector:
+            for size, file_id in self.thumbnails:
+                if size > desired_size:
+                    return file_id
+        return self.file_id
+
+
+class _LocalIndex:
+    """Thread-safe, size-bounded in-process cache with a per-entry TTL."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, ThumbnailIndexEntry]] = OrderedDict()
+
+    def get(self, image_id: int) -> ThumbnailIndexEntry | None:
+        with self._lock:
+            item = self._entries.get(image_id)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires < time.monotonic():
+                del self._entries[image_id]
+                return None
+            self._entries.move_to_end(image_id)
+            return entry
+
+    def put(self, image_id: int, entry: ThumbnailIndexEntry, ttl: float) -> None:
+        with self._lock:
+            self._entries[image_id] = (time.monotonic() + ttl, entry)
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > _LOCAL_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def discard(self, image_ids: Iterable[int]) -> None:
+        with self._lock:
+            for image_id in image_ids:
+                self._entries.pop(image_id, None)
+
+
+def _local_index() -> _LocalIndex:
+    """Return the in-process index of the current app."""
+    return current_app.extensions.setdefault('thumbnail_index', _LocalIndex())
+
+
+def _encode(entry: ThumbnailIndexEntry) -> str:
+    return json.dumps([entry.is_vector, entry.file_id, entry.thumbnails])
+
+
+def _decode(raw: bytes) -> ThumbnailIndexEntry:
+    is_vector, file_id, thumbnails = json.loads(raw)
+    return ThumbnailIndexEntry(bool(is_vector), file_id, tuple((s, f) for s, f in thumbnails))
+
+
+def _load_entries(image_ids: list[int]) -> dict[int, ThumbnailIndexEntry]:
+    """Load the index entries of *image_ids* from the database in one query."""
+    from app.models import Image, Thumbnail
+
+    rows = (
+        db.session.query(Image.id, Image.is_vector, Image.file_id, Thumbnail.size, Thumbnail.file_id)
+        .outerjoin(Thumbnail, db.and_(Thumbnail.image_id == Image.id, Thumbnail.is_primary()))
+        .filter(Image.id.in_(image_ids))
+        .order_by(Image.id, Thumbnail.size.asc())
+        .all()
+    )
+    loaded: dict[int, tuple[bool, int | None, list[tuple[int, int]]]] = {}
+    for image_id, is_vector, file_id, size, thumb_file_id in rows:
+        _vector, _file, thumbnails = loaded.setdefault(image_id, (bool(is_vector), file_id, []))
+        if size is not None and thumb_file_id is not None:
+            thumbnails.append((size, thumb_file_id))
+    return {
+        image_id: ThumbnailIndexEntry(is_vector, file_id, tuple(thumbnails))
+        for image_id, (is_vector, file_id, thumbnails) in loaded.items()
+    }
+
+
+def get_thumbnail_index(image_ids: Iterable[int]) -> dict[int, ThumbnailIndexEntry]:
+    """Return the index entries of *image_ids*, loading all misses in one query.
+
+    Lookups go through the in-process cache, then Redis, then the database.
+    Unknown image ids are omitted from the result.
+    """
+    wanted = {image_id for image_id in image_ids if image_id is not None}
+    if not wanted:
+        return {}
+
+    local = _local_index()
+    local_ttl = current_app.config['THUMBNAIL_INDEX_LOCAL_TTL']
+    found: dict[int, ThumbnailIndexEntry] = {}
+    for image_id in wanted:
+        entry = local.get(image_id)
+        if entry is not None:
+            found[image_id] = entry
+
+    missing = sorted(wanted - found.keys())
+    if missing:
+        try:
+            cached = current_app.redis.mget([f'{_REDIS_PREFIX}{i}' for i in missing])
+        except Exception as e:
+            current_app.logger.warning(f'Thumbnail index read failed: {e}')
+            cached = [None] * len(missing)
+        for image_id, raw in zip(missing, cached):
+            if raw is not None:
+                found[image_id] = _decode(raw)
+                local.put(image_id, found[image_id], local_ttl)
+        missing = [image_id for image_id in missing if image_id not in found]
+
+    if missing:
+        loaded = _load_entries(missing)
+        found.update(loaded)
+        for image_id, entry in loaded.items():
+            local.put(image_id, entry, local_ttl)
+        try:
+            pipe = current_app.redis.pipeline()
+            for image_id, entry in loaded.items():
+                pipe.set(f'{_REDIS_PREFIX}{image_id}', _encode(entry), ex=current_app.config['THUMBNAIL_INDEX_TTL'])
+            pipe.execute()
+        except Exception as e:
+            current_app.logger.warning(f'Thumbnail index write failed: {e}')
+
+    return found
+
+
+def resolve_thumbnail_urls(image_ids: Iterable[int], desired_size: int) -> dict[int, str]:
+    """Return *image_id → URL* of the best thumbnail for *desired_size*.
+
+    Mirrors :meth:`~app.models.Image.get_thumbnail_url` for many images at
+    once: the smallest thumbnail larger than *desired_size*, else the
+    original image.  With ``THUMBNAIL_VARIANTS`` raster images without a
+    thumbnail of exactly *desired_size*, rounded up by
+    :func:`~app.models.variant_size_for`, link to the on-demand variant
+    endpoint instead.  Images without a file map to ``''``.
+    """
+    from app.models import File, variant_size_for
+
+    variant_size = variant_size_for(desired_size) if current_app.config.get('THUMBNAIL_VARIANTS', False) else None
+    urls = {}
+    for image_id, entry in get_thumbnail_index(image_ids).items():
+        if variant_size is not None and not entry.is_vector and entry.file_id is not None:
+            exact = dict(entry.thumbnails).get(variant_size)
+            urls[image_id] = (File.url_for_id(exact) if exact is not None
+                              else File.variant_url_for_id(entry.file_id, variant_size))
+            continue
+        file_id = entry.file_id_for(desired_size)
+        urls[image_id] = File.url_for_id(file_id) if file_id is not None else ''
+    return urls
+
+
+def resolve_thumbnail_url(image_id: int, desired_size: int) -> str:
+    """Return the URL of the best thumbnail of a single image, or ``''``."""
+    return resolve_thumbnail_urls([image_id], desired_size).get(image_id, '')
+
+
+def invalidate_thumbnail_index(*image_ids: int) -> None:
+    """Drop the cached index entries of *image_ids* in this process and in Redis.
+
+    Within a transaction they are dropped now and again after it commits or
+    rolls back (see :func:`_invalidate_pending`).
+    """
+    image_ids = tuple(i for i in image_ids if i is not None)
+    if not image_ids:
+        return
+    session = db.session()
+    if session.in_transaction():
+        session.info.setdefault(_PENDING_KEY, set()).update(image_ids)
+    _discard(image_ids)
+
+
+@sa_event.listens_for(Session, 'after_transaction_end')
+def _invalidate_pending(session: Session, transaction: SessionTransaction) -> None:
+    """Drop the entries invalidated during *session*'s outermost transaction, now that it has ended."""
+    if transaction.parent is None and (image_ids := session.info.pop(_PENDING_KEY, None)):
+        _discard(tuple(image_ids))
+
+
+def _discard(image_ids: tuple[int, ...]) -> None:
+    _local_index().discard(image_ids)
+    try:
+        current_app.redis.delete(*(f'{_REDIS_PREFIX}{i}' for i in image_ids))
+    except Exception as e:
+        current_app.logger.warning(f'Thumbnail index invalidation failed: {e}')
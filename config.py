@@ -76,6 +76,9 @@ class Config:
 
     SQLALCHEMY_POOL_RECYCLE: int = 480
 
+    BALANCE_SQL_THRESHOLD: int = int(os.environ.get('BALANCE_SQL_THRESHOLD') or 0)
+    """Events with at least this many expenses compute balances in SQL; 0 disables the SQL path."""
+
     # Mail settings
     MAIL_SERVER: str = os.environ.get('MAIL_SERVER') or 'localhost'
     MAIL_PORT: int = int(os.environ.get('MAIL_PORT') or 1025)
@@ -87,11 +90,47 @@ class Config:
     # Storage Configuration
     STORAGE_DEFAULT_BACKEND: str = os.environ.get('STORAGE_DEFAULT_BACKEND', 'local')
     STORAGE_LOCAL_PATH: str = os.environ.get('STORAGE_LOCAL_PATH', './app')
+    STORAGE_CONTENT_ADDRESSED: bool = os.environ.get('STORAGE_CONTENT_ADDRESSED', 'false').lower() == 'true'
+    """Store new files under a key derived from their SHA-256, so identical content is stored once."""
+    MEDIA_SENDFILE_HEADER: str = os.environ.get('MEDIA_SENDFILE_HEADER', '')
+    """Offload local media to the reverse proxy: 'X-Accel-Redirect' (nginx), 'X-Sendfile' (Apache) or '' (off)."""
+    MEDIA_SENDFILE_PREFIX: str = os.environ.get('MEDIA_SENDFILE_PREFIX', '/protected-media/')
+    """Internal nginx location mapped to STORAGE_LOCAL_PATH; X-Accel-Redirect targets are prefix + storage key."""
 
     # S3 Configuration
     S3_BUCKET_NAME: str = os.environ.get('S3_BUCKET_NAME', 'expenseapp-bucket')
     S3_REGION: str = os.environ.get('S3_REGION', 'eu-central-1')
     S3_ENDPOINT_URL: str | None = os.environ.get('S3_ENDPOINT_URL')
+    S3_MAX_POOL_CONNECTIONS: int = int(os.environ.get('S3_MAX_POOL_CONNECTIONS') or 10)
+    """HTTP connections kept by the shared S3 client; raise it for many worker threads."""
+    S3_MAX_ATTEMPTS: int = int(os.environ.get('S3_MAX_ATTEMPTS') or 3)
+    """Total attempts per S3 call, including the first, before an error is raised."""
+    S3_RETRY_MODE: str = os.environ.get('S3_RETRY_MODE', 'standard')
+    """botocore retry mode: 'legacy', 'standard' or 'adaptive'."""
+    MEDIA_S3_REDIRECT: bool = os.environ.get('MEDIA_S3_REDIRECT', 'false').lower() == 'true'
+    """Answer requests for S3 media with a 302 to a presigned bucket URL instead of proxying the bytes."""
+    MEDIA_PRESIGNED_URL_TTL: int = int(os.environ.get('MEDIA_PRESIGNED_URL_TTL') or 900)
+    """Seconds a presigned media URL stays valid; URLs are reused for 80 % of this lifetime."""
+    MEDIA_CACHE_MAX_MEMORY: int = int(os.environ.get('MEDIA_CACHE_MAX_MEMORY') or 256 * 1024 ** 2)
+    """Total bytes of media cached in Redis; least recently used entries are evicted beyond it."""
+    MEDIA_CACHE_ADMISSION_WINDOW: int = int(os.environ.get('MEDIA_CACHE_ADMISSION_WINDOW') or 86400)
+    """A file enters the Redis cache on its second request within this many seconds."""
+    MEDIA_DISK_CACHE_PATH: str = os.environ.get('MEDIA_DISK_CACHE_PATH', '')
+    """Directory on local disk caching S3 media between Redis and the bucket; '' disables the tier."""
+    MEDIA_DISK_CACHE_MAX_BYTES: int = int(os.environ.get('MEDIA_DISK_CACHE_MAX_BYTES') or 1024 ** 3)
+    """Byte budget of the disk cache; least recently used files are evicted beyond it."""
+    STORAGE_SCRUB_WORKERS: int = int(os.environ.get('STORAGE_SCRUB_WORKERS') or 4)
+    """Threads of the nightly scrub job reading stored objects to verify their hashes."""
+    STORAGE_SCRUB_BATCH_SIZE: int = int(os.environ.get('STORAGE_SCRUB_BATCH_SIZE') or 200)
+    """Files verified and flagged per batch; the job resumes after the last completed batch."""
+    STORAGE_SCRUB_MAX_READS_PER_SECOND: int = int(os.environ.get('STORAGE_SCRUB_MAX_READS_PER_SECOND') or 20)
+    """Objects the scrub job opens per second across all threads; 0 removes the limit."""
+    STORAGE_SCRUB_MAX_BYTES_PER_SECOND: int = int(
+        os.environ.get('STORAGE_SCRUB_MAX_BYTES_PER_SECOND') or 10 * 1024 ** 2
+    )
+    """Bytes the scrub job reads per second across all threads; 0 removes the limit."""
+    STORAGE_SCRUB_MAX_DURATION: int = int(os.environ.get('STORAGE_SCRUB_MAX_DURATION') or 3600)
+    """Seconds one scrub run may take; the next run continues where it stopped."""
 
     # Image configuration
     IMAGE_ROOT_PATH: str = STORAGE_LOCAL_PATH
@@ -105,7 +144,29 @@ class Config:
         IMAGE_TIMG_PATH = os.environ.get('IMAGE_TIMG_PATH') or 'thumbnails'
     UPLOADS_DEFAULT_DEST: str = os.path.join(IMAGE_ROOT_PATH, IMAGE_TMP_PATH)
     UPLOADED_IMAGES_DEST: str = os.path.join(IMAGE_ROOT_PATH, IMAGE_TMP_PATH)
+    UPLOAD_SPOOL_MAX_MEMORY: int = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY') or 1024 * 1024)
+    """Bytes of an upload buffered in memory during ingestion; larger uploads spill to a temp file."""
     THUMBNAIL_SIZES: list[int] = [32, 64, 128, 256, 512, 1024, 2048]
+    THUMBNAIL_ALTERNATE_FORMATS: list[str] = [
+        fmt.strip().upper() for fmt in os.environ.get('THUMBNAIL_ALTERNATE_FORMATS', 'WEBP').split(',') if fmt.strip()
+    ]
+    """Extra thumbnail encodings (WEBP, AVIF) served to browsers that accept them; empty disables."""
+    THUMBNAIL_VARIANTS: bool = os.environ.get('THUMBNAIL_VARIANTS', 'false').lower() == 'true'
+    """Enable the /media/<file_id>/w/<width> endpoint and point avatar/thumbnail URLs at it."""
+    THUMBNAIL_VARIANT_SIZES: list[int] = [
+        int(size) for size in os.environ.get('THUMBNAIL_VARIANT_SIZES', '48,96,160,320').split(',') if size.strip()
+    ]
+    """Sizes (px) generated on demand besides THUMBNAIL_SIZES; keep at most THUMBNAIL_VARIANTS_PER_IMAGE."""
+    THUMBNAIL_VARIANTS_PER_IMAGE: int = int(os.environ.get('THUMBNAIL_VARIANTS_PER_IMAGE') or 8)
+    """On-demand variants kept per image; the least recently used is evicted beyond this."""
+    THUMBNAIL_VARIANT_MAX_IDLE_DAYS: int = int(os.environ.get('THUMBNAIL_VARIANT_MAX_IDLE_DAYS') or 30)
+    """The daily eviction job removes on-demand variants not served for this many days."""
+    THUMBNAIL_ASYNC: bool = os.environ.get('THUMBNAIL_ASYNC', 'true').lower() == 'true'
+    """Generate thumbnails in the RQ worker after upload; 'false' generates them inside the request."""
+    THUMBNAIL_INDEX_TTL: int = int(os.environ.get('THUMBNAIL_INDEX_TTL') or 86400)
+    """Seconds a thumbnail index entry (image → thumbnail sizes/files) is cached in Redis."""
+    THUMBNAIL_INDEX_LOCAL_TTL: int = int(os.environ.get('THUMBNAIL_INDEX_LOCAL_TTL') or 60)
+    """Seconds an entry is cached in-process; bounds staleness in other workers after invalidation."""
 
     # Redis Settings
     REDIS_HOST: str = os.environ.get('REDIS_HOST') or 'localhost'
@@ -0,0 +1,38 @@
+# coding=utf-8
+"""Add event_balances ledger table.
+
+Holds running paid/spent/sent/received totals per event user so that balance
+reads do not need to recompute every expense. The table starts empty; ledgers
+are built lazily on the next write to an event, or up front with
+``flask dbmaint rebuild-balances``.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9e0f1a2b4'
+down_revision = 'b7c1f2a3d4e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'event_balances',
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('eventuser_id', sa.Integer(), nullable=False),
+        sa.Column('paid', sa.Float(), nullable=True),
+        sa.Column('spent', sa.Float(), nullable=True),
+        sa.Column('sent', sa.Float(), nullable=True),
+        sa.Column('received', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['event_id'], ['events.id'], name='fk_event_balances_event_id'),
+        sa.ForeignKeyConstraint(['eventuser_id'], ['eventusers.id'], name='fk_event_balances_eventuser_id'),
+        sa.PrimaryKeyConstraint('event_id', 'eventuser_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('event_balances')
@@ -0,0 +1,26 @@
+# coding=utf-8
+"""Add settlement_mode to events.
+
+Selects how draft settlements are planned: ``accountant`` routes every debt
+through the event accountant, ``minimal`` settles with the fewest direct
+transfers. Existing rows get NULL, which behaves like ``accountant``.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd4e5f6a7b8c9'
+down_revision = 'c3d9e0f1a2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('events', sa.Column('settlement_mode', sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('events', 'settlement_mode')
@@ -0,0 +1,33 @@
+# coding=utf-8
+"""Add on-demand variant tracking to thumbnails.
+
+``on_demand`` marks thumbnails generated by the ``/media/<file_id>/w/<width>``
+endpoint rather than at upload time; only those are subject to LRU eviction.
+``last_accessed_at`` is refreshed (at most hourly) when a variant is served.
+
+Both columns are nullable without a server default, like every other Boolean
+column in this project; existing thumbnails get NULL and are never evicted.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e5f6a7b8c9d0'
+down_revision = 'd4e5f6a7b8c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('thumbnails') as batch_op:
+        batch_op.add_column(sa.Column('on_demand', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('thumbnails') as batch_op:
+        batch_op.drop_column('last_accessed_at')
+        batch_op.drop_column('on_demand')
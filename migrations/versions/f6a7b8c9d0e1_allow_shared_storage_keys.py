@@ -0,0 +1,35 @@
+# coding=utf-8
+"""Allow several files to share one stored object.
+
+``files.storage_key`` was unique, so identical content was always stored
+once per row.  With content addressing (``STORAGE_CONTENT_ADDRESSED``) and
+``flask dbmaint collapse-duplicate-files`` rows with the same hash point at
+the same key, and objects are deleted only with their last row.
+
+The duplicates themselves are collapsed by that command rather than here:
+objects can only be removed once the repointed rows are committed, which
+a migration running in one transaction cannot guarantee.  Downgrading fails
+while rows still share a key.
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f6a7b8c9d0e1'
+down_revision = 'e5f6a7b8c9d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index('ix_files_storage_key')
+        batch_op.create_index('ix_files_storage_key', ['storage_key'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index('ix_files_storage_key')
+        batch_op.create_index('ix_files_storage_key', ['storage_key'], unique=True)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Benchmark Event.convert_currencies_to_base on events with many transactions.
+
+Compares the former per-object ORM conversion (load every expense and
+settlement, convert in Python, flush one UPDATE per row) with the set-based
+implementation (one UPDATE per table). Each run is rolled back so both
+variants convert the same data.
+
+Runs against a throwaway in-memory SQLite database unless --database-url is
+given. Do NOT point it at a production database.
+
+Usage: python scripts/benchmarks/bench_convert_currencies.py [--sizes 1000 10000 50000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+# Add the root project directory to the Python path so we can import 'app'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app import create_app, db
+from app.models import Currency, Event, EventUser, Expense, Settlement, User
+from config import Config
+
+NUM_USERS = 20
+
+
+def make_config(database_url: str) -> type[Config]:
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ECHO = False
+
+    return BenchmarkConfig
+
+
+def seed_event(n: int) -> int:
+    """Create an event with *n* expenses and *n* settlements in three currencies; return its id."""
+    currencies = [
+        Currency(code=code, name=code, number=number, exponent=2, inCHF=rate, description='')
+        for code, number, rate in (('CHF', 756, 1.0), ('EUR', 978, 0.93), ('USD', 840, 0.88))
+    ]
+    admin = User(username=f'bench_{n}', email=f'bench_{n}@example.com', locale='en')
+    db.session.add_all(currencies + [admin])
+    db.session.flush()
+    event = Event(
+        name=f'Benchmark {n}', date=datetime.now(timezone.utc), admin=admin,
+        base_currency=currencies[0], currencies=currencies, exchange_fee=2.5, fileshare_link='',
+    )
+    db.session.add(event)
+    db.session.flush()
+
+    users = [EventUser(username=f'user_{i}', email=None, weighting=1.0, locale='en') for i in range(NUM_USERS)]
+    for user in users:
+        user.event_id = event.id
+    db.session.add_all(users)
+    db.session.flush()
+
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    db.session.execute(db.insert(Expense), [
+        {'event_id': event.id, 'user_id': rng.choice(users).id, 'currency_id': rng.choice(currencies).id,
+         'amount': round(rng.uniform(1, 500), 2), 'date': now}
+        for _ in range(n)
+    ])
+    db.session.execute(db.insert(Settlement), [
+        {'event_id': event.id, 'sender_id': rng.choice(users).id, 'recipient_id': rng.choice(users).id,
+         'currency_id': rng.choice(currencies).id, 'amount': round(rng.uniform(1, 500), 2),
+         'draft': False, 'date': now}
+        for _ in range(n)
+    ])
+    db.session.commit()
+    return event.id
+
+
+def convert_per_object(event: Event) -> None:
+    """The former implementation: convert every row through the ORM."""
+    with db.session.no_autoflush:
+        expenses = event.expenses.all()
+        settlements = event.settlements.all()
+    for x in expenses + settlements:
+        x.amount = x.eventcurrency.get_amount_in(x.amount, event.base_eventcurrency, event.exchange_fee)
+        x.currency = event.base_currency
+    db.session.flush()
+
+
+def convert_bulk(event: Event) -> None:
+    event.convert_currencies_to_base()
+    db.session.flush()
+
+
+def total_amount(event_id: int) -> float:
+    return sum(
+        db.session.scalar(db.select(db.func.sum(model.amount)).where(model.event_id == event_id))
+        for model in (Expense, Settlement)
+    )
+
+
+def bench(convert, event_id: int, repeat: int) -> tuple[float, float]:
+    """Return (best runtime in ms, resulting total amount) over *repeat* rolled-back runs."""
+    best = float('inf')
+    total = 0.0
+    for _ in range(repeat):
+        db.session.expunge_all()
+        event = db.session.get(Event, event_id)
+        start = time.perf_counter()
+        convert(event)
+        best = min(best, time.perf_counter() - start)
+        total = total_amount(event_id)
+        db.session.rollback()
+    return best * 1000, total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database-url', default='sqlite://')
+    args = parser.parse_args()
+
+    app = create_app(make_config(args.database_url))
+    with app.app_context():
+        db.create_all()
+        print(f"{'rows':>7} {'per-object ms':>14} {'bulk ms':>10} {'speedup':>8}")
+        for n in args.sizes:
+            event_id = seed_event(n)
+            orm_ms, orm_total = bench(convert_per_object, event_id, args.repeat)
+            bulk_ms, bulk_total = bench(convert_bulk, event_id, args.repeat)
+            assert abs(orm_total - bulk_total) <= 1e-6 * abs(orm_total)
+            print(f'{2 * n:>7} {orm_ms:>14.1f} {bulk_ms:>10.1f} {orm_ms / bulk_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
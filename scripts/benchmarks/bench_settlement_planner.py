@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the settlement planners on events with many participants.
+
+Compares the accountant planner (every debt routed through one participant)
+with the heap-based minimal-transfer planner. Reports runtime and the number
+of draft settlements, i.e. PDF renders and emails sent by the reminder task.
+
+Usage: python scripts/benchmarks/bench_settlement_planner.py [--sizes 100 1000 5000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add the root project directory to the Python path so we can import 'app'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.balance import plan_minimal_transfers
+
+TOLERANCE = 0.01
+
+
+def random_balances(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Return *n* balances (rounded to cents) that sum to zero."""
+    balances = np.round(rng.normal(0, 250, n), 2)
+    balances[-1] -= balances.sum()
+    return balances
+
+
+def plan_accountant(balances: np.ndarray, tolerance: float) -> list[tuple[int, int, float]]:
+    """Route every balance through participant 0, as Event does by default."""
+    transfers = []
+    for i, balance in enumerate(balances[1:], start=1):
+        if balance < -tolerance:
+            transfers.append((i, 0, -balance))
+        elif balance > tolerance:
+            transfers.append((0, i, balance))
+    return transfers
+
+
+def bench(planner, balances: np.ndarray, repeat: int) -> tuple[float, int]:
+    """Return (best runtime in ms, number of transfers) over *repeat* runs."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transfers = planner(balances, TOLERANCE)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(transfers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 2000, 5000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'users':>7} {'accountant ms':>14} {'drafts':>7} {'minimal ms':>11} {'drafts':>7}")
+    for n in args.sizes:
+        balances = random_balances(n, rng)
+        acc_ms, acc_count = bench(plan_accountant, balances, args.repeat)
+        min_ms, min_count = bench(plan_minimal_transfers, balances, args.repeat)
+        assert min_count <= n - 1
+        print(f'{n:>7} {acc_ms:>14.2f} {acc_count:>7} {min_ms:>11.2f} {min_count:>7}')
+
+
+if __name__ == '__main__':
+    main()
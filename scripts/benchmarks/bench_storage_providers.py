@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Benchmark per-file storage overhead when reading many thumbnails from S3.
+
+Compares building a fresh S3StorageProvider (and boto3 client) for every file,
+as get_storage_provider used to, with the shared provider from the registry.
+S3 is simulated in-process with moto, so the numbers show client construction
+and request overhead rather than network latency; against a real endpoint the
+registry additionally keeps TCP/TLS connections alive.
+
+Usage: python scripts/benchmarks/bench_storage_providers.py [--files 1000]
+"""
+
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+# Add the root project directory to the Python path so we can import 'app'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import boto3
+from moto import mock_aws
+
+from app import create_app
+from app.storage import _create_storage_provider, get_storage_provider
+from config import Config
+
+THUMBNAIL = os.urandom(4 * 1024)
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    S3_BUCKET_NAME = 'bench-bucket'
+    S3_REGION = 'eu-central-1'
+    S3_ENDPOINT_URL = None
+
+
+def seed_bucket(n: int) -> list[str]:
+    """Upload *n* small thumbnails and return their keys."""
+    boto3.client('s3', region_name=BenchmarkConfig.S3_REGION).create_bucket(
+        Bucket=BenchmarkConfig.S3_BUCKET_NAME,
+        CreateBucketConfiguration={'LocationConstraint': BenchmarkConfig.S3_REGION},
+    )
+    provider = get_storage_provider('s3')
+    keys = [f'thumbnails/{i:05d}.jpg' for i in range(n)]
+    for key in keys:
+        provider.save(key, BytesIO(THUMBNAIL), mime_type='image/jpeg')
+    return keys
+
+
+def read_all(keys: list[str], get_provider) -> tuple[float, float]:
+    """Read every key; return (total ms, ms spent obtaining providers)."""
+    provider_time = 0.0
+    start = time.perf_counter()
+    for key in keys:
+        t0 = time.perf_counter()
+        provider = get_provider('s3')
+        provider_time += time.perf_counter() - t0
+        assert len(provider.get_file_stream(key).read()) == len(THUMBNAIL)
+    return (time.perf_counter() - start) * 1000, provider_time * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context(), mock_aws():
+        keys = seed_bucket(args.files)
+        print(f"{'mode':<12} {'total ms':>10} {'provider ms':>12} {'per file ms':>12}")
+        for label, get_provider in (('per-call', _create_storage_provider), ('registry', get_storage_provider)):
+            total_ms, provider_ms = read_all(keys, get_provider)
+            print(f'{label:<12} {total_ms:>10.1f} {provider_ms:>12.1f} {total_ms / len(keys):>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
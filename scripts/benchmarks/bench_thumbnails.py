@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Benchmark thumbnail rendering for a single upload.
+
+Compares the former pipeline (full decode, then copy and resize the full
+resolution image once per THUMBNAIL_SIZES entry) with the cascaded one in
+app.media.processor._render_thumbnails (JPEG draft decode, each size derived
+from the previous one, parallel encoding). Storage and database writes are
+identical for both and therefore left out.
+
+Each variant runs in a fresh subprocess so its peak RSS can be reported.
+
+Usage: python scripts/benchmarks/bench_thumbnails.py [--width 4000 --height 3000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+# Add the root project directory to the Python path so we can import 'app'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from PIL import Image as ImagePIL
+
+from config import Config
+
+SIZES = Config.THUMBNAIL_SIZES
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """Return a JPEG with photo-like detail (gradients plus noise)."""
+    gradient = ImagePIL.linear_gradient('L').resize((width, height))
+    noise = ImagePIL.effect_noise((width, height), 64)
+    img = ImagePIL.merge('RGB', (gradient, noise, gradient.rotate(180)))
+    out = BytesIO()
+    img.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+
+def render_legacy(file_bytes: bytes, sizes: list[int], formats: list[str]) -> list[tuple[int, str, bytes, str]]:
+    """The former implementation: resize every size from the full-resolution copy."""
+    results = []
+    with ImagePIL.open(BytesIO(file_bytes)) as pil_img:
+        max_dim = max(pil_img.size)
+        for size in sizes:
+            if size >= max_dim:
+                continue
+            thumb_img = pil_img.copy()
+            thumb_img.thumbnail((size, size))
+            for thumb_format in formats:
+                thumb_stream = BytesIO()
+                thumb_img.save(thumb_stream, format=thumb_format)
+                results.append((size, thumb_format, thumb_stream.getvalue(), thumb_img.mode))
+    return results
+
+
+def run_variant(variant: str, path: str, repeat: int) -> None:
+    """Child process: render *repeat* times and print timing and peak RSS as JSON."""
+    from app.media.processor import _render_thumbnails
+
+    with open(path, 'rb') as f:
+        file_bytes = f.read()
+    with ImagePIL.open(BytesIO(file_bytes)) as img:
+        max_dim = max(img.size)
+    sizes = [size for size in SIZES if size < max_dim]
+    render = render_legacy if variant == 'legacy' else _render_thumbnails
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = render(file_bytes, sizes, ['JPEG'])
+        best = min(best, time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'ms': best * 1000,
+        'peak_mb': peak_kb / 1024,
+        'delta_mb': (peak_kb - baseline_kb) / 1024,
+        'dims': {size: ImagePIL.open(BytesIO(data)).size for size, _fmt, data, _mode in results},
+    }))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--variant', choices=['legacy', 'cascaded'], help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.path, args.repeat)
+        return
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'_bench_{args.width}x{args.height}.jpg')
+    with open(path, 'wb') as f:
+        f.write(make_photo(args.width, args.height))
+    try:
+        print(f'{args.width}x{args.height} JPEG, sizes {SIZES}, {os.cpu_count()} CPU(s)')
+        print(f"{'variant':<10} {'best ms':>9} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+        for variant in ('legacy', 'cascaded'):
+            out = subprocess.run(
+                [sys.executable, __file__, '--variant', variant, '--path', path, '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            stats = json.loads(out.strip().splitlines()[-1])
+            print(f"{variant:<10} {stats['ms']:>9.1f} {stats['peak_mb']:>12.1f} {stats['delta_mb']:>14.1f}")
+            print(f"{'':<10} sizes: {stats['dims']}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -166,6 +166,28 @@ def _register_and_get_token(client: FlaskClient, username: str, password: str) -
     return token
 
 
+@pytest.fixture
+def mock_s3(app: Flask):
+    """Serve the ``s3`` backend from moto, with ``S3_BUCKET_NAME`` created.
+
+    Skips when moto is not installed.  ``S3_ENDPOINT_URL`` (set by
+    run_tests.sh for MinIO) is cleared, as moto only intercepts AWS
+    endpoints.
+    """
+    moto = pytest.importorskip('moto')
+    app.config['S3_ENDPOINT_URL'] = None
+    app.extensions.get('storage_providers', {}).pop('s3', None)
+    with moto.mock_aws():
+        import boto3
+
+        boto3.client('s3', region_name=app.config['S3_REGION']).create_bucket(
+            Bucket=app.config['S3_BUCKET_NAME'],
+            CreateBucketConfiguration={'LocationConstraint': app.config['S3_REGION']},
+        )
+        yield
+    app.extensions.get('storage_providers', {}).pop('s3', None)
+
+
 @pytest.fixture
 def api_client(app: Flask) -> tuple[FlaskClient, str]:
     """A test client with a regular-user API token.
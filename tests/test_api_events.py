@@ -5,13 +5,16 @@ from __future__ import annotations
 
 import json
 import uuid
+from datetime import datetime, timezone
 from unittest.mock import patch
 
+import pytest
 from flask import Flask
 from flask.testing import FlaskClient
 
 from app import db
 from app.models import Currency, Event, EventUser, Expense, Settlement, User
+from app.services import event_service
 from tests.conftest import _api_headers, _register_and_get_token
 
 
@@ -56,6 +59,33 @@ def test_list_events_success(
     assert data['total'] >= 1
 
 
+def test_list_events_batches_stats(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_event: Event,
+) -> None:
+    """Listed stats equal Event.get_stats but are loaded in bulk."""
+    client, token = api_client
+    _add_shared_expense(app, api_event, 30.0)
+
+    with patch.object(Event, 'get_stats', side_effect=AssertionError) as get_stats, \
+            patch.object(Event, 'avatar', side_effect=AssertionError) as avatar:
+        resp = client.get('/apis/events/', headers=_api_headers(token))
+    assert not get_stats.called
+    assert not avatar.called
+
+    assert resp.status_code == 200
+    items = resp.get_json()['items']
+    with app.app_context():
+        for item in items:
+            event = Event.query.filter_by(guid=item['guid']).one()
+            assert item['stats'] == event.get_stats()
+            assert item['image_url'] == event.avatar(256)
+    listed = next(item for item in items if item['guid'] == str(api_event.guid))
+    assert listed['stats']['users'] == 2
+    assert listed['stats']['expenses'] == 1
+
+
 def test_list_events_requires_auth(
     app: Flask,
     client: FlaskClient,
@@ -104,6 +134,31 @@ def test_create_event_success(
         assert event is not None
 
 
+def test_create_event_with_settlement_mode(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_currency: Currency,
+) -> None:
+    """settlement_mode is stored and returned; unknown modes are rejected."""
+    client, token = api_client
+    payload = {
+        'name': f'Minimal {uuid.uuid4().hex[:8]}',
+        'date': '2025-06-15T10:00:00',
+        'base_currency_id': api_currency.id,
+        'currency_ids': [api_currency.id],
+        'exchange_fee': 0.0,
+        'settlement_mode': 'minimal',
+    }
+    resp = client.post('/apis/events/', headers=_api_headers(token), data=json.dumps(payload))
+
+    assert resp.status_code == 201
+    assert resp.get_json()['settlement_mode'] == 'minimal'
+
+    payload['settlement_mode'] = 'bogus'
+    resp = client.post('/apis/events/', headers=_api_headers(token), data=json.dumps(payload))
+    assert resp.status_code == 400
+
+
 def test_create_event_missing_fields(
     app: Flask,
     api_client: tuple[FlaskClient, str],
@@ -1197,6 +1252,84 @@ def test_get_balance_success(
     assert 'draft_settlements' in data
 
 
+def _add_shared_expense(app: Flask, api_event: Event, amount: float) -> None:
+    """Add a second participant (once) and an expense paid by the admin for both."""
+    with app.app_context():
+        event = db.session.get(Event, api_event.id)
+        admin = event.accountant
+        guest = event.users.filter(EventUser.id != admin.id).first()
+        if guest is None:
+            guest = event_service.add_event_user(
+                event, f'guest_{uuid.uuid4().hex[:8]}', 'guest@example.com', 1.0, 'en',
+            ).eventuser
+        event_service.create_expense(
+            event, admin, event.base_currency_id, amount, [admin.id, guest.id],
+            datetime.now(timezone.utc), 'shared', 'test',
+        )
+
+
+def test_get_balance_keeps_unchanged_drafts(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_event: Event,
+) -> None:
+    """Repeated balance reads return the same stored drafts without rewriting them."""
+    client, token = api_client
+    ctx = _event_ctx(app, api_event)
+    _add_shared_expense(app, api_event, 40.0)
+    url = f'/apis/events/{ctx["event_guid"]}/balance'
+
+    first = client.get(url, headers=_api_headers(token)).get_json()['draft_settlements']
+    with patch('app.models.db.session.commit') as mock_commit:
+        second = client.get(url, headers=_api_headers(token)).get_json()['draft_settlements']
+
+    assert len(first) == 1
+    assert first[0]['amount'] == 20.0
+    assert [s['guid'] for s in second] == [s['guid'] for s in first]
+    mock_commit.assert_not_called()
+
+
+def test_get_balance_patches_changed_drafts(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_event: Event,
+) -> None:
+    """Drafts are replaced once the balance changes."""
+    client, token = api_client
+    ctx = _event_ctx(app, api_event)
+    _add_shared_expense(app, api_event, 40.0)
+    url = f'/apis/events/{ctx["event_guid"]}/balance'
+
+    first = client.get(url, headers=_api_headers(token)).get_json()['draft_settlements']
+    _add_shared_expense(app, api_event, 10.0)
+    second = client.get(url, headers=_api_headers(token)).get_json()['draft_settlements']
+
+    assert len(second) == 1
+    assert second[0]['amount'] == 25.0
+    assert second[0]['guid'] != first[0]['guid']
+    with app.app_context():
+        assert Settlement.query.filter_by(event_id=ctx['event_id'], draft=True).count() == 1
+
+
+def test_get_balance_recalculate_regenerates_drafts(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_event: Event,
+) -> None:
+    """?recalculate=true discards and regenerates every draft."""
+    client, token = api_client
+    ctx = _event_ctx(app, api_event)
+    _add_shared_expense(app, api_event, 40.0)
+    url = f'/apis/events/{ctx["event_guid"]}/balance'
+
+    first = client.get(url, headers=_api_headers(token)).get_json()['draft_settlements']
+    second = client.get(f'{url}?recalculate=true', headers=_api_headers(token)).get_json()['draft_settlements']
+
+    assert len(second) == 1
+    assert second[0]['amount'] == first[0]['amount']
+    assert second[0]['guid'] != first[0]['guid']
+
+
 def test_get_balance_requires_auth(
     app: Flask,
     client: FlaskClient,
@@ -1303,6 +1436,41 @@ def test_reopen_event_success(
         assert event.closed is False
 
 
+def test_convert_currencies_success(
+    app: Flask,
+    api_client: tuple[FlaskClient, str],
+    api_event: Event,
+    api_second_currency: Currency,
+) -> None:
+    """The admin converts all foreign-currency transactions to the base currency."""
+    client, token = api_client
+    ctx = _event_ctx(app, api_event)
+    with app.app_context():
+        event = db.session.get(Event, api_event.id)
+        eur = db.session.get(Currency, api_second_currency.id)
+        event.add_currency(eur)
+        db.session.commit()
+        admin = event.accountant
+        expense = event_service.create_expense(
+            event, admin, eur.id, 100.0, [admin.id],
+            datetime.now(timezone.utc), 'abroad', 'test',
+        ).expense
+        expected = expense.get_amount()
+        expense_id = expense.id
+
+    resp = client.post(
+        f'/apis/events/{ctx["event_guid"]}/convert-currencies',
+        headers=_api_headers(token),
+    )
+
+    assert resp.status_code == 200
+    assert resp.get_json()['message'] == 'Currencies converted'
+    with app.app_context():
+        expense = db.session.get(Expense, expense_id)
+        assert expense.currency_id == api_event.base_currency_id
+        assert expense.amount == pytest.approx(expected)
+
+
 def test_convert_currencies_permission_denied(
     app: Flask,
     api_client: tuple[FlaskClient, str],
@@ -0,0 +1,324 @@
+# coding=utf-8
+"""Tests for the balance engines in :mod:`app.balance`."""
+
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from flask import Flask
+from sqlalchemy import event as sa_event
+
+from app import db
+from app.balance import (
+    build_balance_sheet,
+    compute_balance_sheet,
+    compute_balance_sheet_sql,
+    plan_minimal_transfers,
+)
+from app.balance_ledger import rebuild_event_ledger
+from app.models import (
+    SETTLEMENT_MODE_MINIMAL,
+    Currency,
+    Event,
+    EventCurrency,
+    EventUser,
+    Expense,
+    Settlement,
+)
+
+
+def _add_eventuser(event: Event, name: str, weighting: float) -> EventUser:
+    """Attach a new participant called *name* to *event*."""
+    suffix = uuid.uuid4().hex[:8]
+    eu = EventUser(
+        username=f'{name}_{suffix}', email=f'{name}_{suffix}@example.com',
+        weighting=weighting, locale='en',
+    )
+    eu.event_id = event.id
+    db.session.add(eu)
+    db.session.flush()
+    return eu
+
+
+@pytest.fixture
+def balance_event(
+    app: Flask,
+    api_event: Event,
+    api_second_currency: Currency,
+) -> Event:
+    """Return an event with weighted users, two currencies and settlements."""
+    event = db.session.get(Event, api_event.id)
+    chf = event.base_currency
+    eur = db.session.get(Currency, api_second_currency.id)
+    event.add_currency(eur)
+    db.session.flush()
+
+    admin = event.accountant
+    alice = _add_eventuser(event, 'alice', 2.0)
+    bob = _add_eventuser(event, 'bob', 0.5)
+    now = datetime.now(timezone.utc)
+
+    db.session.add_all([
+        Expense(user=admin, event=event, currency=chf, amount=120.0,
+                affected_users=[admin, alice, bob], date=now),
+        Expense(user=alice, event=event, currency=eur, amount=45.5,
+                affected_users=[alice, bob], date=now),
+        Expense(user=bob, event=event, currency=chf, amount=10.0,
+                affected_users=[admin], date=now),
+        Settlement(sender=bob, recipient=admin, event=event, currency=eur,
+                   amount=20.0, draft=False, date=now),
+        Settlement(sender=alice, recipient=admin, event=event, currency=chf,
+                   amount=999.0, draft=True, date=now),
+    ])
+    db.session.commit()
+    return event
+
+
+# ---------------------------------------------------------------------------
+# Parity with the per-user ORM helpers
+# ---------------------------------------------------------------------------
+
+def test_balance_sheet_matches_orm_helpers(balance_event: Event) -> None:
+    """Every row of the sheet equals Event.get_user_balance for that user."""
+    sheet = compute_balance_sheet(balance_event)
+
+    assert len(sheet.rows()) == balance_event.users.count()
+    for row in sheet.rows():
+        expected = balance_event.get_user_balance(row[0])
+        assert row[0] == expected[0]
+        assert row[1:] == pytest.approx(expected[1:])
+
+    assert sheet.total_expenses == pytest.approx(balance_event.get_total_expenses())
+
+
+def test_balance_sheet_sums_to_zero(balance_event: Event) -> None:
+    """Balances of a closed system net out to zero."""
+    sheet = compute_balance_sheet(balance_event)
+    assert float(sheet.balance.sum()) == pytest.approx(0.0)
+
+
+def test_balance_sheet_ignores_draft_settlements(balance_event: Event) -> None:
+    """Draft settlements do not contribute to sent/received."""
+    sheet = compute_balance_sheet(balance_event)
+    assert float(sheet.sent.sum()) == pytest.approx(float(sheet.received.sum()))
+    assert float(sheet.sent.sum()) < 999.0
+
+
+def test_balance_sheet_unknown_user_is_zero(balance_event: Event) -> None:
+    """get_user_balance returns zeros for a user outside the event."""
+    stranger = EventUser(username='stranger', email=None, weighting=1.0, locale='en')
+    stranger.id = -1
+    sheet = compute_balance_sheet(balance_event)
+    assert sheet.get_user_balance(stranger)[1:] == (0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def test_balance_sheet_empty_event(api_event: Event) -> None:
+    """An event without expenses yields an all-zero sheet."""
+    sheet = compute_balance_sheet(api_event)
+    assert sheet.total_expenses == 0.0
+    assert all(row[5] == 0.0 for row in sheet.rows())
+
+
+# ---------------------------------------------------------------------------
+# Draft settlements generated from the sheet
+# ---------------------------------------------------------------------------
+
+def test_calculate_balance_zeroes_all_balances(balance_event: Event) -> None:
+    """Confirming the generated drafts brings every balance to zero."""
+    drafts = balance_event.calculate_balance()
+    assert drafts
+    assert balance_event.settlements.filter_by(draft=True).count() == len(drafts)
+
+    for settlement in drafts:
+        settlement.draft = False
+    db.session.commit()
+
+    sheet = compute_balance_sheet(balance_event)
+    tolerance = 10 ** -balance_event.base_currency.exponent
+    assert all(abs(row[5]) <= tolerance for row in sheet.rows())
+
+
+# ---------------------------------------------------------------------------
+# SQL-side aggregation backend
+# ---------------------------------------------------------------------------
+
+def test_sql_balance_sheet_matches_orm_helpers(balance_event: Event) -> None:
+    """The GROUP BY backend agrees with Event.get_user_balance for every user."""
+    sheet = compute_balance_sheet_sql(balance_event)
+
+    assert len(sheet.rows()) == balance_event.users.count()
+    for row in sheet.rows():
+        expected = balance_event.get_user_balance(row[0])
+        assert row[0] == expected[0]
+        assert row[1:] == pytest.approx(expected[1:])
+
+    assert sheet.total_expenses == pytest.approx(balance_event.get_total_expenses())
+
+
+def test_sql_balance_sheet_matches_in_memory_engine(balance_event: Event) -> None:
+    """Both backends produce identical sheets."""
+    in_memory = compute_balance_sheet(balance_event)
+    in_sql = compute_balance_sheet_sql(balance_event)
+
+    assert [row[0] for row in in_sql.rows()] == [row[0] for row in in_memory.rows()]
+    for sql_row, memory_row in zip(in_sql.rows(), in_memory.rows()):
+        assert sql_row[1:] == pytest.approx(memory_row[1:])
+
+
+def test_sql_balance_sheet_empty_event(api_event: Event) -> None:
+    """An event without expenses yields an all-zero sheet."""
+    sheet = compute_balance_sheet_sql(api_event)
+    assert sheet.total_expenses == 0.0
+    assert all(row[5] == 0.0 for row in sheet.rows())
+
+
+def test_build_balance_sheet_uses_threshold(app: Flask, balance_event: Event) -> None:
+    """BALANCE_SQL_THRESHOLD routes large events to the SQL backend."""
+    with patch('app.balance.compute_balance_sheet_sql', wraps=compute_balance_sheet_sql) as sql:
+        app.config['BALANCE_SQL_THRESHOLD'] = 0
+        build_balance_sheet(balance_event)
+        assert not sql.called
+
+        app.config['BALANCE_SQL_THRESHOLD'] = balance_event.expenses.count()
+        build_balance_sheet(balance_event)
+        assert sql.called
+
+
+# ---------------------------------------------------------------------------
+# Minimal-transfer settlement planner
+# ---------------------------------------------------------------------------
+
+def test_plan_minimal_transfers_settles_all_balances() -> None:
+    """The planner zeroes every balance with at most N-1 direct transfers."""
+    rng = np.random.default_rng(7)
+    balances = np.round(rng.normal(0, 100, 50), 2)
+    balances[-1] -= balances.sum()
+
+    transfers = plan_minimal_transfers(balances, 0.01)
+
+    assert len(transfers) <= len(balances) - 1
+    remaining = balances.copy()
+    for sender, recipient, amount in transfers:
+        assert amount > 0
+        remaining[sender] += amount
+        remaining[recipient] -= amount
+    assert np.all(np.abs(remaining) <= 0.01)
+
+
+def test_plan_minimal_transfers_matches_pairs_directly() -> None:
+    """Debtors pay creditors directly instead of going through a hub."""
+    transfers = plan_minimal_transfers(np.array([30.0, -30.0, 10.0, -10.0]), 0.01)
+    assert sorted(transfers) == [(1, 0, 30.0), (3, 2, 10.0)]
+
+
+def test_minimal_settlement_mode_bypasses_accountant(balance_event: Event) -> None:
+    """Events in minimal mode plan direct transfers that settle all balances."""
+    balance_event.settlement_mode = SETTLEMENT_MODE_MINIMAL
+    db.session.commit()
+
+    sheet = compute_balance_sheet(balance_event)
+    plan = balance_event.get_compensation_plan(sheet)
+    assert len(plan) <= len(sheet.eventusers) - 1
+
+    remaining = {row[0].id: row[5] for row in sheet.rows()}
+    for sender, recipient, amount in plan:
+        remaining[sender.id] += amount
+        remaining[recipient.id] -= amount
+    tolerance = 10 ** -balance_event.base_currency.exponent
+    assert all(abs(value) <= tolerance for value in remaining.values())
+
+
+# ---------------------------------------------------------------------------
+# Event-scoped rate table
+# ---------------------------------------------------------------------------
+
+def test_event_rates_match_orm_conversion(balance_event: Event) -> None:
+    """EventRates converts and formats exactly like the ORM helpers."""
+    rates = balance_event.get_rates()
+
+    items = balance_event.expenses.all() + balance_event.settlements.all()
+    assert len({item.currency_id for item in items}) == 2
+    for item in items:
+        assert item.get_amount(rates) == pytest.approx(item.get_amount())
+        assert item.get_amount_str(rates) == item.get_amount_str()
+
+    sheet = compute_balance_sheet(balance_event)
+    assert balance_event.get_balance(sheet, rates) == balance_event.get_balance(sheet)
+
+
+def test_event_rates_avoid_per_row_queries(balance_event: Event) -> None:
+    """Formatting a list with a prebuilt rate table issues no further queries."""
+    rates = balance_event.get_rates()
+    expenses = balance_event.expenses.all()
+    statements: list[str] = []
+
+    def _record(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    db.session.expire_all()
+    for expense in expenses:
+        expense.amount  # reload the expense row itself
+    sa_event.listen(db.engine, 'before_cursor_execute', _record)
+    try:
+        strings = [expense.get_amount_str(rates) for expense in expenses]
+    finally:
+        sa_event.remove(db.engine, 'before_cursor_execute', _record)
+
+    assert len(strings) == len(expenses)
+    assert statements == []
+
+
+# ---------------------------------------------------------------------------
+# Bulk currency conversion
+# ---------------------------------------------------------------------------
+
+def test_convert_currencies_to_base_preserves_balances(balance_event: Event) -> None:
+    """Converting in SQL matches the ORM conversion and leaves balances intact."""
+    expected = {
+        (type(item), item.id): item.get_amount()
+        for item in balance_event.expenses.all() + balance_event.settlements.all()
+    }
+    before = compute_balance_sheet(balance_event)
+
+    balance_event.convert_currencies_to_base()
+    db.session.commit()
+
+    for item in balance_event.expenses.all() + balance_event.settlements.all():
+        assert item.currency_id == balance_event.base_currency_id
+        assert item.currency == balance_event.base_currency
+        assert item.amount == pytest.approx(expected[(type(item), item.id)])
+
+    after = compute_balance_sheet(balance_event)
+    for before_row, after_row in zip(before.rows(), after.rows()):
+        assert after_row[1:] == pytest.approx(before_row[1:])
+
+
+def test_convert_currencies_to_base_rejects_orphaned_currency(balance_event: Event) -> None:
+    """A currency without an event rate aborts the conversion instead of nulling amounts."""
+    eur = next(c for c in balance_event.currencies if c.id != balance_event.base_currency_id)
+    EventCurrency.query.filter_by(event_id=balance_event.id, currency_id=eur.id).delete()
+    db.session.commit()
+    amounts = {(type(item), item.id): (item.amount, item.currency_id)
+               for item in balance_event.expenses.all() + balance_event.settlements.all()}
+
+    with pytest.raises(ValueError, match='without an exchange rate'):
+        balance_event.convert_currencies_to_base()
+    db.session.rollback()
+
+    for item in balance_event.expenses.all() + balance_event.settlements.all():
+        assert (item.amount, item.currency_id) == amounts[(type(item), item.id)]
+
+
+@pytest.mark.parametrize('compute', [compute_balance_sheet, compute_balance_sheet_sql, rebuild_event_ledger])
+def test_balance_backends_reject_orphaned_currency(balance_event: Event, compute) -> None:
+    """The NumPy and SQL engines and the ledger all refuse amounts without an event rate."""
+    eur = next(c for c in balance_event.currencies if c.id != balance_event.base_currency_id)
+    EventCurrency.query.filter_by(event_id=balance_event.id, currency_id=eur.id).delete()
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='without an exchange rate'):
+        compute(balance_event)
@@ -0,0 +1,250 @@
+# coding=utf-8
+"""Tests for the incrementally maintained balance ledger (``event_balances``)."""
+
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask
+
+from app import db
+from app.balance_ledger import read_ledger_sheet, verify_event_ledger
+from app.cli import register
+from app.models import Currency, Event, EventBalance, EventUser, User
+from app.services import event_service
+
+
+def _assert_ledger_consistent(event: Event) -> None:
+    """The ledger exists and matches a full recomputation."""
+    assert read_ledger_sheet(event) is not None
+    assert verify_event_ledger(event) == []
+
+
+@pytest.fixture
+def ledger_event(app: Flask, api_event: Event, api_second_currency: Currency) -> Event:
+    """Return an event created through the service layer with three participants."""
+    admin = db.session.get(User, api_event.admin_id)
+    eur = db.session.get(Currency, api_second_currency.id)
+    result = event_service.create_event(
+        name=f'Ledger {uuid.uuid4().hex[:8]}',
+        date=datetime.now(timezone.utc),
+        admin=admin,
+        base_currency_id=api_event.base_currency_id,
+        currency_ids=[api_event.base_currency_id, eur.id],
+        exchange_fee=2.0,
+        fileshare_link='',
+        description='',
+        created_by='test',
+    )
+    event = result.event
+    for name, weighting in (('alice', 2.0), ('bob', 0.5)):
+        suffix = uuid.uuid4().hex[:8]
+        event_service.add_event_user(
+            event, f'{name}_{suffix}', f'{name}_{suffix}@example.com', weighting, 'en',
+        )
+    return event
+
+
+def _participants(event: Event) -> list[EventUser]:
+    return event.users.order_by(EventUser.id).all()
+
+
+# ---------------------------------------------------------------------------
+# Incremental maintenance through the service layer
+# ---------------------------------------------------------------------------
+
+def test_new_event_has_ledger(ledger_event: Event) -> None:
+    """create_event and add_event_user open a ledger row per participant."""
+    assert EventBalance.query.filter_by(event_id=ledger_event.id).count() == 3
+    _assert_ledger_consistent(ledger_event)
+
+
+def test_expense_lifecycle_updates_ledger(ledger_event: Event, api_second_currency: Currency) -> None:
+    """Creating, updating and removing expenses keeps the ledger in sync."""
+    admin, alice, bob = _participants(ledger_event)
+    now = datetime.now(timezone.utc)
+
+    expense = event_service.create_expense(
+        ledger_event, admin, ledger_event.base_currency_id, 90.0,
+        [admin.id, alice.id, bob.id], now, 'dinner', 'test',
+    ).expense
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.update_expense(
+        str(expense.guid), api_second_currency.id, 40.0, [alice.id, bob.id], now, 'dinner',
+    )
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.add_expense_user(str(expense.guid), str(admin.guid))
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.remove_expense_user(str(expense.guid), str(bob.guid))
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.remove_expense(str(expense.guid))
+    _assert_ledger_consistent(ledger_event)
+    sheet = read_ledger_sheet(ledger_event)
+    assert sheet.total_expenses == pytest.approx(0.0)
+
+
+def test_settlement_lifecycle_updates_ledger(ledger_event: Event, api_second_currency: Currency) -> None:
+    """Draft settlements are ignored until confirmed; updates and removals apply."""
+    admin, alice, bob = _participants(ledger_event)
+
+    draft = event_service.create_settlement(
+        ledger_event, alice, admin.id, ledger_event.base_currency_id, 15.0, '', 'test', draft=True,
+    ).settlement
+    assert read_ledger_sheet(ledger_event).sent.sum() == 0.0
+
+    event_service.execute_draft_settlement(str(draft.guid), 'test')
+    _assert_ledger_consistent(ledger_event)
+    assert read_ledger_sheet(ledger_event).sent.sum() == pytest.approx(15.0)
+
+    settlement = event_service.create_settlement(
+        ledger_event, bob, alice.id, api_second_currency.id, 10.0, '', 'test',
+    ).settlement
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.update_settlement(str(settlement.guid), ledger_event.base_currency_id, 12.0, admin.id, '')
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.remove_settlement(str(settlement.guid))
+    event_service.remove_settlement(str(draft.guid))
+    _assert_ledger_consistent(ledger_event)
+    assert read_ledger_sheet(ledger_event).sent.sum() == pytest.approx(0.0)
+
+
+def test_rate_and_weighting_changes_rebuild_ledger(ledger_event: Event, api_second_currency: Currency) -> None:
+    """set_currency_rate and weighting updates recompute the ledger."""
+    admin, alice, bob = _participants(ledger_event)
+    event_service.create_expense(
+        ledger_event, alice, api_second_currency.id, 50.0,
+        [admin.id, alice.id, bob.id], datetime.now(timezone.utc), '', 'test',
+    )
+
+    event_service.set_currency_rate(str(ledger_event.guid), str(api_second_currency.guid), 1.5)
+    _assert_ledger_consistent(ledger_event)
+
+    event_service.update_event_user_profile(
+        str(bob.guid), bob.username, bob.email, 3.0, '', 'en',
+    )
+    _assert_ledger_consistent(ledger_event)
+
+
+def test_update_event_rebuilds_ledger_only_on_conversion_changes(ledger_event: Event) -> None:
+    """Editing the event's details keeps the ledger; changing the exchange fee rebuilds it."""
+    admin, alice, _bob = _participants(ledger_event)
+    event_service.create_expense(
+        ledger_event, admin, ledger_event.base_currency_id, 30.0,
+        [alice.id], datetime.now(timezone.utc), '', 'test',
+    )
+    row = EventBalance.query.filter_by(event_id=ledger_event.id, eventuser_id=alice.id).one()
+    row.spent = 1234.0
+    db.session.commit()
+    db.session.expunge(row)
+    spent = db.select(EventBalance.spent).filter_by(event_id=ledger_event.id, eventuser_id=alice.id)
+    currency_ids = [c.id for c in ledger_event.currencies]
+
+    def update(exchange_fee: float) -> None:
+        event_service.update_event(
+            str(ledger_event.guid), 'Renamed', ledger_event.date, '', 'edited',
+            ledger_event.base_currency_id, exchange_fee, ledger_event.accountant_id, currency_ids,
+        )
+
+    update(ledger_event.exchange_fee)
+    assert ledger_event.name == 'Renamed'
+    assert db.session.scalar(spent) == 1234.0
+
+    update(ledger_event.exchange_fee + 1)
+    _assert_ledger_consistent(ledger_event)
+
+
+def test_unconvertible_amounts_are_refused(ledger_event: Event, api_second_currency: Currency) -> None:
+    """Expenses in a currency without an event rate, or removing a rate still in use, fail instead of counting 0."""
+    admin, alice, _bob = _participants(ledger_event)
+    now = datetime.now(timezone.utc)
+    unrated = Currency(code='XTS', name='Test', number=963, exponent=2, inCHF=2.0, description='')
+    db.session.add(unrated)
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='without an exchange rate'):
+        event_service.create_expense(ledger_event, admin, unrated.id, 10.0, [alice.id], now, '', 'test')
+    db.session.rollback()
+    assert ledger_event.expenses.count() == 0
+
+    event_service.create_expense(ledger_event, admin, api_second_currency.id, 10.0, [alice.id], now, '', 'test')
+    with pytest.raises(ValueError, match='without an exchange rate'):
+        event_service.update_event(
+            str(ledger_event.guid), ledger_event.name, ledger_event.date, '', '',
+            ledger_event.base_currency_id, ledger_event.exchange_fee, ledger_event.accountant_id,
+            [ledger_event.base_currency_id],
+        )
+    db.session.rollback()
+    assert api_second_currency.id in {c.id for c in ledger_event.currencies}
+    _assert_ledger_consistent(ledger_event)
+    db.session.delete(unrated)
+    db.session.commit()
+
+
+def test_event_without_ledger_is_rebuilt_on_write(api_event: Event) -> None:
+    """Events predating the ledger get one on their first write."""
+    event = db.session.get(Event, api_event.id)
+    admin = event.accountant
+    assert read_ledger_sheet(event) is None
+
+    event_service.create_expense(
+        event, admin, event.base_currency_id, 25.0, [admin.id],
+        datetime.now(timezone.utc), '', 'test',
+    )
+    _assert_ledger_consistent(event)
+
+
+def test_get_balance_sheet_reads_ledger(ledger_event: Event) -> None:
+    """Event.get_balance_sheet returns the ledger totals when available."""
+    admin, alice, _bob = _participants(ledger_event)
+    event_service.create_expense(
+        ledger_event, admin, ledger_event.base_currency_id, 30.0,
+        [alice.id], datetime.now(timezone.utc), '', 'test',
+    )
+    row = EventBalance.query.filter_by(event_id=ledger_event.id, eventuser_id=alice.id).one()
+    row.spent = 1234.0
+    db.session.commit()
+
+    assert ledger_event.get_balance_sheet().get_user_balance(alice)[2] == 1234.0
+
+
+# ---------------------------------------------------------------------------
+# flask dbmaint rebuild-balances
+# ---------------------------------------------------------------------------
+
+def test_rebuild_balances_verify_only_reports_mismatch(app: Flask, ledger_event: Event) -> None:
+    """--verify-only flags a tampered ledger and exits non-zero."""
+    admin = _participants(ledger_event)[0]
+    row = EventBalance.query.filter_by(event_id=ledger_event.id, eventuser_id=admin.id).one()
+    row.paid = 99.0
+    db.session.commit()
+
+    register(app)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['dbmaint', 'rebuild-balances', '--event', str(ledger_event.guid), '--verify-only'])
+
+    assert result.exit_code == 1, result.output
+    assert '1 mismatching' in result.output
+
+
+def test_rebuild_balances_repairs_ledger(app: Flask, ledger_event: Event) -> None:
+    """rebuild-balances recomputes a tampered ledger."""
+    admin = _participants(ledger_event)[0]
+    row = EventBalance.query.filter_by(event_id=ledger_event.id, eventuser_id=admin.id).one()
+    row.paid = 99.0
+    db.session.commit()
+
+    register(app)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['dbmaint', 'rebuild-balances', '--event', str(ledger_event.guid)])
+
+    assert result.exit_code == 0, result.output
+    assert '1 event ledger(s) rebuilt' in result.output
+    _assert_ledger_consistent(ledger_event)
@@ -0,0 +1,173 @@
+# coding=utf-8
+"""Tests for content-addressed storage, shared objects and ``flask dbmaint collapse-duplicate-files``."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+from io import BytesIO
+
+import pytest
+from flask import Flask
+
+from app import db
+from app.cli import register
+from app.models import File
+from app.services.media_service import collapse_duplicate_files
+from app.storage import content_addressed_key
+
+
+@pytest.fixture
+def make_file(app: Flask):
+    """Build unsaved File rows; every row and object created through it is removed afterwards."""
+    created: list[File] = []
+
+    def _make(content: bytes, storage_key: str | None = None) -> File:
+        file_obj = File(
+            original_filename='receipt.pdf',
+            storage_backend='local',
+            storage_key=storage_key or f'static/img/{uuid.uuid4().hex}.pdf',
+            mime_type='application/pdf',
+            file_size=len(content),
+            file_hash=hashlib.sha256(content).hexdigest(),
+            hash_algorithm='sha256',
+        )
+        created.append(file_obj)
+        return file_obj
+
+    yield _make
+
+    db.session.rollback()
+    keys = {file_obj.storage_key for file_obj in created}
+    keys.add(content_addressed_key(created[0].file_hash) if created else '')
+    ids = [file_obj.id for file_obj in created if file_obj.id is not None]
+    File.query.filter(File.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    for key in filter(None, keys):
+        if _stored(app, key):
+            os.remove(os.path.join(app.config['STORAGE_LOCAL_PATH'], key))
+
+
+def _content() -> bytes:
+    """Return content no other test stores, so only this test's rows share its hash."""
+    return f'receipt {uuid.uuid4()}'.encode()
+
+
+def _stored(app: Flask, storage_key: str) -> bool:
+    return os.path.exists(os.path.join(app.config['STORAGE_LOCAL_PATH'], storage_key))
+
+
+def _save(file_obj: File, content: bytes) -> None:
+    file_obj.get_provider().save(file_obj.storage_key, BytesIO(content), file_obj.mime_type)
+
+
+def test_identical_content_is_stored_once(app: Flask, make_file) -> None:
+    """Content-addressed files share one object, which outlives all but the last row."""
+    app.config['STORAGE_CONTENT_ADDRESSED'] = True
+    content = _content()
+    first, second = make_file(content), make_file(content)
+    for file_obj in (first, second):
+        file_obj.save_content(BytesIO(content))
+        db.session.add(file_obj)
+        db.session.commit()
+
+    key = content_addressed_key(first.file_hash)
+    assert first.storage_key == second.storage_key == key
+    assert first.count_other_references() == 1
+
+    first.delete_from_storage()
+    db.session.delete(first)
+    db.session.commit()
+    assert _stored(app, key)
+
+    second.delete_from_storage()
+    assert not _stored(app, key)
+
+
+@pytest.mark.parametrize('broken', ['missing', 'read_error'])
+def test_upload_is_repeated_for_unusable_references(app: Flask, make_file, broken: str) -> None:
+    """A reference whose object is gone, or which is flagged unreadable, does not skip the upload."""
+    app.config['STORAGE_CONTENT_ADDRESSED'] = True
+    content = _content()
+    existing = make_file(content, storage_key=content_addressed_key(hashlib.sha256(content).hexdigest()))
+    existing.read_error = broken == 'read_error'
+    if broken == 'read_error':
+        _save(existing, b'bit rot')
+    db.session.add(existing)
+    db.session.commit()
+
+    new = make_file(content)
+    new.save_content(BytesIO(content))
+
+    assert new.storage_key == existing.storage_key
+    with open(os.path.join(app.config['STORAGE_LOCAL_PATH'], new.storage_key), 'rb') as f:
+        assert f.read() == content
+
+
+def test_uuid_keys_without_content_addressing(app: Flask, make_file) -> None:
+    content = _content()
+    file_obj = make_file(content)
+    key = file_obj.storage_key
+    file_obj.save_content(BytesIO(content))
+    assert file_obj.storage_key == key and _stored(app, key)
+
+
+def test_collapse_duplicate_files(app: Flask, make_file) -> None:
+    """Duplicates move to the oldest readable copy; the other objects are deleted."""
+    content = _content()
+    lost, kept, extra = make_file(content), make_file(content), make_file(content)
+    unrelated = make_file(_content())
+    for file_obj in (kept, extra, unrelated):
+        _save(file_obj, content)
+    db.session.add_all([lost, kept, extra, unrelated])
+    db.session.commit()
+    keys = {f.id: f.storage_key for f in (lost, kept, extra, unrelated)}
+
+    dry_run = collapse_duplicate_files([kept.file_hash, unrelated.file_hash], dry_run=True)
+    assert (dry_run.files, dry_run.objects_removed, dry_run.failures) == (2, 2, [])
+    assert all(db.session.get(File, file_id).storage_key == key for file_id, key in keys.items())
+
+    result = collapse_duplicate_files([kept.file_hash, unrelated.file_hash])
+
+    # The lost row's object never existed, so deleting it reclaims nothing but is harmless
+    assert (result.files, result.objects_removed, result.failures) == (2, 2, [])
+    assert {db.session.get(File, f.id).storage_key for f in (lost, kept, extra)} == {keys[kept.id]}
+    assert db.session.get(File, unrelated.id).storage_key == keys[unrelated.id]
+    assert _stored(app, keys[kept.id]) and not _stored(app, keys[extra.id])
+
+
+def test_collapse_into_content_addressed_key(app: Flask, make_file) -> None:
+    app.config['STORAGE_CONTENT_ADDRESSED'] = True
+    content = _content()
+    files = [make_file(content), make_file(content)]
+    for file_obj in files:
+        _save(file_obj, content)
+    db.session.add_all(files)
+    db.session.commit()
+    old_keys = [f.storage_key for f in files]
+
+    result = collapse_duplicate_files([files[0].file_hash])
+
+    assert (result.files, result.objects_removed, result.failures) == (2, 2, [])
+    key = content_addressed_key(files[0].file_hash)
+    assert [db.session.get(File, f.id).storage_key for f in files] == [key, key]
+    assert _stored(app, key) and not any(_stored(app, old) for old in old_keys)
+
+
+def test_collapse_command_dry_run(app: Flask, make_file) -> None:
+    """The command walks every duplicate hash and reports throughput; a dry run changes nothing."""
+    content = _content()
+    files = [make_file(content), make_file(content)]
+    for file_obj in files:
+        _save(file_obj, content)
+    db.session.add_all(files)
+    db.session.commit()
+    keys = [f.storage_key for f in files]
+
+    register(app)
+    result = app.test_cli_runner().invoke(args=['dbmaint', 'collapse-duplicate-files', '--dry-run'])
+
+    assert 'would be repointed' in result.output and 'hashes/s' in result.output
+    assert [db.session.get(File, f.id).storage_key for f in files] == keys
+    assert all(_stored(app, key) for key in keys)
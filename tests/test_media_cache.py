@@ -0,0 +1,130 @@
+# coding=utf-8
+"""Tests for the Redis media cache: byte budget, second-hit admission and stats."""
+
+from __future__ import annotations
+
+import hashlib
+import uuid
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from app import db
+from app.cli import register
+from app.models import File
+from app.services.media_service import get_cached_file_bytes, get_media_cache_stats
+from app.storage import StorageProvider
+
+
+class _CountingProvider(StorageProvider):
+    """In-memory object store counting reads per key."""
+
+    def __init__(self) -> None:
+        self.objects: dict[str, bytes] = {}
+        self.reads: list[str] = []
+
+    def get_local_path(self, storage_key: str) -> None:
+        return None
+
+    def get_file_stream(self, storage_key: str, start: int = 0) -> BytesIO:
+        self.reads.append(storage_key)
+        return BytesIO(self.objects[storage_key][start:])
+
+
+@pytest.fixture
+def fake_redis():
+    r = pytest.importorskip('fakeredis').FakeRedis()
+    with patch('app.services.media_service._get_redis_connection', return_value=r):
+        yield r
+
+
+@pytest.fixture
+def provider():
+    provider = _CountingProvider()
+    with patch.object(File, 'get_provider', return_value=provider):
+        yield provider
+
+
+def _file(provider: _CountingProvider, content: bytes) -> File:
+    storage_key = f'images/{uuid.uuid4().hex}.jpg'
+    provider.objects[storage_key] = content
+    file_obj = File(
+        original_filename='photo.jpg',
+        storage_backend='s3',
+        storage_key=storage_key,
+        mime_type='image/jpeg',
+        file_size=len(content),
+        file_hash=hashlib.sha256(content).hexdigest(),
+        hash_algorithm='sha256',
+    )
+    db.session.add(file_obj)
+    db.session.commit()
+    return file_obj
+
+
+def test_file_is_admitted_on_second_request(app: Flask, fake_redis, provider) -> None:
+    """A single read never fills Redis; the second one does and later reads are hits."""
+    file_obj = _file(provider, b'x' * 1000)
+
+    get_cached_file_bytes(file_obj)
+    assert get_media_cache_stats().entries == 0
+
+    get_cached_file_bytes(file_obj)
+    assert get_cached_file_bytes(file_obj).file_bytes == b'x' * 1000
+
+    stats = get_media_cache_stats()
+    assert (stats.entries, stats.bytes, stats.hits, stats.misses) == (1, 1000, 1, 2)
+    assert stats.hit_ratio == pytest.approx(1 / 3)
+    assert provider.reads == [file_obj.storage_key] * 2
+
+
+def test_identical_files_share_an_entry(app: Flask, fake_redis, provider) -> None:
+    """Entries are keyed by content hash, so duplicates are served from one entry."""
+    first = _file(provider, b'same thumbnail')
+    duplicate = _file(provider, b'same thumbnail')
+    get_cached_file_bytes(first)
+    get_cached_file_bytes(first)
+
+    assert get_cached_file_bytes(duplicate).file_bytes == b'same thumbnail'
+    assert duplicate.storage_key not in provider.reads
+    assert get_media_cache_stats().entries == 1
+
+
+def test_byte_budget_evicts_least_recently_used(app: Flask, fake_redis, provider) -> None:
+    """Beyond MEDIA_CACHE_MAX_MEMORY the entry used longest ago is evicted."""
+    app.config['MEDIA_CACHE_MAX_MEMORY'] = 2500
+    a, b, c = (_file(provider, bytes([i]) * 1000) for i in range(3))
+    for file_obj in (a, a, b, b):
+        get_cached_file_bytes(file_obj)
+    get_cached_file_bytes(a)  # a is now more recently used than b
+
+    get_cached_file_bytes(c)
+    get_cached_file_bytes(c)
+
+    stats = get_media_cache_stats()
+    assert (stats.entries, stats.bytes, stats.evictions) == (2, 2000, 1)
+    provider.reads.clear()
+    get_cached_file_bytes(a)
+    get_cached_file_bytes(b)
+    assert provider.reads == [b.storage_key]
+
+
+def test_flush_media_cache_reports_stats(app: Flask, fake_redis, provider) -> None:
+    file_obj = _file(provider, b'y' * 2048)
+    for _ in range(4):
+        get_cached_file_bytes(file_obj)
+    register(app)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['flush-media-cache', '--stats-only'])
+    assert result.exit_code == 0, result.output
+    assert '1 entries' in result.output
+    assert 'hit ratio 50.0% (2 hits, 2 misses)' in result.output
+    assert get_media_cache_stats().entries == 1
+
+    result = runner.invoke(args=['flush-media-cache'])
+    assert result.exit_code == 0, result.output
+    assert 'Successfully flushed 1 media files' in result.output
+    assert fake_redis.keys('media_cache*') == []
@@ -0,0 +1,165 @@
+# coding=utf-8
+"""Tests for the local disk tier of the media cache."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import uuid
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from prometheus_client import CollectorRegistry
+
+from app import db
+from app.media.disk_cache import MediaDiskCache
+from app.models import File
+from app.storage import StorageProvider
+
+CONTENT = bytes(range(256)) * 64  # 16 KiB
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class _RemoteProvider(StorageProvider):
+    """In-memory stand-in for S3 that records every read."""
+
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.starts: list[int] = []
+
+    def get_local_path(self, storage_key: str) -> None:
+        return None
+
+    def get_file_stream(self, storage_key: str, start: int = 0) -> BytesIO:
+        self.starts.append(start)
+        return BytesIO(self.content[start:])
+
+
+@pytest.fixture
+def registry() -> CollectorRegistry:
+    return CollectorRegistry()
+
+
+@pytest.fixture
+def cache(tmp_path, registry: CollectorRegistry) -> MediaDiskCache:
+    return MediaDiskCache(str(tmp_path), max_bytes=250, registry=registry)
+
+
+def test_put_and_read(cache: MediaDiskCache, registry: CollectorRegistry) -> None:
+    """Entries are readable by hash; hits and misses are counted."""
+    assert cache.read(_hash(b'a')) is None
+    cache.put(_hash(b'a'), b'a' * 100)
+
+    assert cache.read(_hash(b'a')) == b'a' * 100
+    assert registry.get_sample_value('media_disk_cache_hits_total') == 1
+    assert registry.get_sample_value('media_disk_cache_misses_total') == 1
+
+
+def test_least_recently_used_entry_is_evicted(cache: MediaDiskCache, registry: CollectorRegistry) -> None:
+    """Beyond the byte budget the entry read longest ago is removed first."""
+    cache.put('aa', b'a' * 100)
+    cache.put('bb', b'b' * 100)
+    os.utime(cache.path_for('aa'), (1000, 1000))
+    os.utime(cache.path_for('bb'), (2000, 2000))
+    assert cache.get_path('aa') is not None  # 'aa' is now the most recently used
+
+    cache.put('cc', b'c' * 100)
+
+    assert cache.get_path('bb') is None
+    assert cache.read('aa') == b'a' * 100
+    assert cache.read('cc') == b'c' * 100
+    assert registry.get_sample_value('media_disk_cache_evictions_total') == 1
+
+
+def test_uncommitted_entries_are_invisible(cache: MediaDiskCache) -> None:
+    """Partially written entries never appear under their hash and leave no temp file."""
+    with cache.begin('dd') as entry:
+        entry.write(b'partial')
+        assert cache.get_path('dd') is None
+
+    assert cache.get_path('dd') is None
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_concurrent_writers_publish_whole_files(tmp_path) -> None:
+    """Workers racing on the same hash leave one complete entry."""
+    payload = os.urandom(256 * 1024)
+    caches = [MediaDiskCache(str(tmp_path), max_bytes=10 * 1024 * 1024) for _ in range(8)]
+    threads = [threading.Thread(target=c.put, args=('ee', payload)) for c in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert caches[0].read('ee') == payload
+    assert os.listdir(caches[0].tmp_dir) == []
+
+
+# ---------------------------------------------------------------------------
+# Serving through the disk tier
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def remote_file(app: Flask, tmp_path) -> File:
+    app.config['MEDIA_DISK_CACHE_PATH'] = str(tmp_path / 'media-cache')
+    file_obj = File(
+        original_filename='receipt.pdf',
+        storage_backend='s3',
+        storage_key=f'images/{uuid.uuid4().hex}.pdf',
+        mime_type='application/pdf',
+        file_size=len(CONTENT),
+        file_hash=_hash(CONTENT),
+        hash_algorithm='sha256',
+    )
+    db.session.add(file_obj)
+    db.session.commit()
+    return file_obj
+
+
+def test_large_file_is_cached_while_streaming(client: FlaskClient, remote_file: File) -> None:
+    """The first full download fills the disk cache; later requests and ranges skip storage."""
+    provider = _RemoteProvider(CONTENT)
+    with patch.object(File, 'get_provider', return_value=provider), \
+            patch('app.media.serving.MEDIA_CACHE_MAX_BYTES', 1024):
+        first = client.get(f'/media/{remote_file.id}')
+        assert first.data == CONTENT
+
+        second = client.get(f'/media/{remote_file.id}')
+        ranged = client.get(f'/media/{remote_file.id}', headers={'Range': 'bytes=100-199'})
+
+    assert provider.starts == [0]
+    assert second.data == CONTENT
+    assert second.headers['ETag'] == f'"{remote_file.file_hash}"'
+    assert ranged.status_code == 206
+    assert ranged.data == CONTENT[100:200]
+
+
+def test_range_requests_are_not_cached(client: FlaskClient, remote_file: File) -> None:
+    provider = _RemoteProvider(CONTENT)
+    with patch.object(File, 'get_provider', return_value=provider), \
+            patch('app.media.serving.MEDIA_CACHE_MAX_BYTES', 1024):
+        client.get(f'/media/{remote_file.id}', headers={'Range': 'bytes=1000-'})
+        client.get(f'/media/{remote_file.id}')
+
+    assert provider.starts == [1000, 0]
+
+
+def test_small_file_is_served_from_disk_on_redis_miss(app: Flask, client: FlaskClient, remote_file: File) -> None:
+    """Files not (yet) admitted to Redis are served from disk instead of storage; hits and misses are exported."""
+    fakeredis = pytest.importorskip('fakeredis')
+    provider = _RemoteProvider(CONTENT)
+    with patch.object(File, 'get_provider', return_value=provider), \
+            patch('app.services.media_service._get_redis_connection', return_value=fakeredis.FakeRedis()):
+        assert client.get(f'/media/{remote_file.id}').data == CONTENT
+        assert client.get(f'/media/{remote_file.id}').data == CONTENT
+
+    assert provider.starts == [0]
+    assert app.metrics.registry.get_sample_value('media_disk_cache_hits_total') == 1
+    assert app.metrics.registry.get_sample_value('media_disk_cache_misses_total') == 1
@@ -0,0 +1,245 @@
+# coding=utf-8
+"""Tests for media serving: Range, ETag/304, proxy offload and presigned redirects."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from flask import Flask
+from flask.testing import FlaskClient
+
+from app import db
+from app.models import File
+from app.storage import StorageProvider
+
+CONTENT = bytes(range(256)) * 64  # 16 KiB
+
+
+def _store_file(app: Flask, content: bytes = CONTENT) -> File:
+    """Save *content* to local storage and return its File row."""
+    storage_key = f'img/{uuid.uuid4().hex}.jpg'
+    path = os.path.join(app.config['STORAGE_LOCAL_PATH'], storage_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    file_obj = File(
+        original_filename='receipt.jpg',
+        storage_backend='local',
+        storage_key=storage_key,
+        mime_type='image/jpeg',
+        file_size=len(content),
+        file_hash=hashlib.sha256(content).hexdigest(),
+        hash_algorithm='sha256',
+    )
+    db.session.add(file_obj)
+    db.session.commit()
+    return file_obj
+
+
+class _RemoteProvider(StorageProvider):
+    """In-memory stand-in for an object store without local paths."""
+
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.starts: list[int] = []
+
+    def get_local_path(self, storage_key: str) -> None:
+        return None
+
+    def get_file_stream(self, storage_key: str, start: int = 0) -> BytesIO:
+        self.starts.append(start)
+        return BytesIO(self.content[start:])
+
+
+@pytest.fixture
+def stored_file(app: Flask) -> File:
+    return _store_file(app)
+
+
+# ---------------------------------------------------------------------------
+# Local files
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('url', ['/media/{id}', '/apis/media/files/{id}'])
+def test_serve_local_file_with_etag(client: FlaskClient, stored_file: File, url: str) -> None:
+    """Files are served with a strong ETag derived from the file hash."""
+    resp = client.get(url.format(id=stored_file.id))
+
+    assert resp.status_code == 200
+    assert resp.data == CONTENT
+    assert resp.headers['ETag'] == f'"{stored_file.file_hash}"'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert 'max-age=31536000' in resp.headers['Cache-Control']
+
+
+def test_if_none_match_skips_storage(client: FlaskClient, stored_file: File) -> None:
+    """A matching If-None-Match is answered with 304 without opening storage or Redis."""
+    with patch.object(File, 'get_provider', side_effect=AssertionError('storage touched')), \
+            patch('app.services.media_service._get_redis_connection', side_effect=AssertionError('redis touched')):
+        resp = client.get(f'/media/{stored_file.id}', headers={'If-None-Match': f'"{stored_file.file_hash}"'})
+
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == f'"{stored_file.file_hash}"'
+    assert resp.data == b''
+
+
+def test_range_request_local(client: FlaskClient, stored_file: File) -> None:
+    """Range requests on local files return 206 with the requested slice."""
+    resp = client.get(f'/media/{stored_file.id}', headers={'Range': 'bytes=100-199'})
+
+    assert resp.status_code == 206
+    assert resp.data == CONTENT[100:200]
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+
+
+def test_missing_local_file_returns_404(app: Flask, client: FlaskClient, stored_file: File) -> None:
+    """A file row whose object is gone yields 404 and is flagged."""
+    os.remove(os.path.join(app.config['STORAGE_LOCAL_PATH'], stored_file.storage_key))
+    with patch.object(app.logger, 'error'):
+        resp = client.get(f'/media/{stored_file.id}')
+
+    assert resp.status_code == 404
+    assert db.session.get(File, stored_file.id).read_error is True
+
+
+# ---------------------------------------------------------------------------
+# Remote objects streamed in chunks
+# ---------------------------------------------------------------------------
+
+def test_large_remote_file_is_streamed(client: FlaskClient, stored_file: File) -> None:
+    """Objects above the Redis size limit are piped from storage in chunks."""
+    provider = _RemoteProvider(CONTENT)
+    with patch.object(File, 'get_provider', return_value=provider), \
+            patch('app.media.serving.MEDIA_CACHE_MAX_BYTES', 1024), \
+            patch('app.media.serving.STREAM_CHUNK_SIZE', 1000), \
+            patch('app.services.media_service._get_redis_connection', side_effect=AssertionError('redis touched')):
+        resp = client.get(f'/media/{stored_file.id}')
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        assert resp.data == CONTENT
+
+        ranged = client.get(f'/media/{stored_file.id}', headers={'Range': 'bytes=1000-'})
+
+    assert ranged.status_code == 206
+    assert ranged.data == CONTENT[1000:]
+    assert ranged.headers['Content-Range'] == f'bytes 1000-{len(CONTENT) - 1}/{len(CONTENT)}'
+    assert provider.starts == [0, 1000]
+
+
+def test_remote_range_not_satisfiable(client: FlaskClient, stored_file: File) -> None:
+    """A range beyond the end of the object returns 416."""
+    with patch.object(File, 'get_provider', return_value=_RemoteProvider(CONTENT)), \
+            patch('app.media.serving.MEDIA_CACHE_MAX_BYTES', 1024):
+        resp = client.get(f'/media/{stored_file.id}', headers={'Range': f'bytes={len(CONTENT) + 10}-'})
+
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+# ---------------------------------------------------------------------------
+# Reverse-proxy offload (X-Accel-Redirect / X-Sendfile)
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('url', ['/media/{id}', '/apis/media/files/{id}'])
+def test_x_accel_redirect_reads_no_bytes(app: Flask, client: FlaskClient, stored_file: File, url: str) -> None:
+    """With X-Accel-Redirect the app only sends headers; nginx streams the file."""
+    app.config['MEDIA_SENDFILE_HEADER'] = 'X-Accel-Redirect'
+    app.config['MEDIA_SENDFILE_PREFIX'] = '/internal/media/'
+    # Removing the object proves the app neither opens nor stats it
+    os.remove(os.path.join(app.config['STORAGE_LOCAL_PATH'], stored_file.storage_key))
+
+    with patch('app.media.serving.send_file', side_effect=AssertionError('body sent')), \
+            patch('app.media.serving.open_file_stream', side_effect=AssertionError('storage read')):
+        resp = client.get(url.format(id=stored_file.id))
+
+    assert resp.status_code == 200
+    assert resp.data == b''
+    assert resp.headers['X-Accel-Redirect'] == f'/internal/media/{stored_file.storage_key}'
+    assert resp.headers['Content-Type'] == 'image/jpeg'
+    assert resp.headers['ETag'] == f'"{stored_file.file_hash}"'
+
+
+def test_x_sendfile_uses_absolute_path(app: Flask, client: FlaskClient, stored_file: File) -> None:
+    """X-Sendfile points at the absolute path of the stored object."""
+    app.config['MEDIA_SENDFILE_HEADER'] = 'X-Sendfile'
+
+    with patch('app.media.serving.send_file', side_effect=AssertionError('body sent')):
+        resp = client.get(f'/media/{stored_file.id}')
+
+    expected = os.path.abspath(os.path.join(app.config['STORAGE_LOCAL_PATH'], stored_file.storage_key))
+    assert resp.data == b''
+    assert resp.headers['X-Sendfile'] == expected
+
+
+# ---------------------------------------------------------------------------
+# Presigned S3 redirects
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def s3_file(app: Flask, mock_s3: None) -> File:
+    """Upload CONTENT to a moto-backed bucket and return its File row."""
+    file_obj = File(
+        original_filename='receipt.jpg',
+        storage_backend='s3',
+        storage_key=f'images/{uuid.uuid4().hex}.jpg',
+        mime_type='image/jpeg',
+        file_size=len(CONTENT),
+        file_hash=hashlib.sha256(CONTENT).hexdigest(),
+        hash_algorithm='sha256',
+    )
+    file_obj.get_provider().save(file_obj.storage_key, BytesIO(CONTENT), file_obj.mime_type)
+    db.session.add(file_obj)
+    db.session.commit()
+    return file_obj
+
+
+@pytest.mark.parametrize('url', ['/media/{id}', '/apis/media/files/{id}'])
+def test_s3_redirect_to_presigned_url(app: Flask, client: FlaskClient, s3_file: File, url: str) -> None:
+    """With MEDIA_S3_REDIRECT the app answers with a 302 to a working presigned URL."""
+    app.config['MEDIA_S3_REDIRECT'] = True
+    app.config['MEDIA_PRESIGNED_URL_TTL'] = 600
+
+    with patch('app.media.serving.open_file_stream', side_effect=AssertionError('bytes proxied')):
+        resp = client.get(url.format(id=s3_file.id))
+
+    assert resp.status_code == 302
+    location = resp.headers['Location']
+    assert s3_file.storage_key in location
+    assert 'Expires=' in location or 'X-Amz-Expires=600' in location
+    assert resp.cache_control.private
+    assert resp.cache_control.max_age == 120
+    assert requests.get(location).content == CONTENT
+
+
+def test_presigned_url_is_cached(app: Flask, client: FlaskClient, s3_file: File) -> None:
+    """A cached presigned URL is reused for most of its lifetime."""
+    app.config['MEDIA_S3_REDIRECT'] = True
+    app.config['MEDIA_PRESIGNED_URL_TTL'] = 600
+    store: dict[str, bytes] = {}
+    fake_redis = MagicMock()
+    fake_redis.get.side_effect = store.get
+    fake_redis.set.side_effect = lambda key, value, ex: store.__setitem__(key, value.encode())
+
+    with patch('app.services.media_service._get_redis_connection', return_value=fake_redis):
+        first = client.get(f'/media/{s3_file.id}').headers['Location']
+        with patch('app.storage.S3StorageProvider.get_presigned_url', side_effect=AssertionError('presigned again')):
+            second = client.get(f'/media/{s3_file.id}').headers['Location']
+
+    assert first == second
+    fake_redis.set.assert_called_once_with(f'media_presigned:{s3_file.id}', first, ex=480)
+
+
+def test_redirect_mode_keeps_local_files_in_app(app: Flask, client: FlaskClient, stored_file: File) -> None:
+    """Local files cannot be presigned and are still served by the app."""
+    app.config['MEDIA_S3_REDIRECT'] = True
+
+    resp = client.get(f'/media/{stored_file.id}')
+
+    assert resp.status_code == 200
+    assert resp.data == CONTENT
@@ -0,0 +1,148 @@
+# coding=utf-8
+"""Tests for the EXISTS-based membership helpers on Event and Expense."""
+
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask
+from sqlalchemy import event as sa_event
+
+from app import db
+from app.models import Currency, Event, EventUser, Expense, Settlement
+
+
+def _add_eventuser(event: Event, name: str) -> EventUser:
+    suffix = uuid.uuid4().hex[:8]
+    eu = EventUser(username=f'{name}_{suffix}', email=None, weighting=1.0, locale='en')
+    event.add_user(eu)
+    db.session.flush()
+    return eu
+
+
+@pytest.fixture
+def event(app: Flask, api_event: Event, api_second_currency: Currency) -> Event:
+    """Return the API event with EUR added and one expense paid by the admin."""
+    event = db.session.get(Event, api_event.id)
+    event.add_currency(db.session.get(Currency, api_second_currency.id))
+    admin = event.accountant
+    db.session.add(Expense(user=admin, event=event, currency=event.base_currency, amount=10.0,
+                           affected_users=[admin], date=datetime.now(timezone.utc)))
+    db.session.commit()
+    return event
+
+
+def _statements(func) -> list[str]:
+    """Run *func* and return the SQL statements it executed."""
+    statements: list[str] = []
+
+    def _record(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    sa_event.listen(db.engine, 'before_cursor_execute', _record)
+    try:
+        func()
+    finally:
+        sa_event.remove(db.engine, 'before_cursor_execute', _record)
+    return statements
+
+
+def test_has_user_and_currency(event: Event, api_second_currency: Currency) -> None:
+    """Membership checks agree with the collections."""
+    admin = event.accountant
+    stranger = EventUser(username=f'stranger_{uuid.uuid4().hex[:8]}', email=None, weighting=1.0, locale='en')
+    db.session.add(stranger)
+    db.session.flush()
+
+    assert event.has_user(admin)
+    assert not event.has_user(stranger)
+    assert event.has_currency(event.base_currency)
+    assert event.has_currency(db.session.get(Currency, api_second_currency.id))
+
+    expense = event.expenses.first()
+    assert expense.has_user(admin)
+    assert not expense.has_user(stranger)
+
+
+def test_membership_checks_do_not_load_collections(event: Event) -> None:
+    """has_user issues a single query regardless of the number of participants."""
+    for i in range(20):
+        _add_eventuser(event, f'member{i}')
+    admin = event.accountant
+
+    assert len(_statements(lambda: event.has_user(admin))) == 1
+
+
+def test_remove_user_blocked_by_expense_and_settlement(event: Event) -> None:
+    """Payers and settlement parties cannot be removed; others can."""
+    admin = event.accountant
+    alice = _add_eventuser(event, 'alice')
+    bob = _add_eventuser(event, 'bob')
+    db.session.add(Settlement(sender=alice, recipient=admin, event=event, currency=event.base_currency,
+                              amount=5.0, draft=True, date=datetime.now(timezone.utc)))
+    db.session.commit()
+
+    assert event.remove_user(admin) == 1
+    assert event.remove_user(alice) == 1
+    assert event.remove_user(bob) == 0
+    db.session.commit()
+    assert not event.has_user(bob)
+
+
+def test_remove_currency_blocked_by_base_and_usage(event: Event, api_second_currency: Currency) -> None:
+    """The base currency and currencies in use cannot be removed."""
+    eur = db.session.get(Currency, api_second_currency.id)
+    assert event.remove_currency(event.base_currency) == 1
+
+    expense = Expense(user=event.accountant, event=event, currency=eur, amount=1.0,
+                      affected_users=[], date=datetime.now(timezone.utc))
+    db.session.add(expense)
+    db.session.commit()
+    assert event.remove_currency(eur) == 1
+
+    db.session.delete(expense)
+    db.session.commit()
+    assert event.remove_currency(eur) == 0
+    db.session.commit()
+    assert not event.has_currency(eur)
+
+
+def test_add_users_is_a_single_insert(event: Event) -> None:
+    """Adding many participants is one INSERT … SELECT that skips existing pairs."""
+    users = [_add_eventuser(event, f'p{i}') for i in range(50)]
+    users.append(event.accountant)
+    expense = event.expenses.first()
+    db.session.commit()
+    for user in users + [expense]:
+        db.session.refresh(user)
+
+    statements = _statements(lambda: expense.add_users(users))
+    db.session.commit()
+
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith('INSERT')
+    assert expense.affected_users.count() == 51
+
+    # Re-adding is a no-op rather than a duplicate-key error
+    expense.add_users(users[:10])
+    db.session.commit()
+    assert expense.affected_users.count() == 51
+
+
+def test_add_users_is_visible_through_the_relationships(event: Event) -> None:
+    """Collections loaded before the bulk insert reflect it within the same session."""
+    newcomer = _add_eventuser(event, 'newcomer')
+    expense = event.expenses.first()
+    db.session.commit()
+    assert newcomer not in expense.affected_users.all()
+    assert expense not in newcomer.affected_by_expenses.all()
+
+    expense.add_users([newcomer, event.accountant])
+
+    assert newcomer in expense.affected_users.all()
+    assert expense in newcomer.affected_by_expenses.all()
+    assert expense.remove_user(newcomer) == 0
+    db.session.commit()
+    assert not expense.has_user(newcomer)
@@ -0,0 +1,89 @@
+# coding=utf-8
+"""Tests for storage listing and the orphan sweeper (``flask dbmaint sweep-orphans``)."""
+
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import db
+from app.cli import register
+from app.models import BackupSegment, BackupSet, File, User
+from app.services.storage_service import sweep_orphans
+from app.storage import get_storage_provider
+
+DAY = 24 * 3600
+
+
+def _put(app: Flask, storage_key: str, age: float = 2 * DAY) -> str:
+    """Write a local object whose mtime lies *age* seconds in the past."""
+    get_storage_provider('local').save(storage_key, BytesIO(b'data'))
+    path = os.path.join(app.config['STORAGE_LOCAL_PATH'], storage_key)
+    os.utime(path, (time.time() - age,) * 2)
+    return path
+
+
+def test_local_listing_walks_subdirectories(app: Flask) -> None:
+    provider = get_storage_provider('local')
+    for key in ('backups/a/users.json', 'backups/a/events/1.json', 'backups/b.json', 'static/img/x.jpg'):
+        provider.save(key, BytesIO(b'data'))
+
+    assert sorted(obj.storage_key for obj in provider.iter_objects('backups/')) == [
+        'backups/a/events/1.json', 'backups/a/users.json', 'backups/b.json',
+    ]
+    assert list(provider.iter_objects('missing')) == []
+
+
+def test_sweep_deletes_only_old_unreferenced_objects(app: Flask) -> None:
+    """Objects of files and backup segments, young objects and foreign paths survive."""
+    app.config['STORAGE_DEFAULT_BACKEND'] = 'local'
+    app.config['BACKUP_STORAGE_BACKEND'] = 'local'
+    img = app.config['IMAGE_IMG_PATH']
+    referenced = File('a.jpg', 'local', f'{img}/{uuid.uuid4().hex}.jpg', 'image/jpeg')
+    backup_set = BackupSet('nightly', 'full', 'local', 'backups/set', User.query.first())
+    segment = BackupSegment(backup_set, 'users')
+    segment.storage_key = 'backups/set/users.json'
+    db.session.add_all([referenced, backup_set, segment])
+    db.session.commit()
+
+    kept = [_put(app, referenced.storage_key), _put(app, segment.storage_key),
+            _put(app, f'{img}/young.jpg', age=60), _put(app, 'resources/not-media.csv')]
+    orphans = [_put(app, f'{img}/orphan.jpg'), _put(app, 'backups/deleted-set/users.json')]
+
+    register(app)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['dbmaint', 'sweep-orphans', '--backend', 'local'])
+    assert result.exit_code == 0, result.output
+    assert 'Orphans: 2 of 5 object(s)' in result.output
+    assert 'Dry-run: nothing deleted' in result.output
+    assert all(os.path.exists(path) for path in kept + orphans)
+
+    result = runner.invoke(args=['dbmaint', 'sweep-orphans', '--backend', 'local', '--delete', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert '2 deleted, 0 failed' in result.output and 'objects/s' in result.output
+    assert all(os.path.exists(path) for path in kept)
+    assert not any(os.path.exists(path) for path in orphans)
+
+
+def test_s3_sweep_pages_listing_and_batches_deletes(app: Flask, mock_s3: None) -> None:
+    """Listing follows ListObjectsV2 pages; orphans are removed 1,000 keys per DeleteObjects."""
+    provider = get_storage_provider('s3')
+    for i in range(1002):
+        provider.s3.put_object(Bucket=provider.bucket_name, Key=f'images/{i:04d}.jpg', Body=b'x')
+    file_obj = File('kept.jpg', 's3', 'images/0000.jpg', 'image/jpeg')
+    db.session.add(file_obj)
+    db.session.commit()
+
+    delete_objects = provider.s3.delete_objects
+    with patch.object(provider.s3, 'delete_objects', side_effect=delete_objects) as spy:
+        result = sweep_orphans('s3', 'images', min_age=timedelta(0))
+
+    assert (result.scanned, result.orphans, result.deleted, result.failed) == (1002, 1001, 1001, [])
+    assert [len(call.kwargs['Delete']['Objects']) for call in spy.call_args_list] == [1000, 1]
+    assert [obj.storage_key for obj in provider.iter_objects('images')] == ['images/0000.jpg']
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Tests for bulk thumbnail regeneration (``flask dbmaint regenerate-thumbnails``)."""
+
+from __future__ import annotations
+
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from PIL import Image as ImagePIL
+
+from app import db
+from app.cli import register
+from app.media.processor import (
+    create_thumbnail_variant,
+    create_thumbnails,
+    process_and_store_image,
+    regenerate_thumbnails,
+)
+from app.models import Image, Thumbnail
+
+
+def _upload(app: Flask) -> Image:
+    """Store a 600×400 JPEG with its JPEG thumbnails."""
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = []
+    img_io = BytesIO()
+    ImagePIL.new('RGB', (600, 400), color=tuple(uuid.uuid4().bytes[:3])).save(img_io, 'JPEG')
+    img_io.seek(0)
+    image = process_and_store_image(img_io, 'photo.jpg')
+    create_thumbnails(image)
+    db.session.commit()
+    return image
+
+
+def _pairs(image: Image) -> list[tuple[int, str, bool]]:
+    return sorted((t.size, t.format, bool(t.on_demand)) for t in image.thumbnails)
+
+
+@pytest.fixture
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def test_regenerate_follows_changed_sizes(app: Flask, executor: ProcessPoolExecutor) -> None:
+    """Outdated sizes and colliding variants are replaced; matching images are skipped."""
+    image = _upload(app)
+    create_thumbnail_variant(image, 50)
+    create_thumbnail_variant(image, 100)
+    db.session.commit()
+    removed_key = image.thumbnails.filter_by(size=256).one().file.storage_key
+
+    app.config['THUMBNAIL_SIZES'] = [50, 128, 700]
+    changed, failures = regenerate_thumbnails([image], executor)
+    db.session.commit()
+
+    assert (changed, failures) == (1, [])
+    assert _pairs(image) == [(50, 'JPEG', False), (100, 'JPEG', True), (128, 'JPEG', False)]
+    with ImagePIL.open(image.file.get_provider().get_file_stream(
+            image.thumbnails.filter_by(size=50).one().file.storage_key)) as thumb:
+        assert thumb.size == (50, 33)
+    with pytest.raises(OSError):
+        image.file.get_provider().get_file_stream(removed_key)
+
+    assert regenerate_thumbnails([image], executor) == (0, [])
+
+
+def test_regenerate_adds_formats(app: Flask, executor: ProcessPoolExecutor) -> None:
+    image = _upload(app)
+
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = ['WEBP']
+    changed, _failures = regenerate_thumbnails([image], executor)
+    db.session.commit()
+
+    assert changed == 1
+    assert image.thumbnails.filter_by(format='WEBP').count() == image.thumbnails.filter_by(format='JPEG').count() == 5
+
+
+def test_cli_resumes_from_checkpoint_and_reports_failures(app: Flask, tmp_path) -> None:
+    """The command starts after the checkpointed ID, reports throughput and failures, and exits 1."""
+    skipped = _upload(app)
+    image = _upload(app)
+    broken = _upload(app)
+    broken_id, image_id = broken.id, image.id
+    os.remove(os.path.join(app.config['STORAGE_LOCAL_PATH'], broken.file.storage_key))
+    checkpoint = tmp_path / 'checkpoint'
+    checkpoint.write_text(str(skipped.id))
+
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = ['WEBP']
+    register(app)
+    result = app.test_cli_runner().invoke(args=[
+        'dbmaint', 'regenerate-thumbnails', '--checkpoint', str(checkpoint), '--workers', '2', '--batch-size', '1',
+    ])
+
+    assert result.exit_code == 1, result.output
+    assert f'Resuming after image id {skipped.id}' in result.output
+    assert f'(id={broken_id})' in result.output
+    assert '1 image(s) updated' in result.output and '1 failed' in result.output
+    assert 'images/s' in result.output
+    assert not checkpoint.exists()
+    assert Thumbnail.query.filter_by(image_id=image_id, format='WEBP').count() == 5
+    assert Thumbnail.query.filter_by(image_id=skipped.id, format='WEBP').count() == 0
@@ -0,0 +1,67 @@
+# coding=utf-8
+"""Tests for the shared storage provider registry."""
+
+from __future__ import annotations
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+from app import storage
+from app.storage import LocalStorageProvider, S3StorageProvider, get_storage_provider
+
+
+def test_provider_is_created_once_per_backend(app: Flask) -> None:
+    """Repeated lookups return the same instance for each backend."""
+    local = get_storage_provider('local')
+    s3 = get_storage_provider('s3')
+
+    assert isinstance(local, LocalStorageProvider)
+    assert isinstance(s3, S3StorageProvider)
+    assert get_storage_provider('local') is local
+    assert get_storage_provider('s3') is s3
+
+
+def test_concurrent_lookups_share_one_provider(app: Flask) -> None:
+    """Threads racing on first use still build a single provider."""
+    create = storage._create_storage_provider
+    calls = []
+
+    def _slow_create(backend_name: str):
+        calls.append(backend_name)
+        time.sleep(0.05)
+        return create(backend_name)
+
+    results = []
+
+    def _lookup() -> None:
+        with app.app_context():
+            results.append(get_storage_provider('s3'))
+
+    with patch('app.storage._create_storage_provider', side_effect=_slow_create):
+        threads = [threading.Thread(target=_lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert calls == ['s3']
+    assert len({id(provider) for provider in results}) == 1
+
+
+def test_s3_client_uses_pool_and_retry_config(app: Flask) -> None:
+    """Pool size and retry policy are taken from the app config."""
+    app.config.update(S3_MAX_POOL_CONNECTIONS=32, S3_MAX_ATTEMPTS=5, S3_RETRY_MODE='adaptive')
+
+    client_config = get_storage_provider('s3').s3.meta.config
+
+    assert client_config.max_pool_connections == 32
+    assert client_config.retries == {'total_max_attempts': 5, 'mode': 'adaptive'}
+
+
+def test_unknown_backend_raises(app: Flask) -> None:
+    with pytest.raises(ValueError):
+        get_storage_provider('ftp')
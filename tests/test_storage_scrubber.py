@@ -0,0 +1,132 @@
+# coding=utf-8
+"""Tests for the storage integrity scrubber (``scrub_files``) and its rate limiter."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from flask import Flask
+
+from app import db
+from app.models import File
+from app.services import storage_service
+from app.services.storage_service import RateLimiter, scrub_files
+from app.storage import LocalStorageProvider
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def _stored_file(content: bytes, read_error: bool = False) -> File:
+    file_obj = File(
+        original_filename='receipt.pdf',
+        storage_backend='local',
+        storage_key=f'static/img/{uuid.uuid4().hex}.pdf',
+        mime_type='application/pdf',
+        file_size=len(content),
+        file_hash=hashlib.sha256(content).hexdigest(),
+        hash_algorithm='sha256',
+    )
+    file_obj.read_error = read_error
+    file_obj.get_provider().save(file_obj.storage_key, BytesIO(content))
+    db.session.add(file_obj)
+    db.session.commit()
+    return file_obj
+
+
+def test_scrub_flags_missing_and_corrupted_files(app: Flask, executor: ThreadPoolExecutor) -> None:
+    """Broken objects are flagged, repaired ones cleared, and the batch stops at *limit*."""
+    start = db.session.query(db.func.max(File.id)).scalar() or 0
+    healthy = _stored_file(b'healthy')
+    missing = _stored_file(b'missing')
+    corrupted = _stored_file(b'corrupted')
+    recovered = _stored_file(b'recovered', read_error=True)
+    beyond = _stored_file(b'next batch')
+    os.remove(missing.get_local_path())
+    with open(corrupted.get_local_path(), 'wb') as f:
+        f.write(b'bit rot')
+
+    result = scrub_files(start, 4, executor, RateLimiter(0), RateLimiter(0))
+
+    assert result.checked == 4 and result.last_id == recovered.id
+    assert (result.missing, result.corrupted, result.recovered) == ([missing.id], [corrupted.id], [recovered.id])
+    assert result.bytes_read == len(b'healthy') + len(b'bit rot') + len(b'recovered')
+    db.session.expire_all()
+    assert [f.read_error for f in (healthy, missing, corrupted, recovered, beyond)] == [
+        False, True, True, False, False,
+    ]
+    assert scrub_files(beyond.id, 4, executor, RateLimiter(0), RateLimiter(0)).checked == 0
+
+
+def test_shared_objects_are_read_once(app: Flask, executor: ThreadPoolExecutor) -> None:
+    start = db.session.query(db.func.max(File.id)).scalar() or 0
+    original = _stored_file(b'shared')
+    copy = File(original.original_filename, 'local', original.storage_key, original.mime_type,
+                original.file_size, original.file_hash)
+    db.session.add(copy)
+    db.session.commit()
+
+    result = scrub_files(start, 10, executor, RateLimiter(0), RateLimiter(0))
+
+    assert result.checked == 2 and result.bytes_read == len(b'shared')
+
+
+def test_transient_read_errors_are_retried(
+    app: Flask, executor: ThreadPoolExecutor, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """An error other than "not found" is retried and does not flag the file."""
+    monkeypatch.setattr(storage_service, 'SCRUB_RETRY_DELAY', 0)
+    start = db.session.query(db.func.max(File.id)).scalar() or 0
+    file_obj = _stored_file(b'flaky')
+    read = LocalStorageProvider.get_file_stream
+    failures = iter([TimeoutError('read timed out')])
+
+    def flaky(self, storage_key: str, start: int = 0):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return read(self, storage_key, start)
+
+    monkeypatch.setattr(LocalStorageProvider, 'get_file_stream', flaky)
+    result = scrub_files(start, 10, executor, RateLimiter(0), RateLimiter(0))
+
+    assert (result.checked, result.missing, result.corrupted) == (1, [], [])
+    db.session.expire_all()
+    assert not file_obj.read_error
+
+
+def test_persistent_read_errors_abort_without_flagging(
+    app: Flask, executor: ThreadPoolExecutor, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """A storage outage aborts the batch instead of marking its files unreadable."""
+    monkeypatch.setattr(storage_service, 'SCRUB_RETRY_DELAY', 0)
+    start = db.session.query(db.func.max(File.id)).scalar() or 0
+    files = [_stored_file(b'outage one'), _stored_file(b'outage two')]
+
+    def unavailable(self, storage_key: str, start: int = 0):
+        raise ConnectionError('storage unavailable')
+
+    monkeypatch.setattr(LocalStorageProvider, 'get_file_stream', unavailable)
+    with pytest.raises(ConnectionError):
+        scrub_files(start, 10, executor, RateLimiter(0), RateLimiter(0))
+
+    db.session.expire_all()
+    assert [f.read_error for f in files] == [False, False]
+
+
+def test_rate_limiter_throttles_shared_budget() -> None:
+    """Beyond the one-second burst, callers wait for the configured rate."""
+    limiter = RateLimiter(100)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire(40)
+    assert time.monotonic() - started == pytest.approx(1.0, abs=0.15)
@@ -7,20 +7,23 @@ from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from unittest.mock import MagicMock, patch
 
+import pytest
 from flask import Flask
 from PIL import Image as ImagePIL
 
 from sqlalchemy.exc import SQLAlchemyError
 
 from app import db
-from app.models import Currency, Event, EventUser, Log, Post, Task, User
+from app.models import Currency, Event, EventUser, File, Log, Post, Task, User
 from app.tasks import (
+    SCRUB_CHECKPOINT_KEY,
     _clean_session,
     _set_task_progress,
     clean_log,
     consume_time,
     export_posts,
     get_balance_pdf,
+    scrub_storage,
     type_error,
     update_rates_yahoo,
 )
@@ -87,6 +90,25 @@ def test_task_clean_log(app: Flask) -> None:
     assert deleted_log is None
 
 
+def test_task_scrub_storage_resumes_and_flags(app: Flask) -> None:
+    """The scrubber starts after its checkpoint, flags missing objects and clears the checkpoint when done."""
+    user = User.query.first()
+    checkpoint = db.session.query(db.func.max(File.id)).scalar() or 0
+    file_obj = File('gone.pdf', 'local', f'static/img/{uuid.uuid4().hex}.pdf', 'application/pdf', 1, 'ab' * 32)
+    db.session.add(file_obj)
+    db.session.commit()
+    file_id = file_obj.id
+    fake_redis = pytest.importorskip('fakeredis').FakeRedis()
+    fake_redis.set(SCRUB_CHECKPOINT_KEY, checkpoint)
+
+    with patch('app.tasks.app.redis', fake_redis):
+        scrub_storage(user.guid)
+
+    assert db.session.get(File, file_id).read_error is True
+    assert fake_redis.get(SCRUB_CHECKPOINT_KEY) is None
+    assert Log.query.filter_by(msg_type='scrub_storage').count() > 0
+
+
 @patch('app.tasks.YahooFinancials')
 def test_task_update_rates_yahoo(mock_yahoo: MagicMock, app: Flask) -> None:
     """Test that the Yahoo currency updater processes data correctly without making real API calls."""
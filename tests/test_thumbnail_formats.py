@@ -0,0 +1,131 @@
+# coding=utf-8
+"""Tests for WebP/AVIF thumbnail encodings and ``Accept`` negotiation."""
+
+from __future__ import annotations
+
+import uuid
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from PIL import Image as ImagePIL
+
+from app import db
+from app.cli import register
+from app.media.processor import create_thumbnails, process_and_store_image
+from app.models import Image, Thumbnail
+from app.services.media_service import get_file_alternatives
+
+WEBP_ACCEPT = 'image/avif;q=0,image/webp,image/apng,image/*,*/*;q=0.8'
+
+
+def _upload(app: Flask) -> Image:
+    """Store a 600×400 JPEG with its thumbnails."""
+    img_io = BytesIO()
+    ImagePIL.new('RGB', (600, 400), color=tuple(uuid.uuid4().bytes[:3])).save(img_io, 'JPEG')
+    img_io.seek(0)
+    image = process_and_store_image(img_io, 'photo.jpg')
+    create_thumbnails(image)
+    db.session.commit()
+    return image
+
+
+@pytest.fixture
+def image(app: Flask) -> Image:
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = ['WEBP']
+    return _upload(app)
+
+
+def _thumbnail(image: Image, size: int, fmt: str) -> Thumbnail:
+    return image.thumbnails.filter_by(size=size, format=fmt).one()
+
+
+def test_alternate_encodings_are_stored(image: Image) -> None:
+    """Every thumbnail size gets a WebP sibling; lookups only see the primary format."""
+    sizes = {fmt: sorted(s for s, f in image.thumbnails.with_entities(Thumbnail.size, Thumbnail.format) if f == fmt)
+             for fmt in ('JPEG', 'WEBP')}
+    assert sizes['JPEG'] == [32, 64, 128, 256, 512]
+    assert sizes['WEBP'] == sizes['JPEG']
+
+    webp = _thumbnail(image, 128, 'WEBP')
+    assert webp.file.mime_type == 'image/webp'
+    assert webp.file.storage_key.endswith('_128.webp')
+    assert image.get_thumbnail(100).format == 'JPEG'
+
+
+def test_webp_default_format_is_primary(app: Flask) -> None:
+    """With ``IMAGE_DEFAULT_FORMAT=WEBP`` the WebP thumbnails are the primary encoding, not alternates."""
+    app.config['IMAGE_DEFAULT_FORMAT'] = 'WEBP'
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = []
+    image = _upload(app)
+
+    thumbnail = image.get_thumbnail(100)
+    assert thumbnail is not None and thumbnail.format == 'WEBP'
+    assert image.thumbnails.filter(Thumbnail.is_primary()).count() == 5
+    assert get_file_alternatives(thumbnail.file) == {}
+
+
+@pytest.mark.parametrize('url', ['/media/{id}', '/apis/media/files/{id}'])
+def test_accept_header_selects_webp(client: FlaskClient, image: Image, url: str) -> None:
+    """Clients listing image/webp get the WebP encoding behind the JPEG thumbnail's URL."""
+    jpeg = _thumbnail(image, 128, 'JPEG')
+    webp = _thumbnail(image, 128, 'WEBP')
+
+    resp = client.get(url.format(id=jpeg.file_id), headers={'Accept': WEBP_ACCEPT})
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/webp'
+    assert resp.headers['ETag'] == f'"{webp.file.file_hash}"'
+    assert 'Accept' in resp.vary
+    with ImagePIL.open(BytesIO(resp.data)) as served:
+        assert served.format == 'WEBP'
+
+
+@pytest.mark.parametrize('accept', [None, '*/*', 'image/*', 'image/webp;q=0'])
+def test_generic_accept_gets_primary_format(client: FlaskClient, image: Image, accept: str | None) -> None:
+    """Wildcards do not imply WebP support; the JPEG is served and still varies on Accept."""
+    jpeg = _thumbnail(image, 128, 'JPEG')
+    headers = {'Accept': accept} if accept else {}
+
+    resp = client.get(f'/media/{jpeg.file_id}', headers=headers)
+
+    assert resp.mimetype == 'image/jpeg'
+    assert resp.headers['ETag'] == f'"{jpeg.file.file_hash}"'
+    assert 'Accept' in resp.vary
+
+
+def test_not_modified_per_encoding(client: FlaskClient, image: Image) -> None:
+    """Revalidation compares against the ETag of the negotiated encoding."""
+    jpeg = _thumbnail(image, 128, 'JPEG')
+    webp = _thumbnail(image, 128, 'WEBP')
+
+    resp = client.get(f'/media/{jpeg.file_id}',
+                      headers={'Accept': WEBP_ACCEPT, 'If-None-Match': f'"{webp.file.file_hash}"'})
+    assert resp.status_code == 304
+    assert 'Accept' in resp.vary
+
+    stale = client.get(f'/media/{jpeg.file_id}', headers={'If-None-Match': f'"{webp.file.file_hash}"'})
+    assert stale.status_code == 200
+
+
+def test_originals_do_not_vary(client: FlaskClient, image: Image) -> None:
+    resp = client.get(f'/media/{image.file_id}', headers={'Accept': WEBP_ACCEPT})
+
+    assert resp.mimetype == 'image/jpeg'
+    assert 'Accept' not in resp.vary
+
+
+def test_backfill_command_adds_missing_formats(app: Flask) -> None:
+    """Images created before WebP was enabled get their WebP thumbnails from the CLI backfill."""
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = []
+    image = _upload(app)
+    assert image.thumbnails.filter_by(format='WEBP').count() == 0
+
+    app.config['THUMBNAIL_ALTERNATE_FORMATS'] = ['WEBP']
+    register(app)
+    result = app.test_cli_runner().invoke(args=['dbmaint', 'backfill-thumbnail-formats'])
+
+    assert result.exit_code == 0, result.output
+    assert image.thumbnails.filter_by(format='WEBP').count() == 5
+    assert image.thumbnails.filter_by(format='JPEG').count() == 5
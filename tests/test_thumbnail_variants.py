@@ -0,0 +1,144 @@
+# coding=utf-8
+"""Tests for on-demand thumbnail variants (``/media/<file_id>/w/<width>``)."""
+
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from PIL import Image as ImagePIL
+
+from app import db
+from app.media.processor import create_thumbnails, evict_idle_thumbnail_variants, process_and_store_image
+from app.models import Image, Thumbnail
+from app.thumbnails import resolve_thumbnail_url
+
+
+def _variants(image: Image) -> list[Thumbnail]:
+    return image.thumbnails.filter(Thumbnail.on_demand.is_(True)).order_by(Thumbnail.size).all()
+
+
+@pytest.fixture(autouse=True)
+def variants_enabled(app: Flask) -> None:
+    app.config['THUMBNAIL_VARIANTS'] = True
+    app.config['THUMBNAIL_VARIANT_SIZES'] = [96, 160, 192, 224]
+
+
+@pytest.fixture
+def image(app: Flask) -> Image:
+    """A 600×400 JPEG with its upload-time thumbnails."""
+    img_io = BytesIO()
+    ImagePIL.new('RGB', (600, 400), color=tuple(uuid.uuid4().bytes[:3])).save(img_io, 'JPEG')
+    img_io.seek(0)
+    image = process_and_store_image(img_io, 'photo.jpg')
+    create_thumbnails(image)
+    db.session.commit()
+    return image
+
+
+@pytest.mark.parametrize('url', ['/media/{id}/w/{w}', '/apis/media/files/{id}/w/{w}'])
+def test_variant_is_generated_once(client: FlaskClient, image: Image, url: str) -> None:
+    """The first request stores a variant; later requests serve the stored copy."""
+    resp = client.get(url.format(id=image.file_id, w=96))
+    assert resp.status_code == 200
+    with ImagePIL.open(BytesIO(resp.data)) as served:
+        assert served.size == (96, 64)
+
+    [variant] = _variants(image)
+    assert variant.size == 96
+    assert variant.last_accessed_at is not None
+
+    again = client.get(url.format(id=image.file_id, w=96))
+    assert again.data == resp.data
+    assert len(_variants(image)) == 1
+
+
+def test_upload_sizes_and_originals_are_reused(client: FlaskClient, image: Image) -> None:
+    """Existing thumbnail sizes and sizes beyond the original create no variants."""
+    assert client.get(f'/media/{image.file_id}/w/256').status_code == 200
+    original = client.get(f'/media/{image.file_id}/w/1024')
+
+    assert original.data == client.get(f'/media/{image.file_id}').data
+    assert _variants(image) == []
+
+
+def test_unlisted_widths_are_refused(client: FlaskClient, image: Image) -> None:
+    """Only configured sizes are generated, so cycling widths cannot create or evict variants."""
+    statuses = {client.get(f'/media/{image.file_id}/w/{width}').status_code for width in range(65, 96)}
+
+    assert statuses == {404}
+    assert _variants(image) == []
+
+
+def test_endpoint_is_disabled_without_thumbnail_variants(app: Flask, client: FlaskClient, image: Image) -> None:
+    app.config['THUMBNAIL_VARIANTS'] = False
+    assert client.get(f'/media/{image.file_id}/w/96').status_code == 404
+    assert client.get(f'/apis/media/files/{image.file_id}/w/96').status_code == 404
+    assert _variants(image) == []
+
+
+def test_upload_size_requested_early_is_not_on_demand(client: FlaskClient) -> None:
+    """A standard size generated before the thumbnail job is kept as a regular thumbnail."""
+    img_io = BytesIO()
+    ImagePIL.new('RGB', (600, 400), color=tuple(uuid.uuid4().bytes[:3])).save(img_io, 'JPEG')
+    img_io.seek(0)
+    image = process_and_store_image(img_io, 'photo.jpg')
+    db.session.commit()
+
+    assert client.get(f'/media/{image.file_id}/w/128').status_code == 200
+    assert _variants(image) == []
+
+    create_thumbnails(image)
+    db.session.commit()
+    assert image.thumbnails.filter_by(size=128, format='JPEG').count() == 1
+
+
+@pytest.mark.parametrize('width', [0, 100, 5000])
+def test_invalid_requests_return_404(client: FlaskClient, image: Image, width: int) -> None:
+    assert client.get(f'/media/{image.file_id}/w/{width}').status_code == 404
+    assert client.get('/media/999999/w/64').status_code == 404
+
+
+def test_variant_cap_evicts_least_recently_used(app: Flask, client: FlaskClient, image: Image) -> None:
+    """Beyond the per-image cap the least recently used variant and its object are deleted."""
+    app.config['THUMBNAIL_VARIANTS_PER_IMAGE'] = 2
+    client.get(f'/media/{image.file_id}/w/224')
+    client.get(f'/media/{image.file_id}/w/192')
+    oldest, newer = sorted(_variants(image), key=lambda t: t.size, reverse=True)
+    oldest.last_accessed_at = datetime.now(timezone.utc) - timedelta(days=1)
+    db.session.commit()
+    oldest_key = oldest.file.storage_key
+
+    client.get(f'/media/{image.file_id}/w/160')
+
+    assert [t.size for t in _variants(image)] == [160, 192]
+    assert db.session.get(Thumbnail, newer.id) is not None
+    with pytest.raises(OSError):
+        image.file.get_provider().get_file_stream(oldest_key)
+
+
+def test_idle_variants_are_evicted(client: FlaskClient, image: Image) -> None:
+    """The eviction job removes idle variants and leaves upload-time thumbnails alone."""
+    thumbnails_before = image.thumbnails.filter(Thumbnail.on_demand.isnot(True)).count()
+    client.get(f'/media/{image.file_id}/w/160')
+    client.get(f'/media/{image.file_id}/w/192')
+    idle = next(t for t in _variants(image) if t.size == 192)
+    idle.last_accessed_at = datetime.now(timezone.utc) - timedelta(days=60)
+    db.session.commit()
+
+    assert evict_idle_thumbnail_variants(30) == 1
+    db.session.commit()
+
+    assert [t.size for t in _variants(image)] == [160]
+    assert image.thumbnails.filter(Thumbnail.on_demand.isnot(True)).count() == thumbnails_before
+
+
+def test_avatar_urls_point_at_variants(app: Flask, image: Image) -> None:
+    """With THUMBNAIL_VARIANTS enabled, sizes without an exact thumbnail link to the next served size."""
+    with app.test_request_context():
+        assert resolve_thumbnail_url(image.id, 70) == f'/media/{image.file_id}/w/96'
+        assert resolve_thumbnail_url(image.id, 64) == image.thumbnails.filter_by(size=64, format='JPEG').one().get_url()
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""Tests for the cached thumbnail resolution index (:mod:`app.thumbnails`)."""
+
+from __future__ import annotations
+
+import uuid
+
+import pytest
+from flask import Flask
+from sqlalchemy import event as sa_event
+
+from app import db
+from app.models import File, Image, Thumbnail
+from app.thumbnails import (
+    get_thumbnail_index,
+    invalidate_thumbnail_index,
+    resolve_thumbnail_url,
+    resolve_thumbnail_urls,
+)
+
+
+def _make_file() -> File:
+    file_obj = File(
+        original_filename='pic.jpg',
+        storage_backend='local',
+        storage_key=f'img/{uuid.uuid4().hex}.jpg',
+        mime_type='image/jpeg',
+        file_size=1,
+    )
+    db.session.add(file_obj)
+    db.session.flush()
+    return file_obj
+
+
+def _make_image(sizes: list[int], is_vector: bool = False) -> Image:
+    """Persist an image with one thumbnail per entry of *sizes*."""
+    image = Image(file_obj=_make_file(), is_vector=is_vector, width=4000, height=3000)
+    db.session.add(image)
+    db.session.flush()
+    for size in sizes:
+        db.session.add(Thumbnail(image=image, size=size, file_obj=_make_file()))
+    db.session.commit()
+    return image
+
+
+def _legacy_thumbnail_url(image: Image, size: int) -> str:
+    """The per-image resolution the index replaces."""
+    thumbnail = image.get_thumbnail(size)
+    return thumbnail.get_url() if thumbnail else image.get_url()
+
+
+class _StatementCounter:
+    """Count SQL statements executed while active."""
+
+    def __enter__(self) -> _StatementCounter:
+        self.count = 0
+        sa_event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        sa_event.remove(db.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, *args: object) -> None:
+        self.count += 1
+
+
+@pytest.fixture
+def images(app: Flask) -> list[Image]:
+    """Return raster images with and without thumbnails, and a vector image."""
+    return [
+        _make_image([512, 64, 256]),
+        _make_image([]),
+        _make_image([32]),
+        _make_image([128, 1024], is_vector=True),
+    ]
+
+
+def test_resolve_matches_per_image_lookup(app: Flask, images: list[Image]) -> None:
+    """Bulk resolution picks the same file as Image.get_thumbnail for every size."""
+    with app.test_request_context():
+        for size in (16, 64, 100, 256, 600):
+            urls = resolve_thumbnail_urls([image.id for image in images], size)
+            assert urls == {image.id: _legacy_thumbnail_url(image, size) for image in images}
+
+
+def test_resolve_loads_all_images_in_one_query(app: Flask, images: list[Image]) -> None:
+    """Index misses for any number of images cost a single query; hits cost none."""
+    image_ids = [image.id for image in images]
+    invalidate_thumbnail_index(*image_ids)
+
+    with app.test_request_context():
+        with _StatementCounter() as cold:
+            resolve_thumbnail_urls(image_ids, 64)
+        with _StatementCounter() as warm:
+            for image in images:
+                resolve_thumbnail_url(image.id, 64)
+
+    assert cold.count == 1
+    assert warm.count == 0
+
+
+def test_index_entries_are_sorted_by_size(app: Flask, images: list[Image]) -> None:
+    """Thumbnails are cached as (size, file_id) pairs in ascending size."""
+    entry = get_thumbnail_index([images[0].id])[images[0].id]
+    assert [size for size, _file_id in entry.thumbnails] == [64, 256, 512]
+    assert entry.file_id == images[0].file_id
+
+
+def test_invalidate_picks_up_new_thumbnails(app: Flask, images: list[Image]) -> None:
+    """New thumbnails become visible once the image's entry is invalidated."""
+    image = images[1]
+    with app.test_request_context():
+        assert resolve_thumbnail_url(image.id, 64) == image.get_url()
+
+        thumbnail = Thumbnail(image=image, size=128, file_obj=_make_file())
+        db.session.add(thumbnail)
+        db.session.commit()
+        assert resolve_thumbnail_url(image.id, 64) == image.get_url()
+
+        invalidate_thumbnail_index(image.id)
+        assert resolve_thumbnail_url(image.id, 64) == thumbnail.get_url()
+
+
+def test_invalidation_is_repeated_after_commit(app: Flask, images: list[Image]) -> None:
+    """An entry a concurrent reader caches before the commit is dropped once the transaction ends."""
+    image = images[1]
+    stale = get_thumbnail_index([image.id])[image.id]
+
+    thumbnail = Thumbnail(image=image, size=128, file_obj=_make_file())
+    db.session.add(thumbnail)
+    db.session.flush()
+    invalidate_thumbnail_index(image.id)
+    # A reader in another transaction still sees the old rows and caches them
+    app.extensions['thumbnail_index'].put(image.id, stale, 60)
+    db.session.commit()
+
+    assert get_thumbnail_index([image.id])[image.id].thumbnails == ((128, thumbnail.file_id),)
+
+
+def test_unknown_image_resolves_to_empty(app: Flask) -> None:
+    """Ids without an image row are omitted rather than cached."""
+    with app.test_request_context():
+        assert resolve_thumbnail_urls([-1], 64) == {}
+        assert resolve_thumbnail_url(-1, 64) == ''
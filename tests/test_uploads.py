@@ -2,11 +2,21 @@
 """Tests for file upload endpoints: profile picture processing and storage."""
 from __future__ import annotations
 
+import hashlib
+import tracemalloc
+import uuid
 from io import BytesIO
+from unittest.mock import patch
 
+import pytest
+from flask import Flask
 from flask.testing import FlaskClient
 from PIL import Image
 
+from app import db
+from app.media.processor import _render_thumbnails, create_thumbnails, process_and_store_image
+from app.models import Thumbnail, User
+
 
 def test_upload_profile_picture(auth_client: FlaskClient) -> None:
     """Test that uploading a profile picture processes and saves the file."""
@@ -22,4 +32,93 @@ def test_upload_profile_picture(auth_client: FlaskClient) -> None:
     }, follow_redirects=True)
 
     assert response.status_code == 200
-    assert b"Your changes have been saved." in response.data
\ No newline at end of file
+    assert b"Your changes have been saved." in response.data
+
+def _upload_profile_picture(auth_client: FlaskClient, size: tuple[int, int] = (300, 200)) -> User:
+    """Upload a uniquely coloured JPEG as profile picture; return the test user."""
+    color = tuple(uuid.uuid4().bytes[:3])
+    img_io = BytesIO()
+    Image.new('RGB', size, color=color).save(img_io, 'JPEG')
+    img_io.seek(0)
+    auth_client.post('/edit_profile_picture', data={'image': (img_io, 'photo.jpg')}, follow_redirects=True)
+    return User.query.filter_by(username='testuser').first()
+
+
+def test_upload_enqueues_thumbnails(app: Flask, auth_client: FlaskClient) -> None:
+    """Uploads only store the original and leave thumbnails to the task queue."""
+    with patch.object(app.task_queue, 'enqueue') as enqueue:
+        user = _upload_profile_picture(auth_client)
+
+    image = user.profile_picture
+    enqueue.assert_called_once_with('app.tasks.generate_thumbnails', image.id, str(user.guid))
+    assert image.thumbnails.count() == 0
+    with app.test_request_context():
+        assert image.get_thumbnail_url(64) == image.get_url()
+
+
+def test_create_thumbnails_notifies_and_is_idempotent(app: Flask, auth_client: FlaskClient) -> None:
+    """The worker side creates every size below the original once and notifies the uploader."""
+    with patch.object(app.task_queue, 'enqueue'):
+        user = _upload_profile_picture(auth_client)
+    image = user.profile_picture
+
+    create_thumbnails(image, notify=user)
+    db.session.commit()
+    assert create_thumbnails(image) == []
+
+    sizes = sorted(t.size for t in image.thumbnails.filter(Thumbnail.is_primary()))
+    assert sizes == [s for s in app.config['THUMBNAIL_SIZES'] if s < 300]
+    notification = user.notifications.filter_by(name='thumbnails_ready').one()
+    assert notification.get_data() == {'image_guid': str(image.guid), 'sizes': sizes}
+    with app.test_request_context():
+        assert image.get_thumbnail_url(64) == image.get_thumbnail(64).get_url()
+
+
+def test_thumbnails_generated_inline_when_queue_unavailable(app: Flask, auth_client: FlaskClient) -> None:
+    """If the job cannot be enqueued the upload still ends up with thumbnails."""
+    with patch.object(app.task_queue, 'enqueue', side_effect=ConnectionError('redis down')):
+        user = _upload_profile_picture(auth_client)
+
+    assert user.profile_picture.thumbnails.count() > 0
+
+
+@pytest.mark.parametrize('mode, fmt', [('RGB', 'JPEG'), ('RGBA', 'PNG')])
+def test_cascaded_thumbnails_match_direct_resize(mode: str, fmt: str) -> None:
+    """Deriving each size from the previous one keeps the dimensions of a direct resize."""
+    original = Image.new(mode, (1500, 1000), color=(200, 100, 50, 128)[:len(mode)])
+    buf = BytesIO()
+    original.save(buf, fmt)
+
+    rendered = _render_thumbnails(buf.getvalue(), [64, 1024, 256], ['JPEG'])
+
+    assert [size for size, _fmt, _data, _mode in rendered] == [1024, 256, 64]
+    for size, _fmt, data, thumb_mode in rendered:
+        expected = original.copy()
+        expected.thumbnail((size, size))
+        with Image.open(BytesIO(data)) as thumb:
+            assert thumb.format == 'JPEG'
+            assert thumb.size == expected.size
+        assert thumb_mode == 'RGB'
+
+
+def test_ingestion_memory_is_bounded(app: Flask) -> None:
+    """Large uploads are spooled to disk; peak allocations stay near the spool threshold."""
+    app.config['UPLOAD_SPOOL_MAX_MEMORY'] = 256 * 1024
+    img_io = BytesIO()
+    Image.effect_noise((2000, 2000), 100).convert('RGB').save(img_io, 'PNG')
+    data = img_io.getvalue()
+    assert len(data) > 8 * 1024 * 1024
+
+    img_io.seek(0)
+    tracemalloc.start()
+    try:
+        image = process_and_store_image(img_io, 'noise.png')
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 2 * 1024 * 1024
+    assert image.file.file_hash == hashlib.sha256(data).hexdigest()
+    assert image.file.file_size == len(data)
+    assert (image.width, image.height, image.format) == (2000, 2000, 'PNG')
+    assert image.file.get_provider().get_file_stream(image.file.storage_key).read() == data